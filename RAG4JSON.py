@@ -1,73 +1,235 @@
-import json
 import os
 import argparse
-from tqdm import tqdm
 from collections import Counter
-from typing import List, Dict, Any
-from rag_utils import Retriever, detect_language, separate_by_language
+from typing import List, Dict, Any, Callable, Optional
+import json_io
+from metrics import get_metrics
+from records import Sample, load_samples
 
-def load_json_or_jsonl(path: str) -> List[Dict[Any, Any]]:
-    """加载 JSON 或 JSONL 文件"""
+def load_json_or_jsonl(path: str, compact: bool = False) -> List[Dict[Any, Any]]:
+    """加载 JSON / JSONL / RCOL 文件；compact=True 时返回 records.Sample（标签驻留为整数 id）"""
     assert os.path.exists(path), f"File not found: {path}"
-    if path.endswith(".json"):
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    elif path.endswith(".jsonl"):
-        with open(path, "r", encoding="utf-8") as f:
-            data = [json.loads(line) for line in f]
-    else:
-        raise ValueError(f"Unsupported file type: {path}")
+    data = load_samples(path) if compact else json_io.load_json_or_jsonl(path)
     print(f"加载完成 {path}, 样本数: {len(data)}")
     return data
 
+def _is_empty(sample: Dict[Any, Any], key: str) -> bool:
+    if key == "output" and isinstance(sample, Sample):
+        return sample.is_empty_output()
+    value = sample.get(key)
+    return isinstance(value, list) and len(value) == 0
+
 def filter_empty_outputs(samples: List[Dict[Any, Any]], key: str = "output") -> List[Dict[Any, Any]]:
     """过滤掉指定字段为空列表的样本"""
     before = len(samples)
-    filtered = [s for s in samples if not (isinstance(s.get(key), list) and len(s.get(key)) == 0)]
+    filtered = [s for s in samples if not _is_empty(s, key)]
     after = len(filtered)
     print(f"   🔎 已过滤掉 {before - after} 条 {key} 为空的样本，剩余 {after} 条。")
     return filtered
 
-def main():
+def _kb_position_resolver(combined_kb: List[Dict[Any, Any]]) -> Callable[[Dict[Any, Any]], int]:
+    """
+    相似样本 → 在知识库文件中的行号：优先按对象身份对应；
+    检索器返回副本时（如 kb_index 中的样本）按内容 hash 对应，hash 表按需构建
+    """
+    from kb_index import content_hash
+
+    by_identity = {id(sample): i for i, sample in enumerate(combined_kb)}
+    by_hash = {}
+
+    def kb_position(ex):
+        pos = by_identity.get(id(ex))
+        if pos is not None and combined_kb[pos] is ex:
+            return pos
+        if not by_hash:
+            by_hash.update((content_hash(sample), i) for i, sample in enumerate(combined_kb))
+        return by_hash[content_hash(ex)]
+
+    return kb_position
+
+def main(argv: Optional[List[str]] = None):
     parser = argparse.ArgumentParser(description="基于向量检索的样本增强 (仅需合并知识库)")
-    parser.add_argument("--knowledge_base_path", type=str, required=True, help="合并后的中英文知识库路径 (.json/.jsonl)")
-    parser.add_argument("--data_path", type=str, required=True, help="待增强数据路径 (.json/.jsonl)")
-    parser.add_argument("--output_path", type=str, required=True, help="增强结果输出路径 (.json)")
+    parser.add_argument("--knowledge_base_path", type=str, required=True, help="合并后的中英文知识库路径 (.json/.jsonl/.rcol)")
+    parser.add_argument("--data_path", type=str, required=True, help="待增强数据路径 (.json/.jsonl/.rcol)")
+    parser.add_argument("--output_path", type=str, required=True, help="增强结果输出路径 (.json/.rcol)")
     parser.add_argument("--text_key", type=str, default="input", help="用于检索的文本字段")
     parser.add_argument("--similarity_threshold", type=float, default=0.5, help="相似度阈值")
-    args = parser.parse_args()
+    parser.add_argument("--near_dup_threshold", type=float, default=0.8,
+                        help="MinHash 近重复阈值，与 query 近重复的知识库样本视为自身排除；<=0 关闭")
+    parser.add_argument("--retriever_backend", choices=["rag_utils", "dense"], default="rag_utils",
+                        help="rag_utils: 原检索器；dense: 仓库内稠密检索，可配合 --embedding_cache")
+    parser.add_argument("--encoder_model", type=str, default=None, help="dense 后端的编码模型")
+    parser.add_argument("--embedding_cache", type=str, default=None,
+                        help="dense 后端的句向量缓存目录，KB 与 query 共用，跨运行复用")
+    parser.add_argument("--device", type=str, default=None, help="dense 后端的编码设备")
+    parser.add_argument("--encoder_runtime", choices=["torch", "onnx", "onnx-int8"], default="torch",
+                        help="dense 后端的编码运行时：onnx / onnx-int8 使用 encoder_runtime.py export 导出的 CPU 图")
+    parser.add_argument("--onnx_dir", type=str, default=None, help="encoder_runtime.py export 的输出目录")
+    parser.add_argument("--encoder_threads", type=int, default=None, help="编码的 intra-op 线程数（默认 CPU 核数）")
+    parser.add_argument("--selection", choices=["greedy", "mmr"], default="greedy",
+                        help="greedy: 按相似度取 1 个非空 + 1 个空；mmr: 带平衡与关系覆盖约束的 MMR")
+    parser.add_argument("--k", type=int, default=2, help="mmr 模式下每条样本选取的示例数")
+    parser.add_argument("--top_k", type=int, default=20, help="每条 query 检索的候选数")
+    parser.add_argument("--mmr_lambda", type=float, default=0.7, help="MMR 相关性权重 λ，越小越强调多样性")
+    parser.add_argument("--coverage_weight", type=float, default=0.3, help="query schema 关系覆盖增益的权重")
+    parser.add_argument("--batch_size", type=int, default=256, help="批量选择的 query 数")
+    parser.add_argument("--no_cross_lingual", action="store_true",
+                        help="dense 后端默认在语言分区内无候选时回退到跨语言候选；加此参数关闭回退")
+    parser.add_argument("--store_neighbor_ids", action="store_true",
+                        help="只写入相似样本在知识库文件中的行号 similar_ids，转换时用 --kb_path 还原")
+    parser.add_argument("--kb_index", type=str, default=None,
+                        help="增量知识库索引目录 (kb_index.py)；给出时与知识库文件增量同步而不是全量重建，隐含 dense 后端")
+    parser.add_argument("--quantization", choices=["none", "int8", "binary"], default="none",
+                        help="dense 后端第一遍扫描的向量量化（int8 / 二值符号位），候选再用 float32 精确重排；"
+                             "配合 --embedding_cache 时 float32 向量不常驻内存；隐含 dense 后端")
+    parser.add_argument("--rerank_oversample", type=int, default=None,
+                        help="量化检索的候选倍数：取 top_k × N 个候选精确重排（默认 int8 为 4，binary 为 10）")
+    parser.add_argument("--records", choices=["compact", "dict"], default="compact",
+                        help="compact: 样本以 records.Sample 驻留内存（relation/类型/source/语言为整数 id）；dict: 原始 dict")
+    args = parser.parse_args(argv)
+    metrics = get_metrics("RAG4JSON")
+
+    # 重依赖（向量模型 / numpy / tqdm）在参数解析之后再导入，--help 与参数错误时不付出导入开销
+    from tqdm import tqdm
+    from near_dup import NearDupIndex, normalize_text
+    from selection import greedy_select, is_empty_output
+
+    encoder = None
+    # dense 后端使用一个带语言分区的统一索引（DenseRetriever 或 KBIndex），rag_utils 后端为中英文各一个检索器
+    unified = None
+    if args.kb_index or args.quantization != "none" or args.encoder_runtime != "torch":
+        args.retriever_backend = "dense"
+    if args.retriever_backend == "dense":
+        from retrieval import (
+            DEFAULT_ENCODER, DenseRetriever, build_encoder, detect_language, encoder_key, separate_by_language,
+        )
+
+        encoder = build_encoder(
+            args.encoder_model or DEFAULT_ENCODER, cache_dir=args.embedding_cache, device=args.device,
+            runtime=args.encoder_runtime, onnx_dir=args.onnx_dir, threads=args.encoder_threads,
+        )
+    else:
+        from rag_utils import Retriever, detect_language, separate_by_language
+
+    with metrics.stage("load_kb") as st:
+        print(f"\n📚 加载合并知识库: {args.knowledge_base_path}")
+        combined_kb = load_json_or_jsonl(args.knowledge_base_path, compact=args.records == "compact")
+        print(f"   样本总数: {len(combined_kb)}")
+        st.rows = len(combined_kb)
+
+    kb_index = None
+    if args.kb_index:
+        from kb_index import KBIndex
+
+        # 只对新增/修改的样本做语言检测和编码，删除的样本打墓碑
+        with metrics.stage("sync_index") as st:
+            print(f"\n🔄 增量同步知识库索引: {args.kb_index}")
+            kb_index = KBIndex(args.kb_index, encoder=encoder,
+                               model_name=encoder_key(args.encoder_model or DEFAULT_ENCODER, args.encoder_runtime),
+                               text_key=args.text_key, quantization=args.quantization,
+                               oversample=args.rerank_oversample)
+            added, removed = kb_index.sync(filter_empty_outputs(combined_kb, key="output"), detect_language)
+            unified = kb_index
+            kb_samples_zh = [kb_index.get(i) for i in kb_index.ids_by_lang("zh")]
+            kb_samples_en = [kb_index.get(i) for i in kb_index.ids_by_lang("en")]
+            kb_samples_other = [kb_index.get(i) for i in kb_index.ids_by_lang("other")]
+            print(f"   ✅ 新增 {len(added)} 条，删除 {len(removed)} 条；"
+                  f"中文 {len(kb_samples_zh)} 条，英文 {len(kb_samples_en)} 条，其他 {len(kb_samples_other)} 条")
+            st.rows = len(combined_kb)
+        metrics.update({"added": len(added), "removed": len(removed)}, prefix="kb_index.")
+    else:
+        with metrics.stage("split_language") as st:
+            print(f"🔀 按语言分离知识库 (字段: '{args.text_key}')...")
+            kb_samples_zh, kb_samples_en, kb_samples_other = separate_by_language(combined_kb, text_key=args.text_key)
+
+            # ✅ 新增：过滤 output 为空的样本
+            kb_samples_zh = filter_empty_outputs(kb_samples_zh, key="output")
+            kb_samples_en = filter_empty_outputs(kb_samples_en, key="output")
+            if args.retriever_backend == "dense":
+                kb_samples_other = filter_empty_outputs(kb_samples_other, key="output")
+            st.rows = len(combined_kb)
 
-    print(f"\n📚 加载合并知识库: {args.knowledge_base_path}")
-    combined_kb = load_json_or_jsonl(args.knowledge_base_path)
-    print(f"   样本总数: {len(combined_kb)}")
+        # === 构建 Retriever ===
+        with metrics.stage("build_index") as st:
+            print("\n🚀 构建向量索引...")
+            if args.retriever_backend == "dense":
+                # 其他语言的样本也进入索引，作为单独的分区
+                unified = DenseRetriever(
+                    kb_samples_zh + kb_samples_en + kb_samples_other, key=args.text_key, encoder=encoder,
+                    langs=["zh"] * len(kb_samples_zh) + ["en"] * len(kb_samples_en) + ["other"] * len(kb_samples_other),
+                    quantization=args.quantization, oversample=args.rerank_oversample,
+                )
+                print(f"   ✅ 多语言索引构建完成 (中文 {len(kb_samples_zh)} / 英文 {len(kb_samples_en)} / "
+                      f"其他 {len(kb_samples_other)} 条样本)")
+                if unified.codes is not None:
+                    st.extra["code_mb"] = unified.codes.nbytes / (1 << 20)
+                    print(f"   🗜️ {args.quantization} 量化码 {st.extra['code_mb']:.1f} MB"
+                          + ("" if encoder.cache is not None else "（未给 --embedding_cache，float32 向量仍常驻内存）"))
+                st.rows = len(unified)
+            else:
+                retriever_zh = Retriever(kb_samples_zh, key=args.text_key)
+                retriever_en = Retriever(kb_samples_en, key=args.text_key)
+                print(f"   ✅ 中文索引构建完成 ({len(kb_samples_zh)} 条样本)")
+                print(f"   ✅ 英文索引构建完成 ({len(kb_samples_en)} 条样本)")
+                st.rows = len(kb_samples_zh) + len(kb_samples_en)
 
-    print(f"🔀 按语言分离知识库 (字段: '{args.text_key}')...")
-    kb_samples_zh, kb_samples_en, kb_samples_other = separate_by_language(combined_kb, text_key=args.text_key)
+    kb_position = _kb_position_resolver(combined_kb) if args.store_neighbor_ids else None
 
-    # ✅ 新增：过滤 output 为空的样本
-    kb_samples_zh = filter_empty_outputs(kb_samples_zh, key="output")
-    kb_samples_en = filter_empty_outputs(kb_samples_en, key="output")
+    near_dup_index = None
+    if args.near_dup_threshold > 0:
+        with metrics.stage("near_dup_index") as st:
+            print(f"🧬 构建近重复索引 (MinHash/LSH, 阈值 {args.near_dup_threshold})...")
+            near_dup_index = NearDupIndex(threshold=args.near_dup_threshold)
+            indexed = kb_samples_zh + kb_samples_en + (kb_samples_other if unified is not None else [])
+            for kb_sample in indexed:
+                text = kb_sample.get(args.text_key, "")
+                near_dup_index.add(normalize_text(text), text)
+            st.rows = len(near_dup_index)
 
-    # === 构建 Retriever ===
-    print("\n🚀 构建向量索引...")
-    retriever_zh = Retriever(kb_samples_zh, key=args.text_key)
-    retriever_en = Retriever(kb_samples_en, key=args.text_key)
-    print(f"   ✅ 中文索引构建完成 ({len(kb_samples_zh)} 条样本)")
-    print(f"   ✅ 英文索引构建完成 ({len(kb_samples_en)} 条样本)")
+    with metrics.stage("load_queries") as st:
+        print(f"\n📂 加载待增强样本: {args.data_path}")
+        samples = load_json_or_jsonl(args.data_path, compact=args.records == "compact")
+        print(f"   待增强样本数: {len(samples)}")
+        st.rows = len(samples)
 
-    print(f"\n📂 加载待增强样本: {args.data_path}")
-    samples = load_json_or_jsonl(args.data_path)
-    print(f"   待增强样本数: {len(samples)}")
+    if encoder is not None and encoder.cache is not None:
+        # 一次性批量编码全部 query；与 KB 重合的句子直接命中缓存，检索时只做查表
+        with metrics.stage("encode_queries") as st:
+            queries = [q for q in (s.get(args.text_key, "") for s in samples) if q.strip()]
+            encoder.encode(queries)
+            st.rows = len(queries)
+        metrics.update({"hit": encoder.hits, "miss": encoder.misses}, prefix="embedding_cache.")
+        print(f"   🗃️ 向量缓存: 命中 {encoder.hits}，新编码 {encoder.misses}，缓存共 {len(encoder.cache)} 条")
 
-    print(f"\n🎯 开始检索相似样本 (每条样本选取 2 个: 一个 output 为空，一个 output 非空)")
+    if args.selection == "mmr":
+        from selection import select_batch
+        print(f"\n🎯 开始检索相似样本 (MMR 选取 {args.k} 个，λ={args.mmr_lambda}，兼顾空/非空与 schema 关系覆盖)")
+    else:
+        print(f"\n🎯 开始检索相似样本 (每条样本选取 2 个: 一个 output 为空，一个 output 非空)")
     augmented = []
     stats = Counter()
 
-    for s in tqdm(samples, desc="Processing queries"):
+    def exclude_self(query, examples, sims, vectors):
+        """排除自身（含空白/标点差异的近重复），返回过滤后的 (候选样本, 相似度, 候选向量)。"""
+        near_dups = set(near_dup_index.query(query)) if near_dup_index is not None else set()
+        keep = []
+        for i, (ex, sim) in enumerate(zip(examples, sims)):
+            ex_text = ex.get(args.text_key, "").strip()
+            if sim > 0.95 or ex_text == query.strip():
+                continue
+            if near_dups and normalize_text(ex_text) in near_dups:
+                stats["near_dup_excluded"] += 1
+                continue
+            keep.append(i)
+        if vectors is not None:
+            vectors = vectors[keep]
+        return [examples[i] for i in keep], [sims[i] for i in keep], vectors
+
+    def retrieve_candidates(s):
+        """rag_utils 后端：按语言选择检索器逐条检索；失败或为空时返回 None。"""
         query = s.get(args.text_key, "")
         if not query.strip():
-            stats["zero"] += 1
-            continue
+            return None
 
         detected_lang = detect_language(query)
         s["detected_language"] = detected_lang
@@ -75,58 +237,73 @@ def main():
         retriever = retriever_zh if detected_lang == 'zh' else retriever_en
         try:
             # 多取一些结果，用于筛选
-            examples, sims = retriever.retrieve(query=query, top_k=20, threshold=args.similarity_threshold)
+            examples, sims = retriever.retrieve(query=query, top_k=args.top_k, threshold=args.similarity_threshold)
         except Exception as e:
             print(f"⚠️ 检索失败: {query[:50]}... Error: {e}")
-            stats["zero"] += 1
-            continue
+            return None
 
         if not examples:
-            stats["zero"] += 1
-            continue
-
-        # 新的筛选逻辑：选 1 个 output 非空 + 1 个 output 为空
-        selected_examples = []
-        selected_sims = []
-        has_empty = False
-        has_nonempty = False
-
-        for ex, sim in zip(examples, sims):
-            ex_text = ex.get(args.text_key, "").strip()
-            ex_output = ex.get("output", [])
+            return None
+        return exclude_self(query, examples, sims, None)
 
-            # 排除自身
-            if sim > 0.95 or ex_text == query.strip():
-                continue
+    def retrieve_batch_candidates(batch):
+        """dense 后端：整批 query 一次检索；语言分区内没有可用候选时，使用同一得分矩阵给出的跨语言候选。"""
+        candidates = [None] * len(batch)
+        positions = [i for i, s in enumerate(batch) if s.get(args.text_key, "").strip()]
+        queries = [batch[i][args.text_key] for i in positions]
+        langs = [detect_language(q) for q in queries]
+        hits = unified.search_batch(queries, langs, top_k=args.top_k, threshold=args.similarity_threshold,
+                                    cross_lingual=not args.no_cross_lingual)
+        for i, query, lang, (primary, fallback) in zip(positions, queries, langs, hits):
+            batch[i]["detected_language"] = lang
+            found = exclude_self(query, *primary)
+            if not found[0] and fallback is not None and fallback[0]:
+                found = exclude_self(query, *fallback)
+                if found[0]:
+                    stats["cross_lingual"] += 1
+            if found[0]:
+                candidates[i] = found
+        return candidates
 
-            # 优先选一个 output 非空，一个 output 空
-            if not has_nonempty and ex_output:
-                selected_examples.append(ex)
-                selected_sims.append(sim)
-                has_nonempty = True
-            elif not has_empty and (isinstance(ex_output, list) and len(ex_output) == 0):
-                selected_examples.append(ex)
-                selected_sims.append(sim)
-                has_empty = True
+    with metrics.stage("retrieve") as st:
+        for start in tqdm(range(0, len(samples), args.batch_size), desc="Processing query batches"):
+            batch = samples[start:start + args.batch_size]
+            if unified is not None:
+                candidates = retrieve_batch_candidates(batch)
+            else:
+                candidates = [retrieve_candidates(s) for s in batch]
 
-            # 两类都找到了就停止
-            if has_nonempty and has_empty:
-                break
+            if args.selection == "mmr":
+                live = [(s, *c) for s, c in zip(batch, candidates) if c is not None]
+                picks = iter(select_batch(live, text_key=args.text_key, k=args.k,
+                                          lam=args.mmr_lambda, coverage_weight=args.coverage_weight))
+                picked = [next(picks) if c is not None else [] for c in candidates]
+            else:
+                picked = [greedy_select(c[0], c[1])[0] if c is not None else [] for c in candidates]
 
-        if not selected_examples:
-            stats["zero"] += 1
-            continue
+            for s, c, idx in zip(batch, candidates, picked):
+                if not idx:
+                    stats["zero"] += 1
+                    continue
+                examples, sims = c[0], c[1]
+                if kb_position is not None:
+                    s["similar_ids"] = [kb_position(examples[i]) for i in idx]
+                else:
+                    s["similar_samples"] = [examples[i] for i in idx]
+                s["similarity_scores"] = [sims[i] for i in idx]
 
-        s["similar_samples"] = selected_examples
-        s["similarity_scores"] = selected_sims
+                # 统计信息
+                has_empty = any(is_empty_output(examples[i]) for i in idx)
+                has_nonempty = any(not is_empty_output(examples[i]) for i in idx)
+                if has_nonempty and has_empty:
+                    stats["full"] += 1
+                else:
+                    stats["partial"] += 1
 
-        # 统计信息
-        if has_nonempty and has_empty:
-            stats["full"] += 1
-        else:
-            stats["partial"] += 1
+                augmented.append(s)
 
-        augmented.append(s)
+        st.rows = len(samples)
+        metrics.update(stats, prefix="retrieval.")
 
     # === 输出统计 ===
     total = len(samples)
@@ -134,12 +311,20 @@ def main():
     print(f"  完整结果 (找到空+非空样本): {stats['full']}")
     print(f"  部分结果: {stats['partial']}")
     print(f"  零结果: {stats['zero']}")
+    print(f"  近重复排除的候选: {stats['near_dup_excluded']}")
+    if unified is not None:
+        print(f"  跨语言回退命中: {stats['cross_lingual']}")
     print(f"  覆盖率: {(1 - stats['zero']/total)*100:.1f}%")
 
     # === 保存结果 ===
-    with open(args.output_path, "w", encoding="utf-8") as f:
-        json.dump(augmented, f, ensure_ascii=False, indent=2)
+    with metrics.stage("save") as st:
+        json_io.write_dataset(args.output_path, augmented)
+        st.rows = len(augmented)
     print(f"\n💾 增强结果已保存到: {args.output_path}")
+    if kb_index is not None:
+        # 删除触发的后台压缩需要在退出前完成
+        kb_index.wait()
+    metrics.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流水线基准测试：合成 DuIE / NYT 形态的双语数据，逐阶段计时
+
+- 合成数据字段与真实数据一致：source / sentence / schema / coarse_types / output
+- 每个 (规模, 阶段) 在独立的 spawn 子进程中运行，峰值 RSS 互不干扰
+- 输出吞吐 (rows/s)、峰值 RSS、各阶段随规模的伸缩指数 (log-log 斜率)
+- 结果保存为 JSON，可用 --compare 与历史提交的结果对比
+- --startup 测量各脚本 `--help` 的冷启动耗时与导入耗时，防止重依赖被重新提前导入
+
+用法:
+  python benchmark.py --scales 10000 100000 --output_path bench_results/run.json
+  python benchmark.py --scales 10000 --stages prompt_formatting step2_conversion --compare bench_results/old.json
+  python benchmark.py --startup --compare bench_results/old.json
+"""
+
+import argparse
+import math
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import json_io
+
+# ----------------------------
+# 合成数据
+# ----------------------------
+
+ZH_RELATIONS = [
+    "国籍", "毕业院校", "父亲", "母亲", "妻子", "丈夫", "朝代", "上映时间", "编剧", "获奖", "民族", "作者",
+    "主演", "导演", "作词", "作曲", "改编自", "制片人", "出品公司", "总部地点", "创始人", "成立日期", "歌手",
+]
+EN_RELATIONS = [
+    "administrative division of country", "country of capital", "geographic distribution", "neighborhood of",
+    "location contains", "nationality", "children", "ethnicity", "place of birth", "place of death",
+    "profession", "religion", "place lived", "company founded place", "country of headquarters",
+]
+ZH_COARSE = ["位置", "科学", "医学", "组织机构", "时间", "生物", "事件", "人", "产品", "文学", "音乐"]
+EN_COARSE = ["location", "person", "organization", "product", "science", "music", "event", "literature", "food"]
+ZH_CHARS = "张王李赵刘陈杨黄周吴徐孙马朱胡林郭何高罗郑梁谢宋唐许邓冯韩曹曾彭萧蔡潘田董袁于余叶蒋杜苏魏程吕丁沈任姚"
+ZH_FILLER = ["出生于", "毕业于", "担任", "是", "的", "代表作品", "曾在", "发行了", "主演的电影", "位于", "创立了", "，", "。"]
+EN_SYLLABLES = ["ka", "lo", "mi", "ran", "tes", "vor", "bel", "dan", "ri", "son", "ton", "ville", "mar", "ley"]
+EN_FILLER = ["was born in", "lives in", "the capital of", "in", ",", "said", "of", "the", "and", "visited", "."]
+
+
+def _zh_entity(rng: random.Random) -> str:
+    return "".join(rng.choice(ZH_CHARS) for _ in range(rng.randint(2, 4)))
+
+
+def _en_entity(rng: random.Random) -> str:
+    return " ".join(
+        "".join(rng.choice(EN_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        for _ in range(rng.randint(1, 2))
+    )
+
+
+def make_record(rng: random.Random, zh_ratio: float = 0.55) -> Dict[str, Any]:
+    zh = rng.random() < zh_ratio
+    relations, coarse, filler = (ZH_RELATIONS, ZH_COARSE, ZH_FILLER) if zh else (EN_RELATIONS, EN_COARSE, EN_FILLER)
+    entity = _zh_entity if zh else _en_entity
+    sep = "" if zh else " "
+
+    entities = [entity(rng) for _ in range(rng.randint(1, 4))]
+    words: List[str] = []
+    for ent in entities:
+        words.extend(rng.choice(filler) for _ in range(rng.randint(3, 10)))
+        words.append(ent)
+    words.extend(rng.choice(filler) for _ in range(rng.randint(2, 8)))
+
+    schema = rng.sample(relations, rng.randint(2, 5))
+    coarse_types = rng.sample(coarse, rng.randint(2, 4))
+    output = []
+    # 与真实数据接近：约 1/3 的样本有三元组
+    if len(entities) >= 2 and rng.random() < 0.5:
+        for _ in range(rng.choice([1, 1, 1, 2, 3])):
+            subj, obj = rng.sample(entities, 2)
+            output.append({
+                "subject": [subj, rng.choice(coarse_types), rng.choice(coarse)],
+                "relationship": rng.choice(schema),
+                "object": [obj, rng.choice(coarse_types), rng.choice(coarse)],
+            })
+    return {
+        "source": "DuIE2.0" if zh else "New-York-Times-RE",
+        "sentence": sep.join(words),
+        "schema": schema,
+        "coarse_types": coarse_types,
+        "output": output,
+    }
+
+
+def make_prediction(rng: random.Random, record: Dict[str, Any]) -> Dict[str, Any]:
+    """模拟 generated_predictions.jsonl 的一行：大部分正确，部分漏抽 / 格式噪声。"""
+    output = list(record["output"])
+    if output and rng.random() < 0.2:
+        output = output[:-1]
+    text = json_io.dumps(output)
+    roll = rng.random()
+    if roll < 0.05:
+        text = f"```json\n{text}\n```"
+    elif roll < 0.08:
+        text = text[: max(1, len(text) // 2)]
+    return {"prompt": "", "predict": text, "label": json_io.dumps(record["output"])}
+
+
+def generate_dataset(workdir: Path, num_rows: int, seed: int = 0) -> Dict[str, Path]:
+    workdir.mkdir(parents=True, exist_ok=True)
+    data_path = workdir / "data.json"
+    pred_path = workdir / "generated_predictions.jsonl"
+    rng = random.Random(seed)
+    with json_io.open_writer(data_path) as data_writer, json_io.JsonlWriter(pred_path) as pred_writer:
+        for _ in range(num_rows):
+            record = make_record(rng)
+            data_writer.write(record)
+            pred_writer.write(make_prediction(rng, record))
+    return {"data": data_path, "predictions": pred_path}
+
+
+# ----------------------------
+# 各阶段（在子进程中运行，返回处理的行数）
+# ----------------------------
+
+def stage_json_load(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    return len(json_io.load_json_or_jsonl(paths["data"]))
+
+
+def stage_records_load(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    """与 json_load 相同的数据，驻留为 records.Sample（对比峰值 RSS）。"""
+    from records import load_samples
+
+    return len(load_samples(paths["data"]))
+
+
+def stage_language_split(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from step_convert import LanguageDetector
+
+    detector = LanguageDetector()
+    buckets: Dict[str, int] = {}
+    n = 0
+    for row in json_io.iter_records(paths["data"]):
+        lang = detector.detect_language(row["sentence"])
+        buckets[lang] = buckets.get(lang, 0) + 1
+        n += 1
+    return n
+
+
+def stage_language_split_langdetect(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from seprate_language import separate_by_language
+
+    data = json_io.load_json_or_jsonl(paths["data"])[: args["rag_limit"]]
+    separate_by_language(data, text_key="sentence")
+    return len(data)
+
+
+def stage_near_dup_index(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from near_dup import NearDupIndex
+
+    index = NearDupIndex()
+    n = 0
+    for i, row in enumerate(json_io.iter_records(paths["data"])):
+        index.add(i, row["sentence"])
+        n += 1
+    return n
+
+
+def stage_rag_index_build(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from rag_utils import Retriever
+
+    kb = [r for r in json_io.load_json_or_jsonl(paths["data"])[: args["rag_limit"]] if r["output"]]
+    Retriever(kb, key="sentence")
+    return len(kb)
+
+
+def stage_rag_query(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from rag_utils import Retriever
+
+    data = json_io.load_json_or_jsonl(paths["data"])[: args["rag_limit"]]
+    retriever = Retriever([r for r in data if r["output"]], key="sentence")
+    queries = data[: args["rag_queries"]]
+    start = time.perf_counter()
+    for row in queries:
+        retriever.retrieve(query=row["sentence"], top_k=20, threshold=0.5)
+    # 只计查询耗时
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(queries)
+
+
+def stage_embedding_cache(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    """句向量缓存：首轮全部写入，再重新打开做一轮全命中的查表（只计第二轮）。"""
+    import numpy as np
+    from embedding_cache import CachedEncoder, EmbeddingCache
+
+    class _RandomEncoder:
+        def encode(self, texts, **kwargs):
+            return np.random.default_rng(len(texts)).standard_normal((len(texts), 384), dtype=np.float32)
+
+    texts = [row["sentence"] for row in json_io.iter_records(paths["data"])]
+    cache_dir = paths["data"].parent / "embedding_cache"
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    CachedEncoder(_RandomEncoder(), EmbeddingCache(cache_dir, model_name="random")).encode(texts)
+    start = time.perf_counter()
+    encoder = CachedEncoder(_RandomEncoder(), EmbeddingCache(cache_dir, model_name="random"))
+    encoder.encode(texts)
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(texts)
+
+
+def stage_prompt_formatting(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from conver_train_for_lora import format_training_item
+
+    previous: List[Dict[str, Any]] = []
+    n = 0
+    for row in json_io.iter_records(paths["data"]):
+        if len(previous) >= 2:
+            row["similar_samples"] = previous[-2:]
+        format_training_item(row, include_default_example=True)
+        previous = [previous[-1], row] if previous else [row]
+        n += 1
+    return n
+
+
+def _step_conversion(variant, paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from step_convert import convert_file
+
+    out = paths["data"].with_name(f"{variant.name}_out.jsonl")
+    stats = convert_file(variant, paths["data"], out, workers=args["workers"], prompt_ref=args["prompt_ref"])
+    out.unlink()
+    return stats["total"]
+
+
+def stage_step1_conversion(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from step1_convert import VARIANT
+
+    return _step_conversion(VARIANT, paths, args)
+
+
+def stage_step2_conversion(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from step2_convert import VARIANT
+
+    return _step_conversion(VARIANT, paths, args)
+
+
+def stage_step1_gate(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    """CPU 门控：先在同一份数据上训练一轮，只计特征化 + 打分 + 判定的耗时。"""
+    from step1_gate import Step1Gate, gold_label
+
+    data = json_io.load_json_or_jsonl(paths["data"])
+    gate = Step1Gate(1 << 18)
+    gate.fit(gate.featurize(data), [gold_label(row) for row in data], epochs=1, batch_size=4096)
+    start = time.perf_counter()
+    gate.decide(gate.predict_proba(data))
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(data)
+
+
+def stage_gazetteer_scan(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    """实体词典：由同一份数据的三元组构建自动机，只计逐句扫描的耗时。"""
+    from gazetteer import Gazetteer
+
+    data = json_io.load_json_or_jsonl(paths["data"])
+    gazetteer = Gazetteer.from_samples(data)
+    start = time.perf_counter()
+    for row in data:
+        gazetteer.scan(row["sentence"], row["schema"])
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(data)
+
+
+def stage_pack_plan(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    """序列打包：以序列化长度近似 token 数，只计首次适应递减装箱的耗时。"""
+    from pack_planner import first_fit_decreasing
+
+    lengths = [min(len(json_io.dumps(row)) // 2, 2048) for row in json_io.iter_records(paths["data"])]
+    start = time.perf_counter()
+    first_fit_decreasing(lengths, 2048)
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(lengths)
+
+
+def stage_prediction_parsing(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from get_predict import extract_output, load_predictions
+
+    predictions = load_predictions(paths["predictions"])
+    for text in predictions:
+        extract_output(text)
+    return len(predictions)
+
+
+def stage_scoring(paths: Dict[str, Path], args: Dict[str, Any]) -> int:
+    from get_predict import extract_output, load_predictions, score_predictions
+
+    gold = [row["output"] for row in json_io.iter_records(paths["data"])]
+    predicted = [extract_output(text) for text in load_predictions(paths["predictions"])]
+    start = time.perf_counter()
+    score_predictions(predicted, gold)
+    args["_elapsed_override"] = time.perf_counter() - start
+    return len(gold)
+
+
+STAGES: Dict[str, Callable[[Dict[str, Path], Dict[str, Any]], int]] = {
+    "json_load": stage_json_load,
+    "records_load": stage_records_load,
+    "language_split": stage_language_split,
+    "language_split_langdetect": stage_language_split_langdetect,
+    "near_dup_index": stage_near_dup_index,
+    "rag_index_build": stage_rag_index_build,
+    "rag_query": stage_rag_query,
+    "embedding_cache": stage_embedding_cache,
+    "prompt_formatting": stage_prompt_formatting,
+    "step1_conversion": stage_step1_conversion,
+    "step2_conversion": stage_step2_conversion,
+    "step1_gate": stage_step1_gate,
+    "gazetteer_scan": stage_gazetteer_scan,
+    "pack_plan": stage_pack_plan,
+    "prediction_parsing": stage_prediction_parsing,
+    "scoring": stage_scoring,
+}
+
+
+def _peak_rss_mb() -> float:
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_stage(name: str, paths: Dict[str, Path], args: Dict[str, Any]) -> Dict[str, Any]:
+    baseline_rss = _peak_rss_mb()
+    start = time.perf_counter()
+    try:
+        rows = STAGES[name](paths, args)
+    except ImportError as e:
+        return {"stage": name, "skipped": f"missing dependency: {e.name or e}"}
+    elapsed = args.pop("_elapsed_override", time.perf_counter() - start)
+    return {
+        "stage": name,
+        "rows": rows,
+        "seconds": elapsed,
+        "rows_per_s": rows / elapsed if elapsed > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "baseline_rss_mb": baseline_rss,
+    }
+
+
+def _stage_worker(conn: Any, name: str, paths: Dict[str, Path], args: Dict[str, Any]) -> None:
+    try:
+        conn.send(("ok", _run_stage(name, paths, args)))
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+def run_stage_isolated(name: str, paths: Dict[str, Path], args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    在全新的 spawn 子进程中运行单个阶段，使峰值 RSS 只反映该阶段。
+    用普通 Process 而不是 Pool：Pool 的工作进程是 daemon，阶段内部（--workers > 1）不能再起子进程。
+    """
+    ctx = multiprocessing.get_context("spawn")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_stage_worker, args=(child_conn, name, paths, args))
+    proc.start()
+    child_conn.close()
+    try:
+        status, payload = parent_conn.recv()
+    except EOFError:
+        proc.join()
+        raise RuntimeError(f"Stage {name} exited with code {proc.exitcode} without a result")
+    proc.join()
+    if status == "error":
+        raise RuntimeError(f"Stage {name} failed in the subprocess:\n{payload}")
+    return payload
+
+
+# ----------------------------
+# 启动耗时
+# ----------------------------
+
+STARTUP_SCRIPTS = [
+    "llm4re.py", "RAG4JSON.py", "kb_index.py", "seprate_language.py", "near_dup.py", "conver_train_for_lora.py",
+    "step1_convert.py", "step2_convert.py", "extract_step1.py", "extract_prediction.py", "get_predict.py",
+    "indexed_jsonl.py", "step1_gate.py", "gazetteer.py", "target_format.py",
+    "generation_budget.py", "budgeted_infer.py", "token_cache.py", "pack_planner.py", "encoder_runtime.py",
+]
+
+
+def _import_time_ms(script: Path) -> Optional[float]:
+    """python -X importtime 汇总的导入耗时（顶层模块累计时间之和）。"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", str(script), "--help"],
+        cwd=script.parent, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"，顶层模块没有缩进
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        if not parts[2].startswith(" ") or parts[2].startswith("  "):
+            continue
+        total_us += int(parts[1])
+    return total_us / 1000 if total_us else None
+
+
+def measure_startup(script: Path, repeats: int = 5) -> Dict[str, Any]:
+    """多次运行 `python <script> --help`，取墙钟时间中位数。"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, str(script), "--help"],
+            cwd=script.parent, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            return {"stage": f"startup:{script.name}", "skipped": f"exit code {proc.returncode}"}
+    return {
+        "stage": f"startup:{script.name}",
+        "seconds": statistics.median(timings),
+        "min_seconds": min(timings),
+        "import_ms": _import_time_ms(script),
+        "repeats": repeats,
+    }
+
+
+# ----------------------------
+# 汇总与对比
+# ----------------------------
+
+def scaling_exponents(results: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+    """每个阶段 log(seconds) 对 log(rows) 的最小二乘斜率；≈1 为线性，>1 为超线性。"""
+    by_stage: Dict[str, List[tuple]] = {}
+    for r in results:
+        if r.get("seconds") and r.get("rows"):
+            by_stage.setdefault(r["stage"], []).append((math.log(r["rows"]), math.log(r["seconds"])))
+    exponents: Dict[str, Optional[float]] = {}
+    for stage, points in by_stage.items():
+        if len(points) < 2:
+            exponents[stage] = None
+            continue
+        mx = sum(x for x, _ in points) / len(points)
+        my = sum(y for _, y in points) / len(points)
+        var = sum((x - mx) ** 2 for x, _ in points)
+        exponents[stage] = sum((x - mx) * (y - my) for x, y in points) / var if var else None
+    return exponents
+
+
+def compare_results(current: Dict[str, Any], previous: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    old = {(r.get("scale"), r["stage"]): r for r in previous["results"] if r.get("seconds")}
+    lines = []
+    for r in current["results"]:
+        ref = old.get((r.get("scale"), r["stage"]))
+        if not r.get("seconds") or ref is None:
+            continue
+        ratio = r["seconds"] / ref["seconds"]
+        flag = "⚠️ 回退" if ratio > 1 + tolerance else ("🚀 提升" if ratio < 1 - tolerance else "")
+        lines.append(f"  {r['stage']:<32} n={r.get('scale') or '-':<9} {ref['seconds']:.3f}s → {r['seconds']:.3f}s ({ratio:.2f}x) {flag}")
+    return lines
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="LLM4RE 流水线基准测试")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10_000, 100_000], help="合成数据行数 (10k–10M)")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES), help="要运行的阶段")
+    parser.add_argument("--workers", type=int, default=1, help="step-1/2 转换的进程数")
+    parser.add_argument("--prompt_ref", action="store_true", help="step-1/2 转换使用 system_id 引用")
+    parser.add_argument("--rag_limit", type=int, default=20_000, help="RAG / langdetect 阶段最多使用的行数")
+    parser.add_argument("--rag_queries", type=int, default=1_000, help="RAG 查询阶段的查询数")
+    parser.add_argument("--workdir", type=Path, default=None, help="合成数据目录，默认使用临时目录")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output_path", type=Path, default=None, help="结果 JSON 路径")
+    parser.add_argument("--compare", type=Path, default=None, help="与历史结果 JSON 对比")
+    parser.add_argument("--startup", action="store_true", help="只测量各脚本 --help 的启动耗时")
+    parser.add_argument("--startup_repeats", type=int, default=5, help="每个脚本的启动测量次数")
+    args = parser.parse_args(argv)
+
+    stage_args = {
+        "workers": args.workers,
+        "prompt_ref": args.prompt_ref,
+        "rag_limit": args.rag_limit,
+        "rag_queries": args.rag_queries,
+    }
+
+    results: List[Dict[str, Any]] = []
+    if args.startup:
+        print(f"\n🚀 启动耗时 (python <script> --help, {args.startup_repeats} 次中位数):")
+        for script in STARTUP_SCRIPTS:
+            result = measure_startup(Path(__file__).parent / script, args.startup_repeats)
+            results.append(result)
+            if "skipped" in result:
+                print(f"  ⏭️ {script:<28} 跳过 ({result['skipped']})")
+            else:
+                import_ms = f"{result['import_ms']:.0f} ms" if result["import_ms"] is not None else "-"
+                print(f"  ⏱️ {script:<28} {result['seconds'] * 1000:8.1f} ms  导入 {import_ms}")
+    with tempfile.TemporaryDirectory(prefix="llm4re_bench_") as tmp:
+        root = args.workdir or Path(tmp)
+        for scale in ([] if args.startup else args.scales):
+            print(f"\n🧪 生成 {scale} 条合成数据...")
+            paths = generate_dataset(root / f"n{scale}", scale, seed=args.seed)
+            for stage in args.stages:
+                result = run_stage_isolated(stage, paths, dict(stage_args))
+                result["scale"] = scale
+                results.append(result)
+                if "skipped" in result:
+                    print(f"  ⏭️ {stage:<28} 跳过 ({result['skipped']})")
+                else:
+                    rate = result["rows_per_s"]
+                    rate = format(rate, ">12,.0f") if rate is not None else "-".rjust(12)
+                    print(
+                        f"  ⏱️ {stage:<28} {result['seconds']:8.3f}s  "
+                        f"{rate} rows/s  峰值 RSS {result['peak_rss_mb']:.0f} MB"
+                    )
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "config": {**stage_args, "scales": [] if args.startup else args.scales, "seed": args.seed, "startup": args.startup},
+        "results": results,
+        "scaling_exponents": scaling_exponents(results),
+    }
+
+    if not args.startup and len(args.scales) > 1:
+        print("\n📈 伸缩指数 (≈1 线性):")
+        for stage, exp in report["scaling_exponents"].items():
+            if exp is not None:
+                print(f"  {stage:<28} {exp:.2f}")
+
+    if args.compare:
+        print(f"\n🔍 与 {args.compare} 对比:")
+        for line in compare_results(report, json_io.load_json(args.compare)):
+            print(line)
+
+    output_path = args.output_path or Path("bench_results") / f"{report['timestamp'].replace(':', '')}_{report['commit'] or 'nogit'}.json"
+    json_io.write_json(output_path, report)
+    print(f"\n💾 基准结果已保存到: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
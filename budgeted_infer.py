@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按行预算（max_new_tokens）的批量推理
+
+LLaMA-Factory 的 `llamafactory-cli train --do_predict` 只能给整个数据集设一个 --max_new_tokens（LLM_infer.bash 中为 512），
+一批里只要有一条生成失控，整批都要跑满 512 步。这里直接用 transformers 生成：
+
+- 每行的预算取转换结果中的 max_new_tokens（conver_train_for_lora.py / step*_convert.py --attach_budget），
+  缺省为 --default_budget；同预算档位的行合批，批内按 prompt 长度排序减少 padding
+- 生成文本中顶层 JSON 数组一旦闭合即停止该行（批内所有行都停止后整批结束）
+- 输出与 LLaMA-Factory 的 generated_predictions.jsonl 相同（prompt / predict / label），并多出
+  budget / new_tokens / hit_budget；hit_budget 表示跑满预算仍未结束，get_predict.py 据此写出重跑列表
+- --retry_path 只重跑列表中的行（index 为 --output_path 中的行号，预算取列表中的 budget），并原地替换这些行
+- --window N：按输入顺序每 N 行为一个窗口，窗口内合批，窗口完成后立即按顺序追加写出；
+  get_predict.py --follow 可以边生成边解析、打分
+
+用法:
+  python budgeted_infer.py --model_path /root/autodl-tmp/Llama-3.1-8B-Instruct --adapter_path <lora> \
+      --data_path data/test2_rag_converted.json --output_path saves/test2/generated_predictions.jsonl
+  python get_predict.py ... --retry_path saves/test2/retry.jsonl
+  python budgeted_infer.py ... --retry_path saves/test2/retry.jsonl
+"""
+
+import argparse
+from collections import defaultdict
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import json_io
+from generation_budget import ArrayScanner
+from metrics import get_metrics
+
+
+def build_messages(row: Dict[str, Any], prompts: Optional[Dict[str, str]] = None) -> List[Dict[str, str]]:
+    """与 LLaMA-Factory alpaca 格式一致：instruction 与 input 以换行拼接为用户消息，history 依次展开。"""
+    system = row.get("system")
+    if system is None and "system_id" in row:
+        if prompts is None:
+            raise ValueError("Row has system_id but no --prompts_path was given (step_convert.py --prompt_ref).")
+        system = prompts[row["system_id"]]
+    messages = [{"role": "system", "content": system}] if system else []
+    for user, assistant in row.get("history") or []:
+        messages.append({"role": "user", "content": user})
+        messages.append({"role": "assistant", "content": assistant})
+    query = "\n".join(part for part in (row.get("instruction"), row.get("input")) if part)
+    messages.append({"role": "user", "content": query})
+    return messages
+
+
+def plan_batches(
+    budgets: Dict[int, int], prompt_lengths: Dict[int, int], batch_size: int
+) -> Iterator[Tuple[int, List[int]]]:
+    """按预算分组，组内按 prompt 长度降序切批；产出 (budget, 行下标列表)。"""
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for idx, budget in budgets.items():
+        groups[budget].append(idx)
+    for budget in sorted(groups):
+        indices = sorted(groups[budget], key=lambda i: -prompt_lengths[i])
+        for start in range(0, len(indices), batch_size):
+            yield budget, indices[start:start + batch_size]
+
+
+def _closed_array_criteria(tokenizer: Any, prompt_len: int, batch: int):
+    """StoppingCriteria：逐行增量解码新 token，顶层 JSON 数组闭合的行标记为结束。"""
+    import torch
+    from transformers import StoppingCriteria
+
+    class ClosedArrayCriteria(StoppingCriteria):
+        def __init__(self):
+            self.scanners = [ArrayScanner() for _ in range(batch)]
+            self.seen = prompt_len
+
+        def __call__(self, input_ids, scores, **kwargs):
+            new = input_ids[:, self.seen:]
+            self.seen = input_ids.shape[1]
+            done = []
+            for scanner, ids in zip(self.scanners, new.tolist()):
+                if not scanner.closed:
+                    scanner.feed(tokenizer.decode(ids, skip_special_tokens=True))
+                done.append(scanner.closed)
+            return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+    return ClosedArrayCriteria()
+
+
+def load_model(model_path: str, adapter_path: Optional[str], *, load_in_4bit: bool = False):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True, padding_side="left")
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    kwargs: Dict[str, Any] = {"torch_dtype": torch.bfloat16, "device_map": "auto", "trust_remote_code": True}
+    if load_in_4bit:
+        from transformers import BitsAndBytesConfig
+
+        kwargs["quantization_config"] = BitsAndBytesConfig(load_in_4bit=True, bnb_4bit_compute_dtype=torch.bfloat16)
+    model = AutoModelForCausalLM.from_pretrained(model_path, **kwargs)
+    if adapter_path:
+        from peft import PeftModel
+
+        model = PeftModel.from_pretrained(model, adapter_path)
+    model.eval()
+    return model, tokenizer
+
+
+def generate_batch(
+    model: Any,
+    tokenizer: Any,
+    prompts: List[str],
+    budget: int,
+    *,
+    temperature: float,
+    top_p: float,
+    stop_on_closed_array: bool = True,
+) -> List[Dict[str, Any]]:
+    import torch
+
+    encoded = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(model.device)
+    prompt_len = encoded["input_ids"].shape[1]
+    criteria = _closed_array_criteria(tokenizer, prompt_len, len(prompts)) if stop_on_closed_array else None
+    kwargs: Dict[str, Any] = {"max_new_tokens": budget, "pad_token_id": tokenizer.pad_token_id}
+    if temperature > 0:
+        kwargs.update(do_sample=True, temperature=temperature, top_p=top_p)
+    else:
+        kwargs["do_sample"] = False
+    if criteria is not None:
+        from transformers import StoppingCriteriaList
+
+        kwargs["stopping_criteria"] = StoppingCriteriaList([criteria])
+    with torch.inference_mode():
+        output = model.generate(**encoded, **kwargs)
+
+    # Llama-3 的 generation_config 里 eos_token_id 是列表（<|eot_id|> 等）
+    config_eos = getattr(model.generation_config, "eos_token_id", None)
+    eos_ids = {tokenizer.eos_token_id, *([config_eos] if isinstance(config_eos, int) else config_eos or [])}
+    results = []
+    for i, ids in enumerate(output[:, prompt_len:].tolist()):
+        # 去掉右侧 padding；遇到 eos 即视为正常结束
+        n_new, ended = len(ids), False
+        for pos, token in enumerate(ids):
+            if token in eos_ids:
+                n_new, ended = pos, True
+                break
+        closed = criteria is not None and criteria.scanners[i].closed
+        text = tokenizer.decode(ids[:n_new], skip_special_tokens=True)
+        results.append({
+            "predict": text,
+            "new_tokens": n_new,
+            "hit_budget": not ended and not closed and n_new >= budget,
+        })
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generation with per-row max_new_tokens budgets.")
+    parser.add_argument("--model_path", type=str, required=True)
+    parser.add_argument("--adapter_path", type=str, default=None, help="LoRA checkpoint (peft)")
+    parser.add_argument("--data_path", type=Path, required=True, help="转换结果 (.json/.jsonl)，可带 max_new_tokens")
+    parser.add_argument("--output_path", type=Path, required=True, help="generated_predictions.jsonl")
+    parser.add_argument("--prompts_path", type=Path, default=None, help="step_convert.py --prompt_ref 的 prompt 表")
+    parser.add_argument("--default_budget", type=int, default=512, help="行中没有 max_new_tokens 时的预算")
+    parser.add_argument("--max_budget", type=int, default=2048, help="单行预算上限")
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--temperature", type=float, default=0.0, help="0 为贪心解码")
+    parser.add_argument("--top_p", type=float, default=0.7)
+    parser.add_argument("--no_array_stop", action="store_true", help="不在 JSON 数组闭合时提前停止")
+    parser.add_argument("--load_in_4bit", action="store_true", help="bitsandbytes 4bit 量化加载")
+    parser.add_argument("--window", type=int, default=0,
+                        help="每 N 行（输入顺序）一个窗口，完成即追加写出，供 get_predict.py --follow 跟随；0 为整体合批")
+    parser.add_argument("--retry_path", type=Path, default=None,
+                        help="get_predict.py --retry_path 的输出：只重跑这些行并替换 --output_path 中的对应行")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    metrics = get_metrics("budgeted_infer")
+    prompts = json_io.load_json(args.prompts_path) if args.prompts_path else None
+
+    with metrics.stage("load_data") as st:
+        rows = list(json_io.iter_records(args.data_path))
+        budgets = {i: min(row.get("max_new_tokens") or args.default_budget, args.max_budget) for i, row in enumerate(rows)}
+        if args.retry_path is not None:
+            budgets = {r["index"]: min(r["budget"], args.max_budget) for r in json_io.iter_records(args.retry_path)}
+        st.rows = len(budgets)
+
+    with metrics.stage("load_model"):
+        model, tokenizer = load_model(args.model_path, args.adapter_path, load_in_4bit=args.load_in_4bit)
+
+    texts = {
+        i: tokenizer.apply_chat_template(build_messages(rows[i], prompts), tokenize=False, add_generation_prompt=True)
+        for i in budgets
+    }
+    results: Dict[int, Dict[str, Any]] = {}
+    from tqdm import tqdm
+
+    order = sorted(budgets)
+    window = args.window if args.window > 0 else max(len(order), 1)
+    # 非重跑模式边生成边写：每个窗口完成后按输入顺序追加并落盘（--follow 直接读目标文件，不能走临时文件）
+    streaming = json_io.JsonlWriter(args.output_path, atomic=False) if args.retry_path is None else nullcontext()
+    with metrics.stage("generate") as st, streaming as writer:
+        progress = tqdm(total=len(budgets), desc="Generating", unit="row")
+        for start in range(0, len(order), window):
+            chunk = order[start:start + window]
+            lengths = {i: len(texts[i]) for i in chunk}
+            for budget, indices in plan_batches({i: budgets[i] for i in chunk}, lengths, args.batch_size):
+                batch = generate_batch(
+                    model, tokenizer, [texts[i] for i in indices], budget,
+                    temperature=args.temperature, top_p=args.top_p, stop_on_closed_array=not args.no_array_stop,
+                )
+                for i, result in zip(indices, batch):
+                    results[i] = {"prompt": texts[i], **result, "label": rows[i].get("output", ""), "budget": budget}
+                    metrics.count("generate.hit_budget" if result["hit_budget"] else "generate.finished")
+                progress.update(len(indices))
+            if writer is not None:
+                writer.write_many(results[i] for i in chunk)
+                writer.flush()
+        progress.close()
+        st.rows = len(results)
+        st.extra["new_tokens"] = sum(r["new_tokens"] for r in results.values())
+        st.extra["budget_tokens"] = sum(r["budget"] for r in results.values())
+
+    if args.retry_path is not None:
+        # 原地替换：writer 先写临时文件再改名，中途失败不会损坏原预测
+        previous = list(json_io.iter_jsonl(args.output_path))
+        with json_io.open_writer(args.output_path) as writer:
+            writer.write_many(results.get(i, record) for i, record in enumerate(previous))
+
+    hit = sum(r["hit_budget"] for r in results.values())
+    print(f"✅ 生成 {len(results)} 条，触及预算上限 {hit} 条")
+    print(f"   新 token 数 {st.extra['new_tokens']} / 预算总和 {st.extra['budget_tokens']}")
+    print(f"💾 已保存到 {args.output_path}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
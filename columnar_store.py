@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流水线中间数据的列式二进制存储 (.rcol)
+
+- 低基数字符串列（system prompt、source、yes/no 标签等）做字典编码，只存一份
+- 字符串列表列（schema、coarse_types）共享一个列字典，按 int32 编码
+- 高基数字符串列（sentence、input）连续存放在一个 UTF-8 缓冲区 + offsets
+- 其他结构（output 三元组、history 等）以紧凑 JSON 存放在连续缓冲区
+- 读取通过 mmap + memoryview，零拷贝；按需解码单行/单列
+- 需要喂给 LLaMA-Factory 时再按需导出 JSON / JSONL
+
+用法:
+  python columnar_store.py pack data/train2.json data/train2.rcol
+  python columnar_store.py export data/step1_train2.rcol data/step1_train2.json
+  python columnar_store.py info data/train2.rcol
+"""
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Union
+
+import json_io
+
+MAGIC = b"RCOL1\n"
+_ALIGN = 8
+# 不同值数量不超过行数的该比例时，字符串列使用字典编码
+DICT_RATIO = 0.5
+
+KIND_DICT = "dict"
+KIND_STR = "str"
+KIND_LIST_DICT = "list_dict"
+KIND_JSON = "json"
+
+
+_json_dumps = json_io.dumps_bytes
+_json_loads = json_io.loads
+
+
+class _ColumnBuilder:
+    """按列累积数据，写盘时再确定最终编码方式。"""
+
+    def __init__(self, name: str, num_rows_before: int):
+        self.name = name
+        self.kind: Optional[str] = None
+        self.nulls = bytearray(b"\x01" * num_rows_before)
+        self.has_null = num_rows_before > 0
+        self.vocab: Dict[str, int] = {}
+
+    @staticmethod
+    def _infer_kind(value: Any) -> str:
+        if isinstance(value, str):
+            return KIND_DICT
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return KIND_LIST_DICT
+        return KIND_JSON
+
+    def _init_storage(self, kind: str) -> None:
+        """确定列类型，并为此前缺失的行补占位。"""
+        self.kind = kind
+        self.vocab = {}
+        n = len(self.nulls)
+        if kind == KIND_DICT:
+            self.codes = array("i", [-1] * n)
+        elif kind == KIND_LIST_DICT:
+            self.codes = array("i")
+            self.list_offsets = array("q", [0] * (n + 1))
+        else:
+            self.data = bytearray()
+            self.offsets = array("q", [0] * (n + 1))
+
+    def _intern(self, text: str) -> int:
+        code = self.vocab.get(text)
+        if code is None:
+            code = len(self.vocab)
+            self.vocab[text] = code
+        return code
+
+    def _values(self) -> List[Any]:
+        """还原已写入的值（仅在列类型退化为 json 时使用）。"""
+        words = list(self.vocab)
+        if self.kind == KIND_DICT:
+            return [None if c < 0 else words[c] for c in self.codes]
+        return [
+            [words[c] for c in self.codes[self.list_offsets[i]:self.list_offsets[i + 1]]]
+            for i in range(len(self.list_offsets) - 1)
+        ]
+
+    def _degrade_to_json(self) -> None:
+        values = self._values()
+        nulls = self.nulls
+        self.nulls = bytearray()
+        self._init_storage(KIND_JSON)
+        for is_null, value in zip(nulls, values):
+            self._append_value(value, bool(is_null))
+
+    def _append_value(self, value: Any, missing: bool) -> None:
+        self.nulls.append(1 if missing else 0)
+        if self.kind == KIND_DICT:
+            self.codes.append(-1 if missing else self._intern(value))
+        elif self.kind == KIND_LIST_DICT:
+            if not missing:
+                self.codes.extend(self._intern(v) for v in value)
+            self.list_offsets.append(len(self.codes))
+        else:
+            if not missing:
+                self.data += _json_dumps(value)
+            self.offsets.append(len(self.data))
+
+    def append(self, value: Any, missing: bool = False) -> None:
+        self.has_null = self.has_null or missing
+        if not missing:
+            kind = self._infer_kind(value)
+            if self.kind is None:
+                self._init_storage(kind)
+            elif self.kind != kind and self.kind != KIND_JSON:
+                self._degrade_to_json()
+        if self.kind is None:
+            self.nulls.append(1)
+            return
+        self._append_value(value, missing)
+
+    def finalize(self, num_rows: int) -> Dict[str, Any]:
+        """返回 {meta, buffers}，buffers 为 (名称, bytes-like) 列表。"""
+        if self.kind is None:
+            self._init_storage(KIND_JSON)
+            self.offsets = array("q", [0] * (num_rows + 1))
+        kind = self.kind
+        buffers: List[Any] = []
+        meta: Dict[str, Any] = {"name": self.name, "kind": kind}
+
+        if kind == KIND_DICT and len(self.vocab) > max(1, int(num_rows * DICT_RATIO)):
+            # 高基数：展开为连续字符串缓冲区
+            kind = KIND_STR
+            meta["kind"] = kind
+            words = [w.encode("utf-8") for w in self.vocab]
+            data = bytearray()
+            offsets = array("q", [0])
+            for code in self.codes:
+                if code >= 0:
+                    data += words[code]
+                offsets.append(len(data))
+            buffers.append(("offsets", offsets))
+            buffers.append(("data", data))
+        elif kind in (KIND_DICT, KIND_LIST_DICT):
+            dict_data = bytearray()
+            dict_offsets = array("q", [0])
+            for word in self.vocab:
+                dict_data += word.encode("utf-8")
+                dict_offsets.append(len(dict_data))
+            meta["dict_size"] = len(self.vocab)
+            buffers.append(("dict_offsets", dict_offsets))
+            buffers.append(("dict_data", dict_data))
+            buffers.append(("codes", self.codes))
+            if kind == KIND_LIST_DICT:
+                buffers.append(("list_offsets", self.list_offsets))
+        else:
+            buffers.append(("offsets", self.offsets))
+            buffers.append(("data", self.data))
+
+        if self.has_null:
+            buffers.append(("nulls", self.nulls))
+        return {"meta": meta, "buffers": buffers}
+
+
+def write_columnar(path: Union[str, Path], rows: Iterable[Dict[str, Any]]) -> int:
+    """将字典行写为 .rcol 文件，返回行数。"""
+    if sys.byteorder != "little":
+        raise RuntimeError("columnar_store 仅支持 little-endian 平台")
+
+    builders: Dict[str, _ColumnBuilder] = {}
+    num_rows = 0
+    for row in rows:
+        for key in row:
+            if key not in builders:
+                builders[key] = _ColumnBuilder(key, num_rows)
+        for key, builder in builders.items():
+            if key in row:
+                builder.append(row[key])
+            else:
+                builder.append(None, missing=True)
+        num_rows += 1
+
+    columns_meta: List[Dict[str, Any]] = []
+    payload: List[Any] = []
+    cursor = 0
+    for builder in builders.values():
+        result = builder.finalize(num_rows)
+        meta = result["meta"]
+        meta["buffers"] = {}
+        for buf_name, buf in result["buffers"]:
+            raw = memoryview(buf).cast("B")
+            meta["buffers"][buf_name] = [cursor, len(raw)]
+            payload.append(raw)
+            pad = (-len(raw)) % _ALIGN
+            if pad:
+                payload.append(b"\0" * pad)
+            cursor += len(raw) + pad
+        columns_meta.append(meta)
+
+    header = json.dumps(
+        {"num_rows": num_rows, "columns": columns_meta}, ensure_ascii=False
+    ).encode("utf-8")
+    prefix_len = len(MAGIC) + 8 + len(header)
+    header += b" " * ((-prefix_len) % _ALIGN)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack("<Q", len(header)))
+        fp.write(header)
+        for chunk in payload:
+            fp.write(chunk)
+    return num_rows
+
+
+class _Column:
+    """单列的只读视图，数据直接引用 mmap 内存。"""
+
+    def __init__(self, meta: Dict[str, Any], body: memoryview, views: List[memoryview]):
+        self.name: str = meta["name"]
+        self.kind: str = meta["kind"]
+
+        def buf(key: str, fmt: str = "B") -> memoryview:
+            start, size = meta["buffers"][key]
+            view = body[start:start + size]
+            views.append(view)
+            if fmt != "B":
+                view = view.cast(fmt)
+                views.append(view)
+            return view
+
+        self.nulls = buf("nulls") if "nulls" in meta["buffers"] else None
+        if self.kind in (KIND_DICT, KIND_LIST_DICT):
+            dict_offsets = buf("dict_offsets", "q")
+            dict_data = buf("dict_data")
+            self.dictionary: List[str] = [
+                str(dict_data[dict_offsets[i]:dict_offsets[i + 1]], "utf-8")
+                for i in range(len(dict_offsets) - 1)
+            ]
+            self.codes = buf("codes", "i")
+            self.list_offsets = buf("list_offsets", "q") if self.kind == KIND_LIST_DICT else None
+        else:
+            self.offsets = buf("offsets", "q")
+            self.data = buf("data")
+
+    def is_null(self, i: int) -> bool:
+        return self.nulls is not None and self.nulls[i] == 1
+
+    def raw(self, i: int) -> memoryview:
+        """str / json 列第 i 行的原始字节（零拷贝）。"""
+        return self.data[self.offsets[i]:self.offsets[i + 1]]
+
+    def value(self, i: int) -> Any:
+        if self.is_null(i):
+            return None
+        if self.kind == KIND_DICT:
+            return self.dictionary[self.codes[i]]
+        if self.kind == KIND_LIST_DICT:
+            start, end = self.list_offsets[i], self.list_offsets[i + 1]
+            return [self.dictionary[c] for c in self.codes[start:end]]
+        if self.kind == KIND_STR:
+            return str(self.raw(i), "utf-8")
+        return _json_loads(self.raw(i))
+
+
+class ColumnarDataset(Sequence):
+    """基于 mmap 的 .rcol 只读数据集，支持按行 / 按列访问。"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._fp = self.path.open("rb")
+        self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"Not a columnar (.rcol) file: {self.path}")
+        (header_len,) = struct.unpack_from("<Q", self._mm, len(MAGIC))
+        header_start = len(MAGIC) + 8
+        header = json.loads(self._mm[header_start:header_start + header_len])
+
+        # 记录所有引用 mmap 的 memoryview，close() 时逐个释放
+        self._views: List[memoryview] = [memoryview(self._mm)]
+        body = self._views[0][header_start + header_len:]
+        self._views.append(body)
+
+        self.num_rows: int = header["num_rows"]
+        self.columns: Dict[str, _Column] = {
+            meta["name"]: _Column(meta, body, self._views) for meta in header["columns"]
+        }
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(i) for i in range(*index.indices(self.num_rows))]
+        if index < 0:
+            index += self.num_rows
+        if not 0 <= index < self.num_rows:
+            raise IndexError(index)
+        return self.row(index)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self.num_rows):
+            yield self.row(i)
+
+    def row(self, i: int) -> Dict[str, Any]:
+        return {
+            name: col.value(i)
+            for name, col in self.columns.items()
+            if not col.is_null(i)
+        }
+
+    def column(self, name: str) -> List[Any]:
+        col = self.columns[name]
+        return [col.value(i) for i in range(self.num_rows)]
+
+    def dictionary(self, name: str) -> List[str]:
+        """字典编码列的取值表，配合 codes() 可直接做 group-by。"""
+        return self.columns[name].dictionary
+
+    def codes(self, name: str) -> memoryview:
+        """字典编码列的 int32 编码（零拷贝）。"""
+        return self.columns[name].codes
+
+    def close(self) -> None:
+        # 释放所有 memoryview 后才能关闭 mmap
+        self.columns = {}
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        try:
+            self._mm.close()
+        except BufferError:
+            # 调用方仍持有 codes() 等视图，交给 GC 回收
+            pass
+        self._fp.close()
+
+    def __enter__(self) -> "ColumnarDataset":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def export_rows(dataset: ColumnarDataset, output_path: Union[str, Path]) -> int:
+    """按需导出为 LLaMA-Factory 可读的 JSON / JSONL。"""
+    path = Path(output_path)
+    if path.suffix.lower() == ".jsonl":
+        json_io.write_jsonl(path, dataset)
+    else:
+        json_io.write_json(path, list(dataset))
+    return len(dataset)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="流水线中间数据的列式存储 (.rcol) 工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_pack = sub.add_parser("pack", help="JSON/JSONL → .rcol")
+    p_pack.add_argument("input_path", type=Path)
+    p_pack.add_argument("output_path", type=Path)
+
+    p_export = sub.add_parser("export", help=".rcol → JSON/JSONL")
+    p_export.add_argument("input_path", type=Path)
+    p_export.add_argument("output_path", type=Path)
+
+    p_info = sub.add_parser("info", help="查看 .rcol 列信息")
+    p_info.add_argument("input_path", type=Path)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        rows = json_io.load_json_or_jsonl(args.input_path)
+        n = write_columnar(args.output_path, rows)
+        before = args.input_path.stat().st_size
+        after = args.output_path.stat().st_size
+        print(f"✅ 已写入 {n} 行到 {args.output_path}")
+        print(f"   体积: {before / 1e6:.2f} MB → {after / 1e6:.2f} MB ({before / max(after, 1):.1f}x)")
+    elif args.command == "export":
+        with ColumnarDataset(args.input_path) as ds:
+            n = export_rows(ds, args.output_path)
+        print(f"💾 已导出 {n} 行到 {args.output_path}")
+    else:
+        with ColumnarDataset(args.input_path) as ds:
+            print(f"📊 {args.input_path}: {len(ds)} 行")
+            for name, col in ds.columns.items():
+                extra = f", 字典大小 {len(col.dictionary)}" if col.kind in (KIND_DICT, KIND_LIST_DICT) else ""
+                print(f"  {name}: {col.kind}{extra}")
+
+
+if __name__ == "__main__":
+    main()
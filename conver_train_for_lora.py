@@ -1,7 +1,15 @@
-import json
+import argparse
 import re
+from functools import partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import json_io
+from metrics import get_metrics
+from columnar_store import write_columnar
+from generation_budget import BudgetModel
+from indexed_jsonl import CachedLookup, open_dataset
+from target_format import TARGET_FORMATS, encode_target
 
 
 class LanguageDetector:
@@ -33,6 +41,8 @@ class BilingualREPromptFormatter:
 
     OUTPUT_HEADER_ZH = "请参考示例对当前输入进行抽取，输出 JSON 结果："
     OUTPUT_HEADER_EN = "Please refer to the examples and extract triples from the current input. Output the JSON result:"
+    COMPACT_OUTPUT_HEADER_ZH = "请参考示例对当前输入进行抽取，每行输出一个三元组："
+    COMPACT_OUTPUT_HEADER_EN = "Please refer to the examples and extract triples from the current input. Output one triple per line:"
 
     def __init__(self, detection_threshold: float = 0.5):
         self.detector = LanguageDetector()
@@ -42,12 +52,12 @@ class BilingualREPromptFormatter:
     def infer_language(self, sentence: str) -> str:
         return self.detector.detect_language(sentence, self.detection_threshold)
 
-    def _format_example_zh(self, idx: int, ex: Dict[str, Any]) -> str:
+    def _format_example_zh(self, idx: int, ex: Dict[str, Any], target_format: str = "json") -> str:
         sentence = ex.get("sentence", "").strip()
         schema = ex.get("schema", [])
         coarse_types = ex.get("coarse_types", [])
         output = ex.get("output", [])
-        output_str = json.dumps(output, ensure_ascii=False, separators=(',', ':'))
+        output_str = encode_target(output, target_format, ensure_ascii=False)
         return (
             f"示例{idx}：\n"
             f"输入：\n"
@@ -58,12 +68,12 @@ class BilingualREPromptFormatter:
             f"{output_str}"
         )
 
-    def _format_example_en(self, idx: int, ex: Dict[str, Any]) -> str:
+    def _format_example_en(self, idx: int, ex: Dict[str, Any], target_format: str = "json") -> str:
         sentence = ex.get("sentence", "").strip()
         schema = ex.get("schema", [])
         coarse_types = ex.get("coarse_types", [])
         output = ex.get("output", [])
-        output_str = json.dumps(output, separators=(',', ':'))
+        output_str = encode_target(output, target_format, ensure_ascii=True)
         return (
             f"Example {idx}:\n"
             f"Input:\n"
@@ -80,6 +90,7 @@ class BilingualREPromptFormatter:
         *,
         similar_samples: Optional[List[Dict[str, Any]]] = None,
         include_default_example: bool = False,
+        target_format: str = "json",
     ) -> str:
         sentence = sample.get("sentence", "")
         lang = self.infer_language(sentence)
@@ -96,12 +107,12 @@ class BilingualREPromptFormatter:
                 parts.append("#相似参考示例（供类比）:")
                 for i, ex in enumerate(similar_samples, 1):
                     if "output" in ex:
-                        parts.append(self._format_example_zh(i, ex))
+                        parts.append(self._format_example_zh(i, ex, target_format))
             else:
                 parts.append("#Similar Reference Examples (for analogy):")
                 for i, ex in enumerate(similar_samples, 1):
                     if "output" in ex:
-                        parts.append(self._format_example_en(i, ex))
+                        parts.append(self._format_example_en(i, ex, target_format))
         elif include_default_example:
             if lang == "zh":
                 default_ex = {
@@ -117,7 +128,7 @@ class BilingualREPromptFormatter:
                     ]    
                 }
                 parts.append("#相似参考示例（供类比）:")
-                parts.append(self._format_example_zh(1, default_ex))
+                parts.append(self._format_example_zh(1, default_ex, target_format))
             else:
                 default_ex = {
                     "sentence": "While southern France traditionally produces a galette in the shape of a crown and garnished with candied fruits , the chic bakery houses of Paris have dared to take liberties .",
@@ -142,7 +153,7 @@ class BilingualREPromptFormatter:
                     ]
                 }
                 parts.append("#Similar Reference Examples (for analogy):")
-                parts.append(self._format_example_en(1, default_ex))
+                parts.append(self._format_example_en(1, default_ex, target_format))
 
         # 2. Current input
         schema = sample.get("schema", [])
@@ -159,7 +170,10 @@ class BilingualREPromptFormatter:
             parts.append(f"Entity Coarse-Grained Types: {', '.join(coarse_types)}")
 
         # 3. Output header
-        parts.append(self.OUTPUT_HEADER_ZH if lang == "zh" else self.OUTPUT_HEADER_EN)
+        if target_format == "compact":
+            parts.append(self.COMPACT_OUTPUT_HEADER_ZH if lang == "zh" else self.COMPACT_OUTPUT_HEADER_EN)
+        else:
+            parts.append(self.OUTPUT_HEADER_ZH if lang == "zh" else self.OUTPUT_HEADER_EN)
 
         return "\n".join(parts).strip()
 
@@ -189,6 +203,21 @@ RE_SYSTEM_PROMPT_EN = """You are a relation extraction expert. Strictly extract
 4. fine_grained type should be reasonable and specific
 5. If no valid triples exist, return []"""
 
+# Compact target format (target_format.py): one "|"-separated line per triple
+RE_SYSTEM_PROMPT_COMPACT_ZH = """你是一名关系抽取专家，请严格按照指定格式抽取实体关系三元组，标注其中实体的粗粒度和细粒度。规则如下:
+1. 每行输出一个三元组，字段以 | 分隔: 主体名|主体粗粒度|主体细粒度|关系名|客体名|客体粗粒度|客体细粒度
+2. relationship 必须严格来自给定的关系候选列表，不得自行推断、改写或编造
+3. 粗粒度必须来自实体粗粒度候选候选列表
+4. 细粒度需合理、具体
+5. 若无有效三元组，输出 []"""
+
+RE_SYSTEM_PROMPT_COMPACT_EN = """You are a relation extraction expert. Strictly extract entity-relation triples and annotate coarse-grained and fine-grained types for entities. Rules:
+1. Output one triple per line, fields separated by |: subject|subject_coarse|subject_fine|relation|object|object_coarse|object_fine
+2. relationship must exactly match one from the relation candidates — do NOT infer, paraphrase, or invent
+3. coarse_grained type must be from the entity coarse-grained type candidates
+4. fine_grained type should be reasonable and specific
+5. If no valid triples exist, output []"""
+
 INSTRUCTION_ZH = "根据给定的文本和候选关系类型，提取三元组，并标注其中实体的粗粒度和细粒度类型"
 INSTRUCTION_EN = "Extract triples from the given text and relation candidates, annotating coarse-grained and fine-grained types for entities."
 
@@ -201,29 +230,82 @@ def _load_dataset(source: Union[str, Path, List[Dict[str, Any]]]) -> List[Dict[s
     if not path.exists():
         raise FileNotFoundError(f"Data source does not exist: {path}")
 
-    if path.suffix.lower() == ".jsonl":
-        with path.open("r", encoding="utf-8") as fp:
-            return [json.loads(line) for line in fp if line.strip()]
+    if path.suffix.lower() in (".jsonl", ".rcol"):
+        return json_io.load_json_or_jsonl(path)
 
-    with path.open("r", encoding="utf-8") as fp:
-        data = json.load(fp)
-        if isinstance(data, list):
-            return data
-        raise ValueError(f"Expected a list in JSON file, got {type(data)} from {path}")
+    data = json_io.load_json(path)
+    if isinstance(data, list):
+        return data
+    raise ValueError(f"Expected a list in JSON file, got {type(data)} from {path}")
 
 
 def _write_dataset(output_path: Union[str, Path], rows: List[Dict[str, Any]]) -> None:
-    path = Path(output_path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    if path.suffix.lower() == ".jsonl":
-        with path.open("w", encoding="utf-8") as fp:
-            for row in rows:
-                fp.write(json.dumps(row, ensure_ascii=False))
-                fp.write("\n")
+    json_io.write_dataset(output_path, rows)
+
+
+# Knowledge-base handle used to resolve "similar_ids" written by RAG4JSON --store_neighbor_ids.
+_KB_LOOKUP: Optional[CachedLookup] = None
+
+
+def open_neighbour_kb(kb_path: Optional[Union[str, Path]], cache_size: int = 4096) -> None:
+    """Open (or reset) the process-wide KB handle; also used as the worker-pool initializer."""
+    global _KB_LOOKUP
+    if _KB_LOOKUP is not None:
+        _KB_LOOKUP.close()
+    _KB_LOOKUP = CachedLookup(open_dataset(kb_path), maxsize=cache_size) if kb_path else None
+
+
+def format_training_item(
+    item: Dict[str, Any],
+    *,
+    include_default_example: bool = False,
+    target_format: str = "json",
+    budget_model: Optional[BudgetModel] = None,
+) -> Dict[str, Any]:
+    """Format a single raw sample into one SFT row; target_format="compact" uses target_format.py lines.
+
+    With budget_model the row also carries "max_new_tokens" (generation_budget.py), predicted from the
+    schema size, sentence length and the sample's optional "step1_verdict".
+    """
+
+    similar_samples = item.get("similar_samples")
+    if similar_samples and not isinstance(similar_samples, list):
+        similar_samples = list(similar_samples)  # best-effort fallback
+    if not similar_samples and item.get("similar_ids"):
+        if _KB_LOOKUP is None:
+            raise ValueError("Sample has similar_ids but no knowledge base was given (--kb_path).")
+        similar_samples = _KB_LOOKUP.resolve(item["similar_ids"])
+
+    prompt = PROMPT_FORMATTER.format(
+        item,
+        similar_samples=similar_samples,
+        include_default_example=include_default_example,
+        target_format=target_format,
+    )
+
+    output_content = item.get("output", [])
+    output_str = encode_target(output_content, target_format, ensure_ascii=False)
+
+    sentence = item.get("sentence", "")
+    language = PROMPT_FORMATTER.infer_language(sentence)
+    if target_format == "compact":
+        system_prompt = RE_SYSTEM_PROMPT_COMPACT_ZH if language == "zh" else RE_SYSTEM_PROMPT_COMPACT_EN
     else:
-        with path.open("w", encoding="utf-8") as fp:
-            json.dump(rows, fp, ensure_ascii=False, indent=2)
+        system_prompt = RE_SYSTEM_PROMPT_ZH if language == "zh" else RE_SYSTEM_PROMPT_EN
+    instruction_text = INSTRUCTION_ZH if language == "zh" else INSTRUCTION_EN
+
+    row = {
+        "instruction": instruction_text,
+        "input": prompt,
+        "output": output_str,
+        "system": system_prompt,
+        "history": [],
+    }
+    if budget_model is not None:
+        row["max_new_tokens"] = budget_model.predict(
+            item, verdict=item.get("step1_verdict"), target_format=target_format
+        )
+    return row
 
 
 def convert_to_training_data_format(
@@ -231,41 +313,21 @@ def convert_to_training_data_format(
     *,
     output_path: Optional[Union[str, Path]] = None,
     include_default_example: bool = False,
+    target_format: str = "json",
+    budget_model: Optional[BudgetModel] = None,
 ) -> List[Dict[str, Any]]:
     """Convert raw data (list/JSON/JSONL) to supervised fine-tuning format."""
 
     dataset = _load_dataset(data_source)
-    converted_data: List[Dict[str, Any]] = []
-
-    for idx, item in enumerate(dataset, start=1):
-        print(f"Processing item {idx}/{len(dataset)}...")
-
-        similar_samples = item.get("similar_samples")
-        if similar_samples and not isinstance(similar_samples, list):
-            similar_samples = list(similar_samples)  # best-effort fallback
-
-        prompt = PROMPT_FORMATTER.format(
+    converted_data = [
+        format_training_item(
             item,
-            similar_samples=similar_samples,
             include_default_example=include_default_example,
+            target_format=target_format,
+            budget_model=budget_model,
         )
-
-        output_content = item.get("output", [])
-        output_str = json.dumps(output_content, ensure_ascii=False, separators=(',', ':'))
-
-        sentence = item.get("sentence", "")
-        language = PROMPT_FORMATTER.infer_language(sentence)
-        system_prompt = RE_SYSTEM_PROMPT_ZH if language == "zh" else RE_SYSTEM_PROMPT_EN
-        instruction_text = INSTRUCTION_ZH if language == "zh" else INSTRUCTION_EN
-
-        converted_item = {
-            "instruction": instruction_text,
-            "input": prompt,
-            "output": output_str,
-            "system": system_prompt,
-            "history": [],
-        }
-        converted_data.append(converted_item)
+        for item in dataset
+    ]
 
     if output_path is not None:
         _write_dataset(output_path, converted_data)
@@ -273,14 +335,188 @@ def convert_to_training_data_format(
     return converted_data
 
 
-if __name__ == "__main__":
-    source_path = Path("/home/users/lhy/LLM4RE_2Round/data/test2_rag.jsonl")
-    target_path = Path("/home/users/lhy/LLM4RE_2Round/data/test2_rag_converted.json")
+def iter_training_data(
+    rows: Iterable[Dict[str, Any]],
+    *,
+    include_default_example: bool = False,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    kb_path: Optional[Union[str, Path]] = None,
+    kb_cache_size: int = 4096,
+    target_format: str = "json",
+    budget_model: Optional[BudgetModel] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Lazily format rows; with workers > 1 chunks are formatted in a process pool, order preserved.
+
+    kb_path resolves "similar_ids" through a bounded LRU over a random-access KB (.jsonl/.rcol),
+    opened once per process.
+    """
+
+    formatter = partial(
+        _format_chunk,
+        include_default_example=include_default_example,
+        target_format=target_format,
+        budget_model=budget_model,
+    )
+    chunks = json_io.chunked(rows, chunk_size)
+
+    if workers <= 1:
+        if kb_path:
+            open_neighbour_kb(kb_path, kb_cache_size)
+        for chunk in chunks:
+            yield from formatter(chunk)
+        return
 
-    converted = convert_to_training_data_format(
-        source_path,
-        include_default_example=True,
+    import multiprocessing
+
+    initargs = (kb_path, kb_cache_size)
+    with multiprocessing.Pool(processes=workers, initializer=open_neighbour_kb, initargs=initargs) as pool:
+        # imap 保序，且只会预取有限数量的 chunk，内存占用有界
+        for formatted in pool.imap(formatter, chunks):
+            yield from formatted
+
+
+def convert_to_training_data_streaming(
+    data_source: Union[str, Path],
+    output_path: Union[str, Path],
+    *,
+    include_default_example: bool = False,
+    workers: int = 1,
+    chunk_size: int = 1000,
+    kb_path: Optional[Union[str, Path]] = None,
+    kb_cache_size: int = 4096,
+    target_format: str = "json",
+    budget_model: Optional[BudgetModel] = None,
+    step1_verdicts: Optional[Union[str, Path]] = None,
+) -> int:
+    """Out-of-core variant: stream rows in, format them, and write them out incrementally.
+
+    step1_verdicts is a "yes"/"no" list aligned with the input (Step-1 predictions or step1_gate.py
+    decisions); "no" rows get the empty-output budget.
+    """
+
+    rows = json_io.iter_records(data_source)
+    if step1_verdicts is not None:
+        # 开始写出之前校验条数，避免对不齐的判定文件留下一份截断却看似完整的训练集
+        verdicts = _load_verdicts(step1_verdicts, data_source)
+        rows = ({**item, "step1_verdict": verdict} for item, verdict in zip(rows, verdicts))
+    converted = iter_training_data(
+        rows,
+        include_default_example=include_default_example,
+        workers=workers,
+        chunk_size=chunk_size,
+        kb_path=kb_path,
+        kb_cache_size=kb_cache_size,
+        target_format=target_format,
+        budget_model=budget_model,
     )
+    from tqdm import tqdm
+
+    progress = tqdm(converted, desc="Converting", unit="row")
+
+    if Path(output_path).suffix.lower() == ".rcol":
+        return write_columnar(output_path, progress)
 
-    _write_dataset(target_path, converted)
-    print(f"已将 {len(converted)} 条样本写入 {target_path}")
\ No newline at end of file
+    with json_io.open_writer(output_path) as writer:
+        writer.write_many(progress)
+        return writer.count
+
+
+def _load_verdicts(path: Union[str, Path], data_source: Union[str, Path]) -> List[Any]:
+    verdicts = json_io.load_json_or_jsonl(path)
+    dataset = open_dataset(data_source)
+    try:
+        n_rows = len(dataset)
+    finally:
+        close = getattr(dataset, "close", None)
+        if close is not None:
+            close()
+    if len(verdicts) != n_rows:
+        raise ValueError(f"--step1_verdicts has {len(verdicts)} verdicts but the data has {n_rows} samples")
+    return verdicts
+
+
+def _format_chunk(
+    chunk: List[Dict[str, Any]],
+    *,
+    include_default_example: bool,
+    target_format: str = "json",
+    budget_model: Optional[BudgetModel] = None,
+) -> List[Dict[str, Any]]:
+    return [
+        format_training_item(
+            item,
+            include_default_example=include_default_example,
+            target_format=target_format,
+            budget_model=budget_model,
+        )
+        for item in chunk
+    ]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Convert RAG-augmented data to LLaMA-Factory SFT format.")
+    parser.add_argument("--data_path", type=Path, default=Path("/home/users/lhy/LLM4RE_2Round/data/test2_rag.jsonl"),
+                        help="Input data (.json/.jsonl/.rcol).")
+    parser.add_argument("--output_path", type=Path, default=Path("/home/users/lhy/LLM4RE_2Round/data/test2_rag_converted.json"),
+                        help="Output path (.json/.jsonl/.rcol).")
+    parser.add_argument("--no_default_example", action="store_true",
+                        help="Do not add the built-in example when a sample has no similar_samples.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of formatting processes.")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="Rows per formatting chunk.")
+    parser.add_argument("--kb_path", type=Path, default=None,
+                        help="Knowledge base (.jsonl/.rcol) used to resolve similar_ids from RAG4JSON --store_neighbor_ids.")
+    parser.add_argument("--kb_cache_size", type=int, default=4096, help="LRU size for resolved KB examples.")
+    parser.add_argument("--target_format", choices=TARGET_FORMATS, default="json",
+                        help="Target/example serialization: json triple dicts, or compact one-line-per-triple "
+                             "(fewer generated tokens; decoded by get_predict.py).")
+    parser.add_argument("--attach_budget", action="store_true",
+                        help="Attach a per-row max_new_tokens (generation_budget.py) for budgeted_infer.py.")
+    parser.add_argument("--budget_model", type=Path, default=None,
+                        help="Budget table from `generation_budget.py fit`; heuristic budgets when omitted.")
+    parser.add_argument("--step1_verdicts", type=Path, default=None,
+                        help='"yes"/"no" list aligned with the input; "no" rows get the empty-output budget.')
+    parser.add_argument("--tokenizer", type=str, default=None,
+                        help="Also write a pre-tokenized token-id cache of the output (token_cache.py).")
+    parser.add_argument("--template", type=str, default="llama3", help="Chat template for --tokenizer.")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    metrics = get_metrics("conver_train_for_lora")
+    budget_model = BudgetModel.load(args.budget_model) if args.attach_budget else None
+    with metrics.stage("convert") as st:
+        count = convert_to_training_data_streaming(
+            args.data_path,
+            args.output_path,
+            include_default_example=not args.no_default_example,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            kb_path=args.kb_path,
+            kb_cache_size=args.kb_cache_size,
+            target_format=args.target_format,
+            budget_model=budget_model,
+            step1_verdicts=args.step1_verdicts,
+        )
+        st.rows = count
+        st.extra["workers"] = args.workers
+        if _KB_LOOKUP is not None:
+            info = _KB_LOOKUP.cache_info()
+            metrics.update({"hit": info.hits, "miss": info.misses}, prefix="kb_cache.")
+    print(f"已将 {count} 条样本写入 {args.output_path}")
+    if args.tokenizer:
+        from token_cache import build_cache, load_tokenizer
+
+        with metrics.stage("tokenize") as st:
+            cache_dir = build_cache(
+                args.output_path, load_tokenizer(args.tokenizer), tokenizer_name=args.tokenizer,
+                template=args.template, verify=100,
+            )
+            st.rows = count
+        print(f"已写出预分词缓存 {cache_dir}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
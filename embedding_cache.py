@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+持久化的句子向量缓存：sentence hash → embedding
+
+目录结构（只追加写）:
+  <cache_dir>/meta.json     编码模型名、向量维度、dtype
+  <cache_dir>/hashes.bin    每行 20 字节的 sha1(text)，行号即向量行号
+  <cache_dir>/vectors.f32   float32 行主序矩阵，按 numpy.memmap 只读映射
+
+- 知识库建索引和 query 编码都先查缓存，同一句子在任何一侧只编码一次，
+  train2 自增强（KB 与 query 为同一文件）和 dev/test 的重复运行不再重复计算
+- 写入只追加，进程中途退出时以 hashes 与 vectors 中较短的一方为准，不会读到半行
+- 不同模型的向量不能混用，meta.json 中的模型名不一致时直接报错
+
+用法:
+  cache = EmbeddingCache("cache/emb", model_name="BAAI/bge-m3")
+  encoder = CachedEncoder(load_encoder("BAAI/bge-m3"), cache)
+  vectors = encoder.encode(texts)
+"""
+
+import hashlib
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import json_io
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_HASH_SIZE = 20
+
+
+def sentence_hash(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """只追加的 mmap 向量矩阵 + 内存中的 hash → 行号索引。"""
+
+    def __init__(self, cache_dir: Union[str, Path], *, model_name: str, dim: Optional[int] = None):
+        import numpy as np
+
+        self._np = np
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.model_name = model_name
+        self._meta_path = self.cache_dir / "meta.json"
+        self._hashes_path = self.cache_dir / "hashes.bin"
+        self._vectors_path = self.cache_dir / "vectors.f32"
+
+        self.dim = dim
+        if self._meta_path.exists():
+            meta = json_io.load_json(self._meta_path)
+            if meta["model_name"] != model_name:
+                raise ValueError(
+                    f"Embedding cache {self.cache_dir} was built with {meta['model_name']}, not {model_name}"
+                )
+            if dim is not None and meta["dim"] != dim:
+                raise ValueError(f"Embedding cache dim mismatch: {meta['dim']} != {dim}")
+            self.dim = meta["dim"]
+
+        self._index: Dict[bytes, int] = {}
+        self._matrix: Optional["np.ndarray"] = None
+        self._rows = 0
+        if self.dim is not None:
+            self._load_index()
+
+    def _write_meta(self) -> None:
+        json_io.write_json(self._meta_path, {"model_name": self.model_name, "dim": self.dim, "dtype": "float32"})
+
+    def _load_index(self) -> None:
+        hashes = self._hashes_path.read_bytes() if self._hashes_path.exists() else b""
+        vector_bytes = self._vectors_path.stat().st_size if self._vectors_path.exists() else 0
+        # 异常退出时两个文件可能不等长，只信任两者都完整写入的行
+        rows = min(len(hashes) // _HASH_SIZE, vector_bytes // (4 * self.dim))
+        self._index = {hashes[i * _HASH_SIZE:(i + 1) * _HASH_SIZE]: i for i in range(rows)}
+        self._rows = rows
+        self._truncate(rows)
+        self._matrix = None
+
+    def _truncate(self, rows: int) -> None:
+        for path, row_size in ((self._hashes_path, _HASH_SIZE), (self._vectors_path, 4 * self.dim)):
+            if path.exists() and path.stat().st_size != rows * row_size:
+                with path.open("r+b") as fp:
+                    fp.truncate(rows * row_size)
+
+    @property
+    def matrix(self) -> "np.ndarray":
+        """整个缓存的只读 (rows, dim) 视图。"""
+        if self._matrix is None or self._matrix.shape[0] != self._rows:
+            if self._rows == 0:
+                self._matrix = self._np.empty((0, self.dim or 0), dtype=self._np.float32)
+            else:
+                self._matrix = self._np.memmap(
+                    self._vectors_path, dtype=self._np.float32, mode="r", shape=(self._rows, self.dim)
+                )
+        return self._matrix
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __contains__(self, text: str) -> bool:
+        return sentence_hash(text) in self._index
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[List[Optional[int]], List[bytes]]:
+        """返回每条文本在缓存中的行号（未命中为 None）以及各自的 hash。"""
+        keys = [sentence_hash(t) for t in texts]
+        return [self._index.get(k) for k in keys], keys
+
+    def get(self, text: str) -> Optional["np.ndarray"]:
+        row = self._index.get(sentence_hash(text))
+        return None if row is None else self._np.array(self.matrix[row])
+
+    def add(self, texts: Sequence[str], vectors: "np.ndarray") -> None:
+        """追加新向量；已存在的句子直接跳过。"""
+        vectors = self._np.ascontiguousarray(vectors, dtype=self._np.float32)
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            self._write_meta()
+            self._load_index()
+        elif not self._meta_path.exists():
+            self._write_meta()
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vectors, got {vectors.shape[1]}")
+
+        new_keys: List[bytes] = []
+        new_rows: List[int] = []
+        for i, text in enumerate(texts):
+            key = sentence_hash(text)
+            if key in self._index:
+                continue
+            self._index[key] = self._rows + len(new_keys)
+            new_keys.append(key)
+            new_rows.append(i)
+        if not new_keys:
+            return
+        # 先写向量再写 hash：hash 存在即意味着对应向量已完整落盘
+        with self._vectors_path.open("ab") as fp:
+            fp.write(vectors[new_rows].tobytes())
+        with self._hashes_path.open("ab") as fp:
+            fp.write(b"".join(new_keys))
+        self._rows += len(new_keys)
+
+
+class CachedEncoder:
+    """包装任意带 encode(texts) 方法的编码器，先查缓存，只编码未命中的去重句子。"""
+
+    def __init__(self, encoder: Any, cache: Optional[EmbeddingCache] = None, *, batch_size: int = 64, normalize: bool = True):
+        self.encoder = encoder
+        self.cache = cache
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.hits = 0
+        self.misses = 0
+
+    def _encode(self, texts: List[str]) -> "np.ndarray":
+        import numpy as np
+
+        vectors = np.asarray(
+            self.encoder.encode(texts, batch_size=self.batch_size, convert_to_numpy=True, show_progress_bar=len(texts) > 1000),
+            dtype=np.float32,
+        )
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+        return vectors
+
+    def encode_rows(self, texts: Sequence[str]) -> "np.ndarray":
+        """确保文本都在缓存中，返回各自在 cache.matrix 中的行号（不把向量读进内存）。"""
+        import numpy as np
+
+        texts = list(texts)
+        rows, _ = self.cache.lookup(texts)
+        missing = list(dict.fromkeys(t for t, row in zip(texts, rows) if row is None))
+        # 命中率按“避免的编码次数”统计：同一批内重复的句子也只编码一次
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if missing:
+            self.cache.add(missing, self._encode(missing))
+            rows, _ = self.cache.lookup(texts)
+        return np.asarray(rows, dtype=np.int64)
+
+    def encode(self, texts: Sequence[str]) -> "np.ndarray":
+        import numpy as np
+
+        texts = list(texts)
+        if self.cache is None:
+            self.misses += len(texts)
+            return self._encode(texts)
+
+        rows = self.encode_rows(texts)
+        if not texts:
+            return np.empty((0, self.cache.dim or 0), dtype=np.float32)
+        return np.asarray(self.cache.matrix[rows], dtype=np.float32)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CPU 句向量编码运行时：导出 ONNX + 动态 int8 量化 + 按 token 长度分桶
+
+没有 GPU 的增强机器上，RAG4JSON dense 后端的大部分时间花在 SentenceTransformer 的 PyTorch 前向上。这里：
+
+- export：把 sentence-transformers 模型的 Transformer 部分导出为 ONNX（batch / sequence 维动态），
+  再用 onnxruntime 做动态 int8 量化（权重 int8，激活运行时量化）；pooling 方式、max_seq_length
+  与 tokenizer 一起存入导出目录
+- OnnxEncoder：接口与 SentenceTransformer.encode 相同，可直接放进 embedding_cache.CachedEncoder。
+  先对全部句子分词，按 token 长度排序后切批，批内只补齐到本批最长（动态 padding），
+  每批 token 数不超过 max_batch_tokens，短句自动合成更大的批；
+  onnxruntime 图优化全开，intra-op 线程数默认等于 CPU 核数
+- bench：同一批句子上对比原编码器（PyTorch）与 ONNX fp32 / int8 的句子/秒，
+  以及向量漂移（与原向量的余弦相似度、句子间 top-10 近邻的重合率）
+
+量化后的向量与原模型有微小差异，retrieval.build_encoder 会给向量缓存使用带运行时后缀的模型名，
+两种向量不会混在同一个缓存 / 索引里。
+
+用法:
+  python encoder_runtime.py export --model_name sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 \
+      --output_dir saves/onnx/minilm
+  python encoder_runtime.py bench --onnx_dir saves/onnx/minilm --data_path data/dev2.json --text_key sentence
+  python RAG4JSON.py ... --retriever_backend dense --encoder_runtime onnx-int8 --onnx_dir saves/onnx/minilm
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+import json_io
+
+if TYPE_CHECKING:
+    import numpy as np
+
+RUNTIMES = ("torch", "onnx", "onnx-int8")
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+CONFIG_FILE = "runtime.json"
+
+
+# ----------------------------
+# 导出
+# ----------------------------
+
+def export(model_name: str, output_dir: Path, *, opset: int = 17, quantize: bool = True) -> Dict[str, Any]:
+    """导出 ONNX（输出 last_hidden_state，pooling 在 numpy 中做），可选动态 int8 量化；返回 runtime.json 内容。"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    pooling, normalize = "mean", False
+    for module in st:
+        if type(module).__name__ == "Pooling":
+            pooling = module.get_pooling_mode_str()
+        elif type(module).__name__ == "Normalize":
+            normalize = True
+    if pooling not in ("mean", "cls", "max"):
+        raise ValueError(f"Unsupported pooling mode {pooling!r} for ONNX export")
+
+    dummy = tokenizer(["导出示例 export example"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in dummy]
+
+    class _LastHidden(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(input_names, inputs))).last_hidden_state
+
+    axes = {0: "batch", 1: "sequence"}
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHidden(), tuple(dummy[name] for name in input_names), str(output_dir / FP32_FILE),
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes={name: axes for name in [*input_names, "last_hidden_state"]},
+            opset_version=opset, do_constant_folding=True,
+        )
+    tokenizer.save_pretrained(str(output_dir))
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(output_dir / FP32_FILE), str(output_dir / INT8_FILE), weight_type=QuantType.QInt8)
+
+    config = {
+        "model_name": model_name,
+        "pooling": pooling,
+        "normalize": normalize,
+        "max_seq_length": int(st.max_seq_length or tokenizer.model_max_length),
+        "input_names": input_names,
+        "opset": opset,
+        "quantized": quantize,
+    }
+    json_io.write_json(output_dir / CONFIG_FILE, config)
+    return config
+
+
+# ----------------------------
+# 运行时
+# ----------------------------
+
+def length_batches(lengths: Sequence[int], batch_size: int, max_batch_tokens: int) -> List[List[int]]:
+    """按 token 长度升序切批：每批不超过 batch_size 条，且 条数 × 本批最长 不超过 max_batch_tokens。"""
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches: List[List[int]] = []
+    batch: List[int] = []
+    for idx in order:
+        # 升序排列，加入 idx 后本批最长即为 lengths[idx]
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * lengths[idx] > max_batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _pool(hidden: "np.ndarray", mask: "np.ndarray", mode: str) -> "np.ndarray":
+    import numpy as np
+
+    if mode == "cls":
+        return hidden[:, 0]
+    if mode == "max":
+        return np.where(mask[:, :, None] > 0, hidden, -np.inf).max(axis=1)
+    weights = mask[:, :, None].astype(hidden.dtype)
+    return (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+
+class OnnxEncoder:
+    """onnxruntime 上的句向量编码器，encode() 与 SentenceTransformer.encode 兼容。"""
+
+    def __init__(
+        self,
+        onnx_dir: Path,
+        *,
+        quantized: bool = True,
+        threads: Optional[int] = None,
+        max_batch_tokens: int = 16384,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        onnx_dir = Path(onnx_dir)
+        self.config = json_io.load_json(onnx_dir / CONFIG_FILE)
+        model_path = onnx_dir / (INT8_FILE if quantized else FP32_FILE)
+        if not model_path.exists():
+            raise FileNotFoundError(f"{model_path} not found; run `encoder_runtime.py export` first")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = threads or os.cpu_count() or 1
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = AutoTokenizer.from_pretrained(str(onnx_dir))
+        self.max_seq_length = self.config["max_seq_length"]
+        self.max_batch_tokens = max_batch_tokens
+        self.threads = options.intra_op_num_threads
+
+    def encode(
+        self,
+        sentences: Sequence[str],
+        batch_size: int = 64,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+        normalize_embeddings: bool = False,
+        **kwargs: Any,
+    ) -> "np.ndarray":
+        import numpy as np
+
+        texts = [sentences] if isinstance(sentences, str) else list(sentences)
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length, padding=False)
+        ids = encoded["input_ids"]
+        pad_id = self.tokenizer.pad_token_id or 0
+        batches = length_batches([len(x) for x in ids], batch_size, self.max_batch_tokens)
+        out: Optional[np.ndarray] = None
+
+        progress = None
+        if show_progress_bar:
+            from tqdm import tqdm
+
+            progress = tqdm(total=len(texts), desc="Encoding", unit="sent")
+        for batch in batches:
+            width = max(len(ids[i]) for i in batch)
+            input_ids = np.full((len(batch), width), pad_id, dtype=np.int64)
+            mask = np.zeros((len(batch), width), dtype=np.int64)
+            for row, i in enumerate(batch):
+                input_ids[row, :len(ids[i])] = ids[i]
+                mask[row, :len(ids[i])] = 1
+            feeds = {"input_ids": input_ids, "attention_mask": mask, "token_type_ids": np.zeros_like(input_ids)}
+            hidden = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+            pooled = _pool(hidden, mask, self.config["pooling"])
+            if out is None:
+                out = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            out[batch] = pooled
+            if progress is not None:
+                progress.update(len(batch))
+        if progress is not None:
+            progress.close()
+
+        if out is None:
+            return np.empty((0, 0), dtype=np.float32)
+        if normalize_embeddings or self.config.get("normalize"):
+            out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out
+
+
+def load_runtime_encoder(
+    runtime: str, model_name: str, *, onnx_dir: Optional[Path] = None, device: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> Any:
+    """torch 为原 SentenceTransformer；onnx / onnx-int8 为导出目录中的 fp32 / int8 图。"""
+    if runtime == "torch":
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name, device=device)
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown encoder runtime {runtime!r}; expected one of {', '.join(RUNTIMES)}")
+    if onnx_dir is None:
+        raise ValueError(f"--encoder_runtime {runtime} needs --onnx_dir (see `encoder_runtime.py export`)")
+    config_path = Path(onnx_dir) / CONFIG_FILE
+    if not config_path.exists():
+        raise FileNotFoundError(f"{config_path} not found; run `encoder_runtime.py export --output_dir {onnx_dir}` first")
+    exported = json_io.load_json(config_path)["model_name"]
+    if exported != model_name:
+        raise ValueError(f"{onnx_dir} was exported from {exported}, not {model_name}")
+    return OnnxEncoder(Path(onnx_dir), quantized=runtime == "onnx-int8", threads=threads)
+
+
+# ----------------------------
+# 基准
+# ----------------------------
+
+def _normalized(vectors: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def neighbor_overlap(reference: "np.ndarray", vectors: "np.ndarray", k: int = 10) -> float:
+    """两组向量各自在句子集合内的 top-k 近邻（不含自身）重合率。"""
+    import numpy as np
+
+    k = min(k, len(reference) - 1)
+    if k <= 0:
+        return 1.0
+    found = 0
+    for start in range(0, len(reference), 1024):
+        rows = np.arange(start, min(start + 1024, len(reference)))
+        tops = []
+        for matrix in (reference, vectors):
+            scores = matrix[rows] @ matrix.T
+            scores[np.arange(len(rows)), rows] = -np.inf
+            tops.append(np.argpartition(-scores, k - 1, axis=1)[:, :k])
+        found += sum(len(np.intersect1d(a, b)) for a, b in zip(*tops))
+    return found / (k * len(reference))
+
+
+def benchmark(
+    texts: List[str], runtimes: Sequence[str], model_name: str, *, onnx_dir: Optional[Path],
+    batch_size: int, threads: Optional[int], k: int = 10,
+) -> List[Dict[str, Any]]:
+    """每个运行时先预热一批再计时编码全部句子；漂移以第一个运行时（通常为 torch）为基准。"""
+    import numpy as np
+
+    rows: List[Dict[str, Any]] = []
+    reference = None
+    for runtime in runtimes:
+        encoder = load_runtime_encoder(runtime, model_name, onnx_dir=onnx_dir, device="cpu", threads=threads)
+        encoder.encode(texts[:batch_size], batch_size=batch_size, convert_to_numpy=True)
+        start = time.perf_counter()
+        vectors = np.asarray(encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype=np.float32)
+        elapsed = time.perf_counter() - start
+        vectors = _normalized(vectors)
+        row: Dict[str, Any] = {"runtime": runtime, "seconds": elapsed, "sentences_per_s": len(texts) / elapsed}
+        if reference is None:
+            reference = vectors
+        else:
+            cosine = (reference * vectors).sum(axis=1)
+            row.update({
+                "cosine_mean": float(cosine.mean()),
+                "cosine_min": float(cosine.min()),
+                f"neighbor@{k}": neighbor_overlap(reference, vectors, k),
+            })
+        rows.append(row)
+    return rows
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    from retrieval import DEFAULT_ENCODER
+
+    parser = argparse.ArgumentParser(description="CPU embedding runtime: ONNX export, int8 quantization, benchmark.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export", help="导出 ONNX 并做动态 int8 量化")
+    p.add_argument("--model_name", type=str, default=DEFAULT_ENCODER)
+    p.add_argument("--output_dir", type=Path, required=True)
+    p.add_argument("--opset", type=int, default=17)
+    p.add_argument("--no_quantize", action="store_true", help="只导出 fp32 图")
+
+    p = sub.add_parser("bench", help="对比各运行时的句子/秒与向量漂移")
+    p.add_argument("--model_name", type=str, default=None, help="默认取导出目录记录的模型")
+    p.add_argument("--onnx_dir", type=Path, default=None)
+    p.add_argument("--data_path", type=Path, required=True)
+    p.add_argument("--text_key", type=str, default="input")
+    p.add_argument("--limit", type=int, default=2000, help="最多编码的句子数")
+    p.add_argument("--runtimes", nargs="+", default=list(RUNTIMES), choices=list(RUNTIMES),
+                   help="第一个运行时作为漂移的基准")
+    p.add_argument("--batch_size", type=int, default=64)
+    p.add_argument("--threads", type=int, default=None, help="intra-op 线程数（默认 CPU 核数）")
+    p.add_argument("--output_path", type=Path, default=None, help="结果 JSON 路径")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    from metrics import get_metrics
+
+    metrics = get_metrics(f"encoder_runtime.{args.command}")
+    if args.command == "export":
+        with metrics.stage("export"):
+            config = export(args.model_name, args.output_dir, opset=args.opset, quantize=not args.no_quantize)
+        sizes = {name: (args.output_dir / name).stat().st_size / (1 << 20)
+                 for name in (FP32_FILE, INT8_FILE) if (args.output_dir / name).exists()}
+        print(f"✅ 已导出 {config['model_name']}（pooling={config['pooling']}，max_seq_length={config['max_seq_length']}）")
+        for name, size in sizes.items():
+            print(f"   {name}: {size:.1f} MB")
+        print(f"💾 已保存到 {args.output_dir}")
+    else:
+        model_name = args.model_name
+        if model_name is None and args.onnx_dir is not None:
+            model_name = json_io.load_json(args.onnx_dir / CONFIG_FILE)["model_name"]
+        if model_name is None:
+            raise SystemExit("❌ 需要 --model_name 或 --onnx_dir")
+        texts = [t for t in (row.get(args.text_key, "") for row in json_io.iter_records(args.data_path)) if t.strip()]
+        texts = texts[: args.limit]
+        with metrics.stage("bench") as st:
+            rows = benchmark(texts, args.runtimes, model_name, onnx_dir=args.onnx_dir,
+                             batch_size=args.batch_size, threads=args.threads)
+            st.rows = len(texts) * len(rows)
+        print(f"📊 {len(texts)} 条句子，batch_size={args.batch_size}，threads={args.threads or os.cpu_count()}")
+        print(f"{'runtime':<10} {'sent/s':>9} {'speedup':>8} {'cos_mean':>9} {'cos_min':>8} {'nn@10':>6}")
+        fmt = lambda v, spec: format(v, spec) if v is not None else "-".rjust(int(spec.split(".")[0]))
+        for row in rows:
+            print(f"{row['runtime']:<10} {row['sentences_per_s']:>9.1f} "
+                  f"{row['sentences_per_s'] / rows[0]['sentences_per_s']:>7.2f}x "
+                  f"{fmt(row.get('cosine_mean'), '9.4f')} {fmt(row.get('cosine_min'), '8.4f')} "
+                  f"{fmt(row.get('neighbor@10'), '6.3f')}")
+        if args.output_path:
+            json_io.write_json(args.output_path, {"model_name": model_name, "sentences": len(texts), "results": rows})
+            print(f"💾 结果已保存到 {args.output_path}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+RAG4JSON 检索效果与延迟的离线评测：不用微调即可比较检索后端和参数
+
+质量指标（用 query 自身的金标 output 关系打分）:
+  overlap@k      选中示例的关系并集覆盖 query 金标关系的比例（只统计金标非空的 query）
+  hit@k          至少一个选中示例与 query 共享关系的比例
+  cand_overlap   top_k 原始候选的关系覆盖率，反映检索本身而非选择策略
+  both           同时拿到 output 为空与非空示例的 query 比例
+  coverage       至少拿到一个示例的 query 比例
+  r@f32          量化检索（--quantizations int8 binary）的候选中包含同一模型 float32 候选的比例，
+                 需要同时评测 none；其他行为 "-"
+性能指标:
+  p50/p95/p99    单条 query 的检索延迟（毫秒；批量检索时按批次耗时均摊）
+  build_s        建索引耗时
+  index_mb       建索引前后的 RSS 增量
+
+同一个后端/模型的索引只建一次，在其上遍历 top_k × threshold × selection 的组合，结果汇总成一张表。
+
+用法:
+  python eval_retrieval.py \
+    --knowledge_base_path data/train2.json --data_path data/dev2.json --text_key sentence \
+    --backends rag_utils dense --top_ks 10 20 --thresholds 0.5 0.6 --selections greedy mmr \
+    --output_path bench_results/retrieval_eval.json
+  python eval_retrieval.py ... --backends dense --quantizations none int8 binary --embedding_cache data/emb_cache
+"""
+
+import argparse
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import json_io
+from metrics import current_rss_mb, get_metrics
+from selection import greedy_select, is_empty_output, output_relations, select_batch
+
+
+def percentile(values: Sequence[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+# ----------------------------
+# 后端：统一成 build → search(queries, top_k, threshold) -> [(样本, 相似度, 向量或 None)]
+# ----------------------------
+
+SearchFn = Callable[[List[str], int, float], List[Tuple[List[Dict[str, Any]], List[float], Any]]]
+
+
+def build_rag_utils(kb: List[Dict[str, Any]], text_key: str, args: argparse.Namespace) -> SearchFn:
+    from rag_utils import Retriever, detect_language, separate_by_language
+
+    kb_zh, kb_en, _ = separate_by_language(kb, text_key=text_key)
+    retrievers = {"zh": Retriever(kb_zh, key=text_key), "en": Retriever(kb_en, key=text_key)}
+
+    def search(queries: List[str], top_k: int, threshold: float):
+        results = []
+        for query in queries:
+            retriever = retrievers["zh"] if detect_language(query) == "zh" else retrievers["en"]
+            examples, sims = retriever.retrieve(query=query, top_k=top_k, threshold=threshold)
+            results.append((examples, sims, None))
+        return results
+
+    return search
+
+
+def build_dense(
+    kb: List[Dict[str, Any]], text_key: str, args: argparse.Namespace, model_name: str, quantization: str = "none"
+) -> SearchFn:
+    from retrieval import DenseRetriever, build_encoder, detect_language, separate_by_language
+
+    encoder = build_encoder(model_name, cache_dir=args.embedding_cache, device=args.device)
+    kb_zh, kb_en, kb_other = separate_by_language(kb, text_key=text_key)
+    index = DenseRetriever(
+        kb_zh + kb_en + kb_other, key=text_key, encoder=encoder,
+        langs=["zh"] * len(kb_zh) + ["en"] * len(kb_en) + ["other"] * len(kb_other),
+        quantization=quantization, oversample=args.rerank_oversample,
+    )
+
+    def search(queries: List[str], top_k: int, threshold: float):
+        hits = index.search_batch(
+            queries, [detect_language(q) for q in queries], top_k=top_k, threshold=threshold,
+            cross_lingual=not args.no_cross_lingual,
+        )
+        # 与 RAG4JSON 一致：分区内为空时使用跨语言候选
+        return [primary if primary[0] or fallback is None else fallback for primary, fallback in hits]
+
+    return search
+
+
+def backend_configs(
+    args: argparse.Namespace,
+) -> List[Tuple[str, Callable[[List[Dict[str, Any]], str], SearchFn], Optional[str]]]:
+    """(名称, 构建函数, 对照的 float32 配置名或 None)；同一模型的 none 排在量化配置之前。"""
+    configs = []
+    for backend in args.backends:
+        if backend == "rag_utils":
+            configs.append(("rag_utils", lambda kb, key: build_rag_utils(kb, key, args), None))
+        elif backend == "dense":
+            from retrieval import DEFAULT_ENCODER
+
+            for model in args.encoder_models or [DEFAULT_ENCODER]:
+                for quant in sorted(args.quantizations, key=lambda q: q != "none"):
+                    name = f"dense:{model}" if quant == "none" else f"dense-{quant}:{model}"
+                    configs.append((
+                        name, lambda kb, key, m=model, q=quant: build_dense(kb, key, args, m, q),
+                        None if quant == "none" else f"dense:{model}",
+                    ))
+    return configs
+
+
+# ----------------------------
+# 评测
+# ----------------------------
+
+def exclude_self(
+    query: str, found: Tuple[List[Dict[str, Any]], List[float], Any], text_key: str, near_dups: frozenset = frozenset()
+):
+    """与 RAG4JSON 一致地排除自身：高相似度、文本相同，或与 query MinHash 近重复（near_dups 为归一化文本）。"""
+    examples, sims, vectors = found
+    keep = [
+        i for i, (ex, sim) in enumerate(zip(examples, sims))
+        if not (sim > 0.95 or ex.get(text_key, "").strip() == query.strip())
+    ]
+    if near_dups:
+        from near_dup import normalize_text
+
+        keep = [i for i in keep if normalize_text(examples[i].get(text_key, "").strip()) not in near_dups]
+    if vectors is not None:
+        vectors = vectors[keep]
+    return [examples[i] for i in keep], [sims[i] for i in keep], vectors
+
+
+def relation_overlap(gold: set, examples: Sequence[Dict[str, Any]]) -> float:
+    found = set()
+    for ex in examples:
+        found |= output_relations(ex)
+    return len(gold & found) / len(gold)
+
+
+def recall_vs(
+    reference: List[Tuple[List[Dict[str, Any]], List[float], Any]],
+    candidates: List[Tuple[List[Dict[str, Any]], List[float], Any]],
+) -> float:
+    """reference（float32）候选中同样出现在 candidates 里的比例；两者来自同一份知识库对象，按对象身份比较。"""
+    found = total = 0
+    for (ref, _, _), (got, _, _) in zip(reference, candidates):
+        got_ids = {id(ex) for ex in got}
+        found += sum(id(ex) in got_ids for ex in ref)
+        total += len(ref)
+    return found / total if total else 1.0
+
+
+def score_selection(
+    queries: List[Dict[str, Any]],
+    candidates: List[Tuple[List[Dict[str, Any]], List[float], Any]],
+    selected: List[List[int]],
+) -> Dict[str, float]:
+    overlap, hit, cand_overlap = [], [], []
+    both = covered = 0
+    for query, (examples, _, _), idx in zip(queries, candidates, selected):
+        chosen = [examples[i] for i in idx]
+        if chosen:
+            covered += 1
+            if any(is_empty_output(ex) for ex in chosen) and any(not is_empty_output(ex) for ex in chosen):
+                both += 1
+        gold = output_relations(query)
+        if gold:
+            overlap.append(relation_overlap(gold, chosen))
+            hit.append(float(any(output_relations(ex) & gold for ex in chosen)))
+            cand_overlap.append(relation_overlap(gold, examples))
+    n = len(queries) or 1
+    mean = lambda xs: sum(xs) / len(xs) if xs else 0.0
+    return {
+        "overlap@k": mean(overlap),
+        "hit@k": mean(hit),
+        "cand_overlap": mean(cand_overlap),
+        "both": both / n,
+        "coverage": covered / n,
+    }
+
+
+def evaluate_config(
+    search: SearchFn,
+    queries: List[Dict[str, Any]],
+    args: argparse.Namespace,
+    top_k: int,
+    threshold: float,
+    near_dups: Optional[List[frozenset]] = None,
+) -> Tuple[List[Tuple[List[Dict[str, Any]], List[float], Any]], List[float]]:
+    texts = [q.get(args.text_key, "") for q in queries]
+    near_dups = near_dups or [frozenset()] * len(texts)
+    candidates: List[Tuple[List[Dict[str, Any]], List[float], Any]] = []
+    latencies: List[float] = []
+    for start in range(0, len(texts), args.batch_size):
+        batch = texts[start:start + args.batch_size]
+        t0 = time.perf_counter()
+        found = search(batch, top_k, threshold)
+        elapsed = (time.perf_counter() - t0) * 1000 / len(batch)
+        latencies.extend([elapsed] * len(batch))
+        batch_dups = near_dups[start:start + args.batch_size]
+        candidates.extend(exclude_self(q, f, args.text_key, d) for q, f, d in zip(batch, found, batch_dups))
+    return candidates, latencies
+
+
+def select(
+    queries: List[Dict[str, Any]],
+    candidates: List[Tuple[List[Dict[str, Any]], List[float], Any]],
+    selection: str,
+    args: argparse.Namespace,
+) -> List[List[int]]:
+    if selection == "greedy":
+        return [greedy_select(ex, sims)[0] for ex, sims, _ in candidates]
+    picks: List[List[int]] = []
+    for start in range(0, len(queries), 256):
+        batch = [(q, *c) for q, c in zip(queries[start:start + 256], candidates[start:start + 256])]
+        picks.extend(select_batch(batch, text_key=args.text_key, k=args.k,
+                                  lam=args.mmr_lambda, coverage_weight=args.coverage_weight))
+    return picks
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = (f"{'backend':<40} {'top_k':>5} {'thr':>5} {'select':>7} {'ovl@k':>6} {'hit@k':>6} {'cand':>6} "
+              f"{'both':>6} {'cov':>6} {'r@f32':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'build_s':>8} {'idx_MB':>7}")
+    print(header)
+    print("-" * len(header))
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-".rjust(int(spec.split(".")[0]))
+    for r in rows:
+        print(
+            f"{r['backend'][:40]:<40} {r['top_k']:>5} {r['threshold']:>5.2f} {r['selection']:>7} "
+            f"{r['overlap@k']:>6.3f} {r['hit@k']:>6.3f} {r['cand_overlap']:>6.3f} {r['both']:>6.3f} {r['coverage']:>6.3f} "
+            f"{fmt(r['recall_vs_f32'], '6.3f')} "
+            f"{fmt(r['p50_ms'], '7.2f')} {fmt(r['p95_ms'], '7.2f')} {fmt(r['p99_ms'], '7.2f')} "
+            f"{r['build_s']:>8.2f} {fmt(r['index_mb'], '7.1f')}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="RAG4JSON 检索效果与延迟评测")
+    parser.add_argument("--knowledge_base_path", type=Path, required=True)
+    parser.add_argument("--data_path", type=Path, required=True, help="带金标 output 的评测数据")
+    parser.add_argument("--text_key", type=str, default="input")
+    parser.add_argument("--backends", nargs="+", default=["rag_utils", "dense"], choices=["rag_utils", "dense"])
+    parser.add_argument("--encoder_models", nargs="+", default=None, help="dense 后端要对比的编码模型")
+    parser.add_argument("--embedding_cache", type=str, default=None)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--no_cross_lingual", action="store_true")
+    parser.add_argument("--near_dup_threshold", type=float, default=0.8,
+                        help="MinHash 近重复阈值，与 query 近重复的知识库样本视为自身排除（同 RAG4JSON）；<=0 关闭")
+    parser.add_argument("--quantizations", nargs="+", default=["none"], choices=["none", "int8", "binary"],
+                        help="dense 后端第一遍扫描的向量量化；同时给出 none 时报告相对 float32 的召回 r@f32")
+    parser.add_argument("--rerank_oversample", type=int, default=None, help="量化检索取 top_k × N 个候选精确重排")
+    parser.add_argument("--top_ks", type=int, nargs="+", default=[20])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--selections", nargs="+", default=["greedy"], choices=["greedy", "mmr"])
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument("--mmr_lambda", type=float, default=0.7)
+    parser.add_argument("--coverage_weight", type=float, default=0.3)
+    parser.add_argument("--batch_size", type=int, default=1, help="检索批大小；1 时延迟即单条 query 延迟")
+    parser.add_argument("--limit", type=int, default=None, help="最多评测的 query 数")
+    parser.add_argument("--keep_empty_kb", action="store_true", help="知识库保留 output 为空的样本（RAG4JSON 默认过滤）")
+    parser.add_argument("--output_path", type=Path, default=None, help="结果 JSON 路径")
+    args = parser.parse_args(argv)
+    metrics = get_metrics("eval_retrieval")
+
+    kb = json_io.load_json_or_jsonl(args.knowledge_base_path)
+    if not args.keep_empty_kb:
+        kb = [s for s in kb if not is_empty_output(s)]
+    queries = [q for q in json_io.load_json_or_jsonl(args.data_path) if q.get(args.text_key, "").strip()]
+    if args.limit:
+        queries = queries[: args.limit]
+    print(f"📚 知识库 {len(kb)} 条，评测 query {len(queries)} 条")
+
+    # 每条 query 的近重复知识库文本只算一次，所有配置共用
+    near_dups = None
+    if args.near_dup_threshold > 0:
+        from near_dup import NearDupIndex, normalize_text
+
+        with metrics.stage("near_dup_index") as st:
+            near_dup_index = NearDupIndex(threshold=args.near_dup_threshold)
+            for kb_sample in kb:
+                text = kb_sample.get(args.text_key, "")
+                near_dup_index.add(normalize_text(text), text)
+            near_dups = [frozenset(near_dup_index.query(q.get(args.text_key, ""))) for q in queries]
+            st.rows = len(near_dup_index)
+        print(f"🧬 近重复排除 (MinHash/LSH, 阈值 {args.near_dup_threshold}): "
+              f"{sum(bool(d) for d in near_dups)} 条 query 在知识库中有近重复")
+
+    rows: List[Dict[str, Any]] = []
+    # float32 配置的候选，供同一模型的量化配置计算 r@f32
+    reference: Dict[Tuple[str, int, float], List[Tuple[List[Dict[str, Any]], List[float], Any]]] = {}
+    for name, build, reference_name in backend_configs(args):
+        rss_before = current_rss_mb()
+        t0 = time.perf_counter()
+        try:
+            with metrics.stage(f"build:{name}") as st:
+                search = build(kb, args.text_key)
+                st.rows = len(kb)
+        except ImportError as e:
+            print(f"⏭️ {name} 跳过 (missing dependency: {e.name or e})")
+            continue
+        build_s = time.perf_counter() - t0
+        rss_after = current_rss_mb()
+        index_mb = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+
+        for top_k in args.top_ks:
+            for threshold in args.thresholds:
+                with metrics.stage(f"search:{name}") as st:
+                    candidates, latencies = evaluate_config(search, queries, args, top_k, threshold, near_dups)
+                    st.rows = len(queries)
+                recall = None
+                if reference_name is None:
+                    reference[(name, top_k, threshold)] = candidates
+                elif (reference_name, top_k, threshold) in reference:
+                    recall = recall_vs(reference[(reference_name, top_k, threshold)], candidates)
+                for selection in args.selections:
+                    row = {
+                        "backend": name,
+                        "top_k": top_k,
+                        "threshold": threshold,
+                        "selection": selection,
+                        "k": args.k if selection == "mmr" else 2,
+                        **score_selection(queries, candidates, select(queries, candidates, selection, args)),
+                        "recall_vs_f32": recall,
+                        "p50_ms": percentile(latencies, 0.50),
+                        "p95_ms": percentile(latencies, 0.95),
+                        "p99_ms": percentile(latencies, 0.99),
+                        "build_s": build_s,
+                        "index_mb": index_mb,
+                    }
+                    rows.append(row)
+
+    print()
+    print_table(rows)
+    if args.output_path:
+        json_io.write_json(args.output_path, {"config": {k: str(v) for k, v in vars(args).items()}, "results": rows})
+        print(f"\n💾 评测结果已保存到: {args.output_path}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,12 @@ import argparse
 # ----------------------------
 
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
+
+import json_io
+from generation_budget import is_truncated, retry_budget
+from indexed_jsonl import IndexedJsonl
+from metrics import get_metrics
 
 def normalize_generation_text(text: str) -> str:
     cleaned = text.strip().replace("\u200b", "")
@@ -133,54 +138,74 @@ def ensure_parsed_output(text: str, sample: Dict[str, Any]) -> Dict[str, Any]:
 # 主逻辑：按顺序对齐处理（支持外部参数）
 # ----------------------------
 
-def main(predictions_path: str, test_data_path: str, output_path: str):
-    # 1. 加载测试数据（保持顺序）
-    with open(test_data_path, "r", encoding="utf-8") as f:
-        test_samples = json.load(f)  # list of dicts
-
-    # 2. 逐行读取预测结果（保持顺序）
-    predict_strings = []
-    with open(predictions_path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                item = json.loads(line)
-                predict_strings.append(item.get("predict", ""))
-            except json.JSONDecodeError:
-                predict_strings.append("")  # 解析失败则为空
-
-    # 3. 对齐并处理
-    if len(test_samples) != len(predict_strings):
-        print(f"⚠️ 警告：测试样本数 ({len(test_samples)}) 与预测行数 ({len(predict_strings)}) 不一致！")
-
-    final_results = []
-    for i, sample in enumerate(test_samples):
-        if i >= len(predict_strings):
-            predict_str = ""
-        else:
-            predict_str = predict_strings[i]
-
-        # 使用你的 postprocess 函数解析
-        result = ensure_parsed_output(predict_str, sample)
-        final_results.append(result)
-
-    # 4. 保存结果
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(final_results, f, ensure_ascii=False, indent=2)
-
-    print(f"✅ 成功处理 {len(final_results)} 条样本，结果已保存至 {output_path}")
-
-if __name__ == "__main__":
+def prediction_string(item: Any) -> str:
+    # 解析失败则为空
+    return item.get("predict", "") if isinstance(item, dict) else ""
+
+
+def main(
+    predictions_path: str,
+    test_data_path: str,
+    output_path: str,
+    align_key: Optional[str] = None,
+    retry_path: Optional[str] = None,
+):
+    metrics = get_metrics("extract_prediction")
+
+    # 1. 为测试数据与预测结果建立字节偏移索引（不整体加载，按下标随机读取）
+    with metrics.stage("index") as st:
+        test_samples = IndexedJsonl(test_data_path)
+        predictions = IndexedJsonl(predictions_path)
+        st.rows = len(predictions)
+
+    if align_key is None and len(test_samples) != len(predictions):
+        print(f"⚠️ 警告：测试样本数 ({len(test_samples)}) 与预测行数 ({len(predictions)}) 不一致！")
+
+    # 2. 对齐并处理：默认按下标，给出 align_key 时按预测行中的该字段对齐
+    retries = []
+    with metrics.stage("parse") as st, json_io.JsonArrayWriter(output_path) as writer:
+        for i, sample in enumerate(test_samples):
+            row = i if align_key is None else predictions.position(sample.get(align_key), key=align_key)
+            item = None if row is None else predictions.get(row)
+            # 使用你的 postprocess 函数解析
+            text = prediction_string(item)
+            writer.write(ensure_parsed_output(text, sample))
+            # 生成触及 max_new_tokens 上限（budgeted_infer.py 的 hit_budget）或 JSON 数组未闭合
+            if is_truncated(text, item):
+                metrics.count("parse.truncated")
+                # index 为预测文件中的行号：budgeted_infer.py --retry_path 按它替换预测行
+                retries.append({"index": row, "budget": retry_budget(item)})
+        st.rows = writer.count
+    test_samples.close()
+    predictions.close()
+
+    print(f"✅ 成功处理 {writer.count} 条样本，结果已保存至 {output_path}")
+    if retries:
+        print(f"⚠️ {len(retries)} 条生成可能被截断")
+    if retry_path:
+        with json_io.open_writer(retry_path) as retry_writer:
+            retry_writer.write_many(retries)
+        print(f"🔁 重跑列表已保存至 {retry_path}")
+    metrics.finish()
+
+def cli(argv=None):
     parser = argparse.ArgumentParser(description="Parse and align model predictions with test data.")
     parser.add_argument("--predictions_path", type=str, required=True, help="Path to generated_predictions.jsonl")
     parser.add_argument("--test_data_path", type=str, required=True, help="Path to test data JSON file")
     parser.add_argument("--output_path", type=str, required=True, help="Output JSON file path")
+    parser.add_argument("--align_key", type=str, default=None,
+                        help="按该字段（如 id）对齐预测与样本；默认按行号对齐")
+    parser.add_argument("--retry_path", type=str, default=None,
+                        help="被截断的行写成 JSONL {index, budget}，供 budgeted_infer.py --retry_path 加大预算重跑")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     main(
         predictions_path=args.predictions_path,
         test_data_path=args.test_data_path,
-        output_path=args.output_path
-    )
\ No newline at end of file
+        output_path=args.output_path,
+        align_key=args.align_key,
+        retry_path=args.retry_path,
+    )
+
+if __name__ == "__main__":
+    cli()
\ No newline at end of file
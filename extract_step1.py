@@ -1,18 +1,13 @@
-import json
 import os
 import argparse
 
+import json_io
+from metrics import get_metrics
+
 def load_json_or_jsonl(path):
     """加载 JSON 或 JSONL 文件"""
     assert os.path.exists(path), f"❌ File not found: {path}"
-    if path.endswith(".json"):
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    elif path.endswith(".jsonl"):
-        with open(path, "r", encoding="utf-8") as f:
-            data = [json.loads(line) for line in f]
-    else:
-        raise ValueError(f"Unsupported file type: {path}")
+    data = json_io.load_json_or_jsonl(path)
     print(f"✅ 已加载 {path}, 样本数: {len(data)}")
     return data
 
@@ -29,19 +24,23 @@ def extract_predicts(data):
 
 def save_json(data, path):
     """保存为 JSON 文件"""
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    json_io.write_json(path, data)
     print(f"💾 已保存到 {path}")
 
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description="提取 JSON/JSONL 文件中的 predict 字段")
     parser.add_argument("--input_path", type=str, required=True, help="输入文件路径 (.json 或 .jsonl)")
     parser.add_argument("--output_path", type=str, required=True, help="输出 JSON 文件路径")
-    args = parser.parse_args()
-
-    data = load_json_or_jsonl(args.input_path)
-    predicts = extract_predicts(data)
-    save_json(predicts, args.output_path)
+    args = parser.parse_args(argv)
+
+    metrics = get_metrics("extract_step1")
+    with metrics.stage("extract") as st:
+        data = load_json_or_jsonl(args.input_path)
+        predicts = extract_predicts(data)
+        save_json(predicts, args.output_path)
+        st.rows = len(data)
+    metrics.update({"yes": predicts.count("yes"), "no": predicts.count("no")}, prefix="predict.")
+    metrics.finish()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于知识库三元组实体名的 Aho-Corasick 实体预筛
+
+- 从 KB 样本 output 中的 subject / object 名称（及其粗类型）、已知 (subject, object) → 关系 建立词典
+- Aho-Corasick 自动机一遍扫描句子，找出全部词典实体的出现位置（大小写不敏感；
+  以 ASCII 字母数字开头/结尾的名称要求词边界，中文名称不要求）
+- 最长不重叠匹配计数实体提及，并列出句中同时出现的已知实体对及其关系
+- 自动机序列化为 JSON（json_io 编解码），加载后无需重建
+
+信号用途：
+- step1_gate.py --gazetteer：提及数 / 已知实体对作为分类特征；置信带内出现 schema 内已知实体对的样本直接判 yes
+- get_predict.py --span_check：校验预测三元组的 subject / object 是否出现在句子中、是否为已知实体
+
+用法:
+  python gazetteer.py build --kb_paths data/train2.json --output_path data/gazetteer.json
+  python gazetteer.py scan --gazetteer data/gazetteer.json --input_path data/dev2.json
+"""
+
+import argparse
+import time
+from collections import Counter, deque
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import json_io
+from metrics import get_metrics
+
+_VERSION = 1
+
+# (起始下标, 结束下标, 名称 id)
+Match = Tuple[int, int, int]
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def normalize_name(name: Any) -> str:
+    return str(name).strip().lower() if name is not None else ""
+
+
+def triple_names(triple: Dict[str, Any]) -> Tuple[Optional[Tuple[str, str]], Optional[Tuple[str, str]]]:
+    """三元组的 (subject 名称, 粗类型), (object 名称, 粗类型)；字段缺失时为 None。"""
+    ends = []
+    for key in ("subject", "object"):
+        value = triple.get(key)
+        if isinstance(value, list) and value:
+            ends.append((str(value[0]), str(value[1]) if len(value) > 1 else ""))
+        else:
+            ends.append(None)
+    return ends[0], ends[1]
+
+
+class Gazetteer:
+    """实体名词典 + Aho-Corasick 自动机。"""
+
+    def __init__(
+        self,
+        names: List[str],
+        types: Optional[List[List[str]]] = None,
+        pairs: Optional[Dict[Tuple[int, int], Set[str]]] = None,
+    ):
+        self.names = names
+        self.types = types if types is not None else [[] for _ in names]
+        self.pairs = pairs or {}
+        self._ids = {name: i for i, name in enumerate(names)}
+        self._lengths = [len(name) for name in names]
+        self._bounded = [(_is_word_char(n[0]), _is_word_char(n[-1])) for n in names]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[int] = [-1]
+        self._fail: List[int] = [0]
+        self._link: List[int] = [0]
+
+    # ----------------------------
+    # 构建
+    # ----------------------------
+
+    @classmethod
+    def from_samples(cls, samples: Iterable[Dict[str, Any]], *, min_len: int = 2) -> "Gazetteer":
+        """从 KB 样本的 output 三元组收集实体名、粗类型与已知实体对。"""
+        ids: Dict[str, int] = {}
+        names: List[str] = []
+        types: List[Set[str]] = []
+        pairs: Dict[Tuple[int, int], Set[str]] = {}
+
+        def add(entry: Optional[Tuple[str, str]]) -> Optional[int]:
+            if entry is None:
+                return None
+            name = normalize_name(entry[0])
+            if len(name) < min_len:
+                return None
+            i = ids.get(name)
+            if i is None:
+                i = ids[name] = len(names)
+                names.append(name)
+                types.append(set())
+            if entry[1]:
+                types[i].add(entry[1])
+            return i
+
+        for sample in samples:
+            output = sample.get("output")
+            if not isinstance(output, list):
+                continue
+            for triple in output:
+                if not isinstance(triple, dict):
+                    continue
+                subject, obj = triple_names(triple)
+                s, o = add(subject), add(obj)
+                if s is not None and o is not None and s != o:
+                    pairs.setdefault((s, o), set()).add(str(triple.get("relationship")))
+        gazetteer = cls(names, [sorted(t) for t in types], pairs)
+        gazetteer.build()
+        return gazetteer
+
+    def build(self) -> None:
+        """插入全部名称，再按 BFS 计算失败指针与输出链接（最近的、本身是名称结尾的失败祖先）。"""
+        goto, out = [{}], [-1]
+        for pid, name in enumerate(self.names):
+            node = 0
+            for ch in name:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = goto[node][ch] = len(goto)
+                    goto.append({})
+                    out.append(-1)
+                node = nxt
+            out[node] = pid
+        fail = [0] * len(goto)
+        link = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                f = goto[f].get(ch, 0)
+                fail[child] = f if f != child else 0
+                link[child] = f if out[f] >= 0 else link[f]
+                queue.append(child)
+        self._goto, self._out, self._fail, self._link = goto, out, fail, link
+
+    # ----------------------------
+    # 匹配
+    # ----------------------------
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def find(self, text: str) -> Iterator[Match]:
+        """逐字符推进自动机，产出全部（可重叠）匹配；text 需已小写。"""
+        goto, fail, out, link = self._goto, self._fail, self._out, self._link
+        lengths, bounded = self._lengths, self._bounded
+        size = len(text)
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            o = node if out[node] >= 0 else link[node]
+            while o:
+                pid = out[o]
+                start = i + 1 - lengths[pid]
+                left, right = bounded[pid]
+                if not (left and start > 0 and _is_word_char(text[start - 1])) and \
+                        not (right and i + 1 < size and _is_word_char(text[i + 1])):
+                    yield start, i + 1, pid
+                o = link[o]
+
+    def mentions(self, text: str) -> List[Match]:
+        """最长优先、互不重叠的实体提及。"""
+        found = sorted(self.find(text.lower()), key=lambda m: (m[0], m[0] - m[1]))
+        chosen: List[Match] = []
+        end = 0
+        for match in found:
+            if match[0] >= end:
+                chosen.append(match)
+                end = match[1]
+        return chosen
+
+    def scan(self, text: str, schema: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        一遍扫描给出：提及数、去重实体、句中同时出现的已知实体对（给出 schema 时只保留 schema 内关系）。
+        """
+        mentions = self.mentions(text)
+        ids = list(dict.fromkeys(pid for _, _, pid in mentions))
+        allowed = set(schema) if schema is not None else None
+        pairs = []
+        for a in ids:
+            for b in ids:
+                rels = self.pairs.get((a, b)) if a != b else None
+                if not rels:
+                    continue
+                for rel in sorted(rels):
+                    if allowed is None or rel in allowed:
+                        pairs.append((self.names[a], rel, self.names[b]))
+        return {
+            "mentions": len(mentions),
+            "entities": [self.names[i] for i in ids],
+            "pairs": pairs,
+        }
+
+    def lookup(self, name: Any) -> Optional[int]:
+        return self._ids.get(normalize_name(name))
+
+    # ----------------------------
+    # 序列化
+    # ----------------------------
+
+    def save(self, path: Path) -> None:
+        payload = {
+            "version": _VERSION,
+            "names": self.names,
+            "types": self.types,
+            "pairs": [[s, o, sorted(rels)] for (s, o), rels in self.pairs.items()],
+            "goto": self._goto,
+            "fail": self._fail,
+            "out": self._out,
+            "link": self._link,
+        }
+        json_io.write_json(path, payload, indent=False)
+
+    @classmethod
+    def load(cls, path: Path) -> "Gazetteer":
+        payload = json_io.load_json(path)
+        if payload.get("version") != _VERSION:
+            raise ValueError(f"Unsupported gazetteer version in {path}: {payload.get('version')}")
+        pairs = {(s, o): set(rels) for s, o, rels in payload["pairs"]}
+        gazetteer = cls(payload["names"], payload["types"], pairs)
+        gazetteer._goto = payload["goto"]
+        gazetteer._fail = payload["fail"]
+        gazetteer._out = payload["out"]
+        gazetteer._link = payload["link"]
+        return gazetteer
+
+
+def span_flags(sentence: str, triple: Dict[str, Any], gazetteer: Optional[Gazetteer] = None) -> Dict[str, bool]:
+    """
+    校验一个预测三元组：subject / object 名称是否出现在句子中；
+    给出 gazetteer 时再检查是否为已知实体、粗类型是否与 KB 一致、是否为已知实体对。
+    """
+    text = (sentence or "").lower()
+    subject, obj = triple_names(triple)
+    flags = {
+        "subject_in_text": subject is not None and normalize_name(subject[0]) in text,
+        "object_in_text": obj is not None and normalize_name(obj[0]) in text,
+    }
+    if gazetteer is not None:
+        s = gazetteer.lookup(subject[0]) if subject else None
+        o = gazetteer.lookup(obj[0]) if obj else None
+        flags["subject_known"] = s is not None
+        flags["object_known"] = o is not None
+        flags["type_consistent"] = all(
+            i is None or not entry[1] or not gazetteer.types[i] or entry[1] in gazetteer.types[i]
+            for i, entry in ((s, subject), (o, obj))
+            if entry is not None
+        )
+        flags["known_pair"] = s is not None and o is not None and (s, o) in gazetteer.pairs
+    return flags
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def cmd_build(args: argparse.Namespace) -> None:
+    metrics = get_metrics("gazetteer.build")
+    with metrics.stage("build") as st:
+        def samples() -> Iterator[Dict[str, Any]]:
+            for path in args.kb_paths:
+                yield from json_io.iter_records(path)
+
+        gazetteer = Gazetteer.from_samples(samples(), min_len=args.min_len)
+        st.rows = len(gazetteer)
+        st.extra.update({"states": len(gazetteer._goto), "pairs": len(gazetteer.pairs)})
+    with metrics.stage("save"):
+        gazetteer.save(args.output_path)
+    print(f"✅ 实体名 {len(gazetteer)} 个，自动机状态 {len(gazetteer._goto)} 个，已知实体对 {len(gazetteer.pairs)} 个")
+    print(f"💾 已保存到 {args.output_path}")
+    metrics.finish()
+
+
+def cmd_scan(args: argparse.Namespace) -> None:
+    metrics = get_metrics("gazetteer.scan")
+    with metrics.stage("load"):
+        gazetteer = Gazetteer.load(args.gazetteer)
+    stats: Counter = Counter()
+    scan_output = json_io.open_writer(args.output_path) if args.output_path else nullcontext()
+    with metrics.stage("scan") as st, scan_output as writer:
+        elapsed = 0.0
+        for sample in json_io.iter_records(args.input_path):
+            start = time.perf_counter()
+            hit = gazetteer.scan(sample.get("sentence", ""), sample.get("schema"))
+            elapsed += time.perf_counter() - start
+            stats["total"] += 1
+            bucket = "2+" if hit["mentions"] >= 2 else str(hit["mentions"])
+            stats[f"mentions={bucket}"] += 1
+            stats["with_pair"] += bool(hit["pairs"])
+            output = sample.get("output")
+            if isinstance(output, list):
+                # gold 非空却提及不足 2 个的样本数：预筛若据此判 no 会漏掉的样本
+                stats[f"gold_nonempty.mentions={bucket}"] += bool(output)
+                stats["gold_nonempty.with_pair"] += bool(output) and bool(hit["pairs"])
+                stats["gold_empty.with_pair"] += (not output) and bool(hit["pairs"])
+            if writer is not None:
+                writer.write({"mentions": hit["mentions"], "entities": hit["entities"], "pairs": hit["pairs"]})
+        st.rows = stats["total"]
+    metrics.update(dict(stats), prefix="gazetteer.")
+    total = max(stats["total"], 1)
+    print(f"✅ 扫描 {stats['total']} 条，平均 {elapsed / total * 1e6:.1f} µs/句")
+    for key in sorted(stats):
+        if key != "total":
+            print(f"   {key}: {stats[key]}")
+    metrics.finish()
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Aho-Corasick gazetteer built from KB triple entity names.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("build", help="从 KB 样本构建并保存自动机")
+    p.add_argument("--kb_paths", type=Path, nargs="+", required=True, help="知识库 (.json/.jsonl/.rcol)")
+    p.add_argument("--output_path", type=Path, required=True)
+    p.add_argument("--min_len", type=int, default=2, help="忽略短于该字符数的实体名")
+
+    p = sub.add_parser("scan", help="扫描数据集，统计提及数与已知实体对")
+    p.add_argument("--gazetteer", type=Path, required=True)
+    p.add_argument("--input_path", type=Path, required=True)
+    p.add_argument("--output_path", type=Path, default=None, help="逐条扫描结果 (.json/.jsonl)")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    {"build": cmd_build, "scan": cmd_scan}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+逐样本的生成长度预算（max_new_tokens）
+
+- Step-1 / Step-2 的 yes/no 行只需几个 token：STEP_BUDGET
+- 三元组抽取行：按 (关系候选数, 句长) 分桶查表得到三元组个数的高分位数，
+  乘以每个三元组的 token 数（json / compact 目标格式不同）再加固定开销；
+  Step-1 判定为 no 的样本只需输出 []
+- 预算向上取整到 BUDGET_BUCKETS 中的档位，推理时同档位的行可以合成一批
+- 表由 fit 子命令从带 gold output 的数据统计（可选用真实 tokenizer 计 token 数）；不 fit 时用启发式
+
+转换脚本（conver_train_for_lora.py / step*_convert.py）用 --attach_budget 给每行写入 max_new_tokens，
+budgeted_infer.py 按行预算生成，并在 JSON 数组闭合时提前停止；
+get_predict.py / extract_prediction.py 标记触顶（可能被截断）的行，写出 --retry_path 供加大预算重跑。
+
+用法:
+  python generation_budget.py fit --data_paths data/train2.json --output_path data/budget.json
+  python generation_budget.py report --data_path data/test2_rag_converted.json
+"""
+
+import argparse
+import math
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+import json_io
+
+BUDGET_BUCKETS = (8, 16, 32, 64, 128, 256, 512)
+STEP_BUDGET = 8
+EMPTY_BUDGET = 8
+DEFAULT_TOKENS_PER_TRIPLE = {"json": 48, "compact": 24}
+DEFAULT_OVERHEAD = 8
+
+_FENCE = re.compile(r"^```(?:json)?|```$")
+
+
+def bucket_budget(tokens: int, *, cap: int = BUDGET_BUCKETS[-1]) -> int:
+    """向上取整到最近的预算档位，不超过 cap。"""
+    for bucket in BUDGET_BUCKETS:
+        if tokens <= bucket:
+            return min(bucket, cap)
+    return cap
+
+
+def _length_bucket(sentence: str) -> int:
+    return min(len(sentence or "") // 50, 6)
+
+
+def _schema_bucket(schema: Any) -> int:
+    return min(len(schema or []), 8)
+
+
+class BudgetModel:
+    """(关系候选数, 句长) 分桶 → 三元组个数的高分位数；不在表中的桶用启发式。"""
+
+    def __init__(
+        self,
+        table: Optional[Dict[str, int]] = None,
+        *,
+        tokens_per_triple: Optional[Dict[str, int]] = None,
+        overhead: int = DEFAULT_OVERHEAD,
+        cap: int = BUDGET_BUCKETS[-1],
+    ):
+        self.table = table or {}
+        self.tokens_per_triple = dict(DEFAULT_TOKENS_PER_TRIPLE, **(tokens_per_triple or {}))
+        self.overhead = overhead
+        self.cap = cap
+
+    @staticmethod
+    def key(sample: Dict[str, Any]) -> str:
+        return f"{_schema_bucket(sample.get('schema'))}:{_length_bucket(sample.get('sentence', ''))}"
+
+    def expected_triples(self, sample: Dict[str, Any]) -> int:
+        found = self.table.get(self.key(sample))
+        if found is not None:
+            return found
+        # 启发式：句子越长可能的三元组越多，且通常不超过关系候选数的两倍
+        schema = sample.get("schema") or []
+        return max(1, min(2 * len(schema), 1 + len(sample.get("sentence") or "") // 30))
+
+    def predict(self, sample: Dict[str, Any], *, verdict: Optional[str] = None, target_format: str = "json") -> int:
+        """一个抽取样本的 max_new_tokens；verdict 为 Step-1 的 "yes"/"no"。"""
+        if isinstance(verdict, str) and verdict.strip().lower().startswith("no"):
+            return EMPTY_BUDGET
+        per_triple = self.tokens_per_triple.get(target_format, DEFAULT_TOKENS_PER_TRIPLE["json"])
+        return bucket_budget(self.overhead + per_triple * self.expected_triples(sample), cap=self.cap)
+
+    @classmethod
+    def fit(
+        cls,
+        samples: Iterable[Dict[str, Any]],
+        *,
+        quantile: float = 0.99,
+        tokenizer: Any = None,
+        cap: int = BUDGET_BUCKETS[-1],
+    ) -> "BudgetModel":
+        """由 gold output 统计每个分桶的三元组个数分位数；给出 tokenizer 时再统计每个三元组的 token 数。"""
+        from target_format import encode_target
+
+        counts: Dict[str, List[int]] = defaultdict(list)
+        per_triple: Dict[str, List[float]] = {"json": [], "compact": []}
+        for sample in samples:
+            output = sample.get("output")
+            if not isinstance(output, list):
+                continue
+            counts[cls.key(sample)].append(len(output))
+            if tokenizer is not None and output:
+                for fmt in per_triple:
+                    n_tokens = len(tokenizer.encode(encode_target(output, fmt), add_special_tokens=False))
+                    per_triple[fmt].append(n_tokens / len(output))
+
+        def upper(values: List[float]) -> int:
+            values = sorted(values)
+            return int(math.ceil(values[min(len(values) - 1, int(quantile * len(values)))]))
+
+        table = {key: max(1, upper(values)) for key, values in counts.items()}
+        tokens = {fmt: upper(values) for fmt, values in per_triple.items() if values}
+        return cls(table, tokens_per_triple=tokens, cap=cap)
+
+    def save(self, path: Path) -> None:
+        json_io.write_json(path, {
+            "table": self.table,
+            "tokens_per_triple": self.tokens_per_triple,
+            "overhead": self.overhead,
+            "cap": self.cap,
+        })
+
+    @classmethod
+    def load(cls, path: Optional[Path]) -> "BudgetModel":
+        """path 为 None 时返回启发式模型。"""
+        if path is None:
+            return cls()
+        payload = json_io.load_json(path)
+        return cls(
+            payload["table"],
+            tokens_per_triple=payload.get("tokens_per_triple"),
+            overhead=payload.get("overhead", DEFAULT_OVERHEAD),
+            cap=payload.get("cap", BUDGET_BUCKETS[-1]),
+        )
+
+
+# ----------------------------
+# JSON 数组闭合检测
+# ----------------------------
+
+class ArrayScanner:
+    """增量扫描生成文本，顶层 JSON 数组闭合（括号深度回到 0）时 closed 置真；字符串内的括号忽略。"""
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.closed = False
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if self.closed:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = self.started
+            elif ch in "[{":
+                if not self.started and ch == "[":
+                    self.started = True
+                if self.started:
+                    self.depth += 1
+            elif ch in "]}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+        return self.closed
+
+
+def is_truncated(text: str, record: Any = None) -> bool:
+    """
+    推理记录标了 hit_budget（budgeted_infer.py），或文本以 [ 开头但数组未闭合时视为被截断。
+    """
+    if isinstance(record, dict) and record.get("hit_budget"):
+        return True
+    stripped = _FENCE.sub("", (text or "").strip()).strip()
+    if not stripped.startswith("["):
+        return False
+    scanner = ArrayScanner()
+    return not scanner.feed(stripped)
+
+
+def retry_budget(record: Any, *, default: int = BUDGET_BUCKETS[-1], cap: int = 2048) -> int:
+    """重跑时的预算：原预算翻倍；记录中没有 budget（如 LLaMA-Factory 固定 512 的输出）时按 default 翻倍。"""
+    budget = record.get("budget") if isinstance(record, dict) else None
+    return min(2 * (budget or default), cap)
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Per-row max_new_tokens budgets for generation.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fit", help="从带 gold output 的数据统计预算表")
+    p.add_argument("--data_paths", type=Path, nargs="+", required=True)
+    p.add_argument("--output_path", type=Path, required=True)
+    p.add_argument("--quantile", type=float, default=0.99)
+    p.add_argument("--tokenizer", type=str, default=None, help="统计每个三元组 token 数所用的 tokenizer")
+    p.add_argument("--cap", type=int, default=BUDGET_BUCKETS[-1])
+
+    p = sub.add_parser("report", help="统计转换结果中的预算分布，与固定 512 对比")
+    p.add_argument("--data_path", type=Path, required=True)
+    p.add_argument("--flat_budget", type=int, default=512)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    from metrics import get_metrics
+
+    metrics = get_metrics(f"generation_budget.{args.command}")
+    if args.command == "fit":
+        tokenizer = None
+        if args.tokenizer:
+            from transformers import AutoTokenizer
+
+            tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, trust_remote_code=True)
+
+        def samples():
+            for path in args.data_paths:
+                yield from json_io.iter_records(path)
+
+        with metrics.stage("fit") as st:
+            model = BudgetModel.fit(samples(), quantile=args.quantile, tokenizer=tokenizer, cap=args.cap)
+            st.rows = len(model.table)
+        model.save(args.output_path)
+        print(f"✅ 预算表 {len(model.table)} 个分桶，每三元组 token 数 {model.tokens_per_triple}")
+        print(f"💾 已保存到 {args.output_path}")
+    else:
+        budgets: Counter = Counter()
+        with metrics.stage("report") as st:
+            for row in json_io.iter_records(args.data_path):
+                budgets[row.get("max_new_tokens", args.flat_budget)] += 1
+            st.rows = sum(budgets.values())
+        total = sum(budgets.values())
+        steps = sum(b * n for b, n in budgets.items())
+        print(f"✅ {total} 行，预算上限总和 {steps}（固定 {args.flat_budget} 时为 {args.flat_budget * total}，"
+              f"减少 {1 - steps / max(args.flat_budget * total, 1):.1%}）")
+        for budget in sorted(budgets):
+            print(f"   max_new_tokens={budget}: {budgets[budget]}")
+        metrics.update({str(b): n for b, n in budgets.items()}, prefix="budget.")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,16 @@
 import argparse
 import ast
 import json
+import os
 import re
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import json_io
+from generation_budget import is_truncated, retry_budget
+from indexed_jsonl import IndexedJsonl, open_dataset
+from metrics import get_metrics
+from target_format import decode_compact, looks_compact
 
 
 def normalize_generation_text(text: Optional[str]) -> str:
@@ -21,6 +28,11 @@ def extract_output(text: str) -> List[Dict[str, Any]]:
     cleaned = normalize_generation_text(text)
     if not cleaned:
         return []
+    # conver_train_for_lora.py --target_format compact：每行一个 | 分隔的三元组
+    if looks_compact(cleaned):
+        triples = decode_compact(cleaned)
+        if triples:
+            return triples
 
     candidates: List[Any] = []
     try:
@@ -69,62 +81,291 @@ def ensure_parsed_output(text: str, sample: Dict[str, Any], index: int) -> Dict[
     return {"id": sample_id, "sentence": sentence, "output": output}
 
 
-def load_test_data(path: Path) -> List[Dict[str, Any]]:
-    content = path.read_text(encoding="utf-8").strip()
-    if not content:
-        return []
-    if path.suffix.lower() == ".jsonl":
-        return [json.loads(line) for line in content.splitlines() if line.strip()]
-    return json.loads(content)
+def _triple_key(triple: Dict[str, Any], strict: bool) -> Optional[tuple]:
+    subject, obj = triple.get("subject"), triple.get("object")
+    if not isinstance(subject, list) or not isinstance(obj, list) or not subject or not obj:
+        return None
+    if strict:
+        return (tuple(map(str, subject)), str(triple.get("relationship")), tuple(map(str, obj)))
+    return (str(subject[0]), str(triple.get("relationship")), str(obj[0]))
 
 
-def load_predictions(path: Path) -> List[str]:
-    lines = []
-    with path.open("r", encoding="utf-8") as fp:
-        for raw in fp:
-            raw = raw.strip()
-            if not raw:
-                continue
-            record = json.loads(raw)
-            if isinstance(record, str):
-                lines.append(record)
-                continue
-            for key in ("generation", "text", "output_text", "response", "predict"):
-                if key in record and isinstance(record[key], str):
-                    lines.append(record[key])
-                    break
-            else:
-                lines.append("")
-    return lines
+def score_predictions(
+    predictions: Iterable[List[Dict[str, Any]]],
+    golds: Iterable[List[Dict[str, Any]]],
+    *,
+    strict: bool = False,
+) -> Dict[str, float]:
+    """Micro P/R/F1 over triples; strict=True also requires matching coarse/fine types."""
+    tp = n_pred = n_gold = 0
+    for pred, gold in zip(predictions, golds):
+        row_tp, row_pred, row_gold = score_counts(pred, gold, strict=strict)
+        tp += row_tp
+        n_pred += row_pred
+        n_gold += row_gold
+    return scores_from_counts(tp, n_pred, n_gold)
+
+
+def score_counts(
+    pred: List[Dict[str, Any]], gold: List[Dict[str, Any]], *, strict: bool = False
+) -> Tuple[int, int, int]:
+    """One sample's (true positives, predicted, gold) triple counts."""
+    pred_keys = {k for k in (_triple_key(t, strict) for t in pred) if k is not None}
+    gold_keys = {k for k in (_triple_key(t, strict) for t in gold) if k is not None}
+    return len(pred_keys & gold_keys), len(pred_keys), len(gold_keys)
+
+
+def scores_from_counts(tp: int, n_pred: int, n_gold: int) -> Dict[str, float]:
+    precision = tp / n_pred if n_pred else 0.0
+    recall = tp / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "tp": tp, "n_pred": n_pred, "n_gold": n_gold}
 
 
-def write_results(path: Path, rows: Iterable[Dict[str, Any]]) -> None:
-    data = list(rows)
-    with path.open("w", encoding="utf-8") as fp:
-        json.dump(data, fp, ensure_ascii=False, indent=2)
+def prediction_text(record: Any) -> str:
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        for key in ("generation", "text", "output_text", "response", "predict"):
+            if key in record and isinstance(record[key], str):
+                return record[key]
+    return ""
 
 
-def parse_args() -> argparse.Namespace:
+def load_predictions(path: Path) -> List[str]:
+    return [prediction_text(record) for record in json_io.iter_jsonl(path)]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Extract LLM predictions into eval-ready format.")
     parser.add_argument("--predictions_path", required=True, type=Path, help="LLM prediction JSONL path.")
     parser.add_argument("--test_data_path", required=True, type=Path, help="Original test data JSON/JSONL path.")
     parser.add_argument("--output_path", required=True, type=Path, help="Where to save converted results (JSON).")
-    return parser.parse_args()
+    parser.add_argument("--align_key", type=str, default=None,
+                        help="Align predictions to samples by this field (e.g. id) instead of by line number.")
+    parser.add_argument("--span_check", choices=["off", "report", "drop"], default="off",
+                        help="Check that predicted subject/object names occur in the sentence; "
+                             "'drop' removes triples whose spans are missing.")
+    parser.add_argument("--gazetteer", type=Path, default=None,
+                        help="Gazetteer from gazetteer.py; adds known-entity / type / known-pair checks to --span_check.")
+    parser.add_argument("--retry_path", type=Path, default=None,
+                        help="Write rows whose generation hit its max_new_tokens budget (or left the JSON array "
+                             "unclosed) as JSONL {index, budget} for `budgeted_infer.py --retry_path`.")
+    parser.add_argument("--follow", action="store_true",
+                        help="Tail a predictions JSONL that is still being written: parse rows as they appear, "
+                             "keep a running score and checkpoint progress (rerun to resume).")
+    parser.add_argument("--poll_interval", type=float, default=1.0, help="Seconds between polls in --follow mode.")
+    parser.add_argument("--idle_timeout", type=float, default=600.0,
+                        help="Stop --follow after this many seconds without new rows (progress is kept).")
+    parser.add_argument("--checkpoint_path", type=Path, default=None,
+                        help="Follow checkpoint (default: <output_path>.follow.json).")
+    parser.add_argument("--report_every", type=int, default=100,
+                        help="Print the running score and save a checkpoint every N rows in --follow mode.")
+    args = parser.parse_args(argv)
+    if args.follow and args.align_key is not None:
+        parser.error("--follow aligns predictions by line number; --align_key is not supported")
+    return args
+
+
+def check_spans(result: Dict[str, Any], gazetteer: Any, drop: bool, metrics: Any) -> None:
+    """统计（并按需删除）subject / object 不在句子中的三元组。"""
+    from gazetteer import span_flags
+
+    kept = []
+    for triple in result["output"]:
+        flags = span_flags(result["sentence"], triple, gazetteer)
+        for name, ok in flags.items():
+            metrics.count(f"span.{name}" if ok else f"span.not_{name}")
+        if drop and not (flags["subject_in_text"] and flags["object_in_text"]):
+            metrics.count("span.dropped")
+            continue
+        kept.append(triple)
+    result["output"] = kept
+
+
+def parse_row(
+    idx: int, sample: Dict[str, Any], record: Any, args: argparse.Namespace, gazetteer: Any, metrics: Any,
+    *, row: Optional[int] = None,
+) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+    """
+    解析一条预测；返回 (结果, 重跑项或 None)。
+    重跑项的 index 是预测文件中的行号 row（budgeted_infer.py 按它替换行），缺省与样本下标 idx 相同。
+    """
+    text = prediction_text(record)
+    result = ensure_parsed_output(text, sample, idx)
+    retry = None
+    if is_truncated(text, record):
+        metrics.count("parse.truncated")
+        retry = {"index": idx if row is None else row, "budget": retry_budget(record)}
+    if args.span_check != "off":
+        check_spans(result, gazetteer, args.span_check == "drop", metrics)
+    metrics.count("parse.empty" if not result["output"] else "parse.nonempty")
+    return result, retry
 
 
-def main() -> None:
-    args = parse_args()
-    test_samples = load_test_data(args.test_data_path)
-    predict_strings = load_predictions(args.predictions_path)
+def _print_scores(scores: Dict[str, float], prefix: str = "") -> None:
+    print(f"[INFO] {prefix}P={scores['precision']:.4f} R={scores['recall']:.4f} F1={scores['f1']:.4f}")
 
-    final_results: List[Dict[str, Any]] = []
-    for idx, sample in enumerate(test_samples):
-        prediction = predict_strings[idx] if idx < len(predict_strings) else ""
-        final_results.append(ensure_parsed_output(prediction, sample, idx))
 
+def _write_retries(args: argparse.Namespace, retries: List[Dict[str, Any]]) -> None:
+    if retries:
+        print(f"[WARN] {len(retries)} 条生成触及 max_new_tokens 上限，可能被截断")
+    if args.retry_path is not None:
+        with json_io.open_writer(args.retry_path) as retry_writer:
+            retry_writer.write_many(retries)
+        print(f"[INFO] 重跑列表写入 {args.retry_path}")
+
+
+def follow(args: argparse.Namespace, gazetteer: Any, metrics: Any) -> None:
+    """
+    --follow：推理仍在追加写预测文件时逐行解析，累计 P/R/F1。
+    已解析的结果先追加到 <output>.partial.jsonl，每 report_every 行把（预测文件偏移、部分结果长度、
+    累计计数）原子写入断点；中断或空闲超时后重新运行会从断点继续。全部行到齐后写出与非 follow
+    模式相同的 JSON 数组并删除中间文件。
+    """
+    partial_path = args.output_path.with_name(args.output_path.name + ".partial.jsonl")
+    checkpoint_path = args.checkpoint_path or args.output_path.with_name(args.output_path.name + ".follow.json")
+    state: Dict[str, Any] = {
+        "offset": 0, "partial_bytes": 0, "rows": 0,
+        "tp": 0, "n_pred": 0, "n_gold": 0, "has_gold": True, "retries": [],
+    }
+    if checkpoint_path.exists():
+        state.update(json_io.load_json(checkpoint_path))
+        print(f"[INFO] 从断点继续：已解析 {state['rows']} 行（{checkpoint_path}）")
+    args.output_path.parent.mkdir(parents=True, exist_ok=True)
+    # 断点之后才写入的部分结果作废，从断点处的预测重新解析
+    with partial_path.open("ab") as fp:
+        fp.truncate(state["partial_bytes"])
+
+    test_samples = open_dataset(args.test_data_path)
+    total = len(test_samples)
+
+    def save_checkpoint(writer: json_io.JsonlWriter) -> None:
+        state["partial_bytes"] = writer.tell()
+        tmp_path = checkpoint_path.with_name(checkpoint_path.name + ".tmp")
+        json_io.write_json(tmp_path, state)
+        os.replace(tmp_path, checkpoint_path)
+
+    with metrics.stage("follow") as st, json_io.JsonlWriter(partial_path, append=True) as writer:
+        rows = json_io.follow_jsonl(
+            args.predictions_path, offset=state["offset"], poll_interval=args.poll_interval,
+            idle_timeout=args.idle_timeout, stop=lambda: state["rows"] >= total, skip_invalid=True,
+        )
+        for record, offset in rows:
+            idx = state["rows"]
+            if idx >= total:
+                print(f"[WARN] 预测行数多于测试样本（{total}），忽略多余的行")
+                break
+            sample = test_samples[idx]
+            result, retry = parse_row(idx, sample, record, args, gazetteer, metrics)
+            writer.write(result)
+            if retry is not None:
+                state["retries"].append(retry)
+            if state["has_gold"] and "output" in sample:
+                row_tp, row_pred, row_gold = score_counts(result["output"], sample["output"])
+                state["tp"] += row_tp
+                state["n_pred"] += row_pred
+                state["n_gold"] += row_gold
+            else:
+                state["has_gold"] = False
+            state["rows"] += 1
+            state["offset"] = offset
+            if state["rows"] % args.report_every == 0 or state["rows"] == total:
+                save_checkpoint(writer)
+                if state["has_gold"]:
+                    scores = scores_from_counts(state["tp"], state["n_pred"], state["n_gold"])
+                    _print_scores(scores, f"{state['rows']}/{total} ")
+                else:
+                    print(f"[INFO] {state['rows']}/{total}")
+            if state["rows"] >= total:
+                break
+        save_checkpoint(writer)
+        st.rows = state["rows"]
+    close = getattr(test_samples, "close", None)
+    if close is not None:
+        close()
+
+    if state["rows"] < total:
+        print(f"[WARN] {args.idle_timeout:.0f}s 内没有新的预测，已解析 {state['rows']}/{total} 行；"
+              f"断点保存在 {checkpoint_path}，重新运行 --follow 继续")
+        metrics.finish()
+        return
+
+    with json_io.JsonArrayWriter(args.output_path) as out:
+        out.write_many(json_io.iter_jsonl(partial_path))
+    print(f"[INFO] 总计 {out.count} 条结果写入 {args.output_path}")
+    _write_retries(args, state["retries"])
+    if state["has_gold"] and total:
+        with metrics.stage("score") as st:
+            scores = scores_from_counts(state["tp"], state["n_pred"], state["n_gold"])
+            st.rows = total
+            st.extra.update(scores)
+        _print_scores(scores)
+    partial_path.unlink()
+    checkpoint_path.unlink()
+    metrics.finish()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    metrics = get_metrics("get_predict")
+    if args.follow:
+        gazetteer = None
+        if args.gazetteer is not None:
+            from gazetteer import Gazetteer
+
+            gazetteer = Gazetteer.load(args.gazetteer)
+        follow(args, gazetteer, metrics)
+        return
+    # 两个文件都只建字节偏移索引，逐条按下标（或 id）读取，不整体加载
+    with metrics.stage("load") as st:
+        test_samples = open_dataset(args.test_data_path)
+        predictions = IndexedJsonl(args.predictions_path)
+        st.rows = len(predictions)
+
+    gazetteer = None
+    if args.gazetteer is not None:
+        from gazetteer import Gazetteer
+
+        gazetteer = Gazetteer.load(args.gazetteer)
+
+    retries: List[Dict[str, Any]] = []
+    pred_outputs: List[List[Dict[str, Any]]] = []
+    gold_outputs: List[List[Dict[str, Any]]] = []
+    has_gold = True
     args.output_path.parent.mkdir(parents=True, exist_ok=True)
-    write_results(args.output_path, final_results)
-    print(f"[INFO] 总计 {len(final_results)} 条结果写入 {args.output_path}")
+    with metrics.stage("parse") as st, json_io.JsonArrayWriter(args.output_path) as writer:
+        for idx, sample in enumerate(test_samples):
+            if args.align_key is None:
+                row: Optional[int] = idx
+                record = predictions[idx] if idx < len(predictions) else ""
+            else:
+                row = predictions.position(sample.get(args.align_key), key=args.align_key)
+                record = "" if row is None else predictions.get(row, "")
+            result, retry = parse_row(idx, sample, record, args, gazetteer, metrics, row=row)
+            if retry is not None:
+                retries.append(retry)
+            writer.write(result)
+            pred_outputs.append(result["output"])
+            if has_gold and "output" in sample:
+                gold_outputs.append(sample["output"])
+            else:
+                has_gold = False
+        st.rows = writer.count
+    predictions.close()
+    close = getattr(test_samples, "close", None)
+    if close is not None:
+        close()
+    print(f"[INFO] 总计 {writer.count} 条结果写入 {args.output_path}")
+    _write_retries(args, retries)
+
+    if pred_outputs and has_gold:
+        with metrics.stage("score") as st:
+            scores = score_predictions(pred_outputs, gold_outputs)
+            st.rows = len(gold_outputs)
+            st.extra.update(scores)
+        _print_scores(scores)
+    metrics.finish()
 
 
 if __name__ == "__main__":
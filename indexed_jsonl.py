@@ -0,0 +1,464 @@
+# -*- coding: utf-8 -*-
+"""
+带字节偏移索引的 JSONL / JSON 数组随机访问读取
+
+第一次打开时扫描一遍文件，把每条记录的字节范围写到旁路文件 <path>.idx；
+之后按下标读取只需一次 mmap 切片 + 一次解析。源文件大小或修改时间变化时自动重建索引。
+.json 文件按顶层数组处理，扫描时定位每个元素的字节范围，同样支持随机访问。
+
+  kb = IndexedJsonl("data/train2.jsonl")
+  kb[12345]              # 解析第 12345 条记录
+  kb.raw(12345)          # 原始字节
+  kb.position("id_001")  # 按 id 字段定位（id 映射缓存在 <path>.id.ids）
+  kb.shard(0, 8)         # 第 0/8 个分片的记录迭代器
+
+map_shards() 让每个 worker 各自 mmap 同一个文件、按分片并行处理，结果按原顺序返回。
+open_dataset() 按扩展名返回可随机访问的数据集句柄（.json/.jsonl → IndexedJsonl，.rcol → ColumnarDataset），
+CachedLookup 在其上加一层有界 LRU，热门示例只解析一次。
+
+命令行：
+  python indexed_jsonl.py index  data/test2.json --id_key id
+  python indexed_jsonl.py sample data/test2.json --n 100 --output_path data/test2_head100.json
+  python indexed_jsonl.py sample data/train2.jsonl --n 1000 --random --seed 42 --output_path data/train2_s1k.jsonl
+  python indexed_jsonl.py shard  data/train2.jsonl --num_shards 8 --output_dir data/shards
+  python indexed_jsonl.py get    data/test2.json --index 12
+"""
+
+import argparse
+import mmap
+import os
+import random
+import re
+import struct
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import json_io
+
+PathLike = Union[str, Path]
+
+_MAGIC = b"LJIX"
+_VERSION = 1
+# magic, version, 源文件大小, 源文件 mtime_ns, 记录数；其后为 2 * 记录数 个 uint64 字节范围
+_HEADER = struct.Struct("<4sIQQQ")
+
+
+# 字符串（含转义）与结构字符；字符串整体跳过，其中的括号和逗号不参与计数
+_ARRAY_TOKENS = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{},]', re.S)
+_WHITESPACE = b" \t\r\n"
+
+
+def sidecar_path(path: PathLike) -> Path:
+    path = Path(path)
+    return path.with_name(path.name + ".idx")
+
+
+def idmap_path(path: PathLike, key: str) -> Path:
+    path = Path(path)
+    return path.with_name(f"{path.name}.{key}.ids")
+
+
+def scan_bounds(mm: Union[mmap.mmap, bytes]) -> "array":
+    """扫描每条非空行的字节范围，按 [start_0, end_0, start_1, end_1, ...] 交错存放。"""
+    bounds = array("Q")
+    start = 0
+    size = len(mm)
+    while start < size:
+        end = mm.find(b"\n", start)
+        if end == -1:
+            end = size
+        if mm[start:end].strip():
+            bounds.append(start)
+            bounds.append(end)
+        start = end + 1
+    return bounds
+
+
+def scan_array_bounds(mm: Union[mmap.mmap, bytes]) -> "array":
+    """扫描顶层 JSON 数组中每个元素的字节范围（不解析元素本身），格式同 scan_bounds。"""
+    bounds = array("Q")
+    depth = 0
+    prev = -1  # 上一个顶层分隔符（[ 或 ,）之后的位置
+    for match in _ARRAY_TOKENS.finditer(mm):
+        token = match.group()
+        if token[:1] == b'"':
+            continue
+        pos = match.start()
+        if depth == 0:
+            if token != b"[" or prev >= 0:
+                raise ValueError("Expected a JSON array")
+            depth, prev = 1, pos + 1
+        elif depth == 1 and token in (b",", b"]"):
+            segment = mm[prev:pos]
+            stripped = segment.lstrip(_WHITESPACE)
+            if stripped:
+                start = prev + len(segment) - len(stripped)
+                bounds.append(start)
+                bounds.append(start + len(stripped.rstrip(_WHITESPACE)))
+            elif token == b",":
+                raise ValueError(f"Empty element at byte {pos}")
+            if token == b"]":
+                return bounds
+            prev = pos + 1
+        elif token in (b"[", b"{"):
+            depth += 1
+        elif token in (b"]", b"}"):
+            depth -= 1
+    if prev < 0:
+        return bounds  # 只有空白
+    raise ValueError("Unterminated JSON array")
+
+
+class IndexedJsonl(Sequence):
+    """只读、可随机访问的 JSONL / JSON 数组数据集；字节范围表保存在 <path>.idx。"""
+
+    def __init__(self, path: PathLike, *, write_sidecar: bool = True):
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"File not found: {self.path}")
+        self.is_array = self.path.suffix.lower() == ".json"
+        self._write = write_sidecar
+        self._fp = self.path.open("rb")
+        stat = os.fstat(self._fp.fileno())
+        self._stat = stat
+        self._mm: Optional[mmap.mmap] = (
+            mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else None
+        )
+        self._loads = json_io.get_codec().loads
+        self._ids: Dict[str, Dict[Any, int]] = {}
+        self._bounds = self._load_sidecar(stat)
+        if self._bounds is None:
+            if self._mm is None:
+                self._bounds = array("Q")
+            elif self.is_array:
+                self._bounds = scan_array_bounds(self._mm)
+            else:
+                self._bounds = scan_bounds(self._mm)
+            if write_sidecar:
+                self._write_sidecar(stat)
+
+    # ----------------------------
+    # 旁路索引
+    # ----------------------------
+
+    def _load_sidecar(self, stat: os.stat_result) -> Optional["array"]:
+        idx = sidecar_path(self.path)
+        if not idx.exists():
+            return None
+        with idx.open("rb") as fp:
+            header = fp.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                return None
+            magic, version, size, mtime_ns, count = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+                return None
+            bounds = array("Q")
+            try:
+                bounds.fromfile(fp, 2 * count)
+            except EOFError:
+                return None
+        return bounds
+
+    def _write_sidecar(self, stat: os.stat_result) -> None:
+        idx = sidecar_path(self.path)
+        tmp = idx.with_name(idx.name + ".tmp")
+        try:
+            with tmp.open("wb") as fp:
+                fp.write(_HEADER.pack(_MAGIC, _VERSION, stat.st_size, stat.st_mtime_ns, len(self._bounds) // 2))
+                self._bounds.tofile(fp)
+            tmp.replace(idx)
+        except OSError:
+            # 只读目录下退化为仅在内存中保存索引
+            tmp.unlink(missing_ok=True)
+
+    # ----------------------------
+    # 访问
+    # ----------------------------
+
+    def __len__(self) -> int:
+        return len(self._bounds) // 2
+
+    def raw(self, index: int) -> bytes:
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError(index)
+        return self._mm[self._bounds[2 * index]:self._bounds[2 * index + 1]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._loads(self.raw(index))
+
+    def __iter__(self) -> Iterator[Any]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def get(self, index: int, default: Any = None) -> Any:
+        """越界或该行不是合法 JSON 时返回 default（对应 iter_jsonl(skip_invalid=True)）。"""
+        if not -len(self) <= index < len(self):
+            return default
+        try:
+            return self[index]
+        except ValueError:
+            return default
+
+    # ----------------------------
+    # id → 下标
+    # ----------------------------
+
+    def id_index(self, key: str = "id") -> Dict[Any, int]:
+        """记录中 key 字段到下标的映射；首次构建后缓存到 <path>.<key>.ids，重复 id 取第一次出现。"""
+        if key in self._ids:
+            return self._ids[key]
+        ids = self._load_idmap(key)
+        if ids is None:
+            ids = [rec.get(key) if isinstance(rec, dict) else None for rec in map(self.get, range(len(self)))]
+            if self._write:
+                self._write_idmap(key, ids)
+        mapping: Dict[Any, int] = {}
+        for i, value in enumerate(ids):
+            if value is not None:
+                mapping.setdefault(value, i)
+        self._ids[key] = mapping
+        return mapping
+
+    def position(self, value: Any, key: str = "id") -> Optional[int]:
+        return self.id_index(key).get(value)
+
+    def by_id(self, value: Any, key: str = "id", default: Any = None) -> Any:
+        pos = self.position(value, key)
+        return default if pos is None else self.get(pos, default)
+
+    def _load_idmap(self, key: str) -> Optional[List[Any]]:
+        path = idmap_path(self.path, key)
+        if not path.exists():
+            return None
+        try:
+            payload = json_io.load_json(path)
+        except ValueError:
+            return None
+        if (
+            not isinstance(payload, dict)
+            or payload.get("size") != self._stat.st_size
+            or payload.get("mtime_ns") != self._stat.st_mtime_ns
+            or len(payload.get("ids") or []) != len(self)
+        ):
+            return None
+        return payload["ids"]
+
+    def _write_idmap(self, key: str, ids: List[Any]) -> None:
+        path = idmap_path(self.path, key)
+        tmp = path.with_name(path.name + ".tmp")
+        payload = {"size": self._stat.st_size, "mtime_ns": self._stat.st_mtime_ns, "key": key, "ids": ids}
+        try:
+            json_io.write_json(tmp, payload, indent=False)
+            tmp.replace(path)
+        except OSError:
+            tmp.unlink(missing_ok=True)
+
+    # ----------------------------
+    # 分片
+    # ----------------------------
+
+    def shard_ranges(self, num_shards: int) -> List[Tuple[int, int]]:
+        """把 [0, len) 切成 num_shards 段连续下标区间，前面的分片多分到余数。"""
+        n = len(self)
+        num_shards = max(1, num_shards)
+        size, rest = divmod(n, num_shards)
+        ranges, start = [], 0
+        for shard in range(num_shards):
+            stop = start + size + (1 if shard < rest else 0)
+            ranges.append((start, stop))
+            start = stop
+        return ranges
+
+    def shard(self, shard: int, num_shards: int) -> Iterator[Any]:
+        start, stop = self.shard_ranges(num_shards)[shard]
+        for i in range(start, stop):
+            yield self[i]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        self._fp.close()
+
+    def __enter__(self) -> "IndexedJsonl":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def _map_shard(args: Tuple[str, int, int, Callable[[Any], Any]]) -> List[Any]:
+    path, start, stop, fn = args
+    # 父进程已写好旁路索引，worker 只读取
+    with IndexedJsonl(path, write_sidecar=False) as ds:
+        return [fn(ds[i]) for i in range(start, stop)]
+
+
+def map_shards(
+    path: PathLike,
+    fn: Callable[[Any], Any],
+    *,
+    num_shards: int = 0,
+    workers: int = 0,
+) -> Iterator[Any]:
+    """
+    按分片并行对每条记录调用 fn（需可 pickle 的顶层函数），按原顺序逐条产出结果。
+    每个 worker 自己 mmap 文件，进程间只传下标区间和结果。
+    """
+    workers = workers or os.cpu_count() or 1
+    with IndexedJsonl(path) as ds:
+        ranges = ds.shard_ranges(num_shards or workers * 4)
+        if workers <= 1 or len(ds) < 2:
+            for i in range(len(ds)):
+                yield fn(ds[i])
+            return
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [(str(path), start, stop, fn) for start, stop in ranges if stop > start]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in pool.map(_map_shard, tasks):
+            yield from chunk
+
+
+def sample_indices(n: int, size: int, *, shuffle: bool = False, seed: int = 42) -> List[int]:
+    """前 size 条，或固定种子下的随机 size 条（保持原文件顺序）。"""
+    size = min(size, n)
+    if not shuffle:
+        return list(range(size))
+    return sorted(random.Random(seed).sample(range(n), size))
+
+
+def open_dataset(path: PathLike) -> Sequence:
+    """按扩展名打开可随机访问的数据集：.json/.jsonl → IndexedJsonl，.rcol → ColumnarDataset。"""
+    path = Path(path)
+    suffix = path.suffix.lower()
+    if suffix in (".json", ".jsonl"):
+        return IndexedJsonl(path)
+    if suffix == ".rcol":
+        from columnar_store import ColumnarDataset
+
+        return ColumnarDataset(path)
+    return json_io.load_json_or_jsonl(path)
+
+
+class CachedLookup:
+    """在随机访问数据集上加一层有界 LRU 缓存，按下标取记录。"""
+
+    def __init__(self, dataset: Sequence, maxsize: int = 4096):
+        self.dataset = dataset
+        self._get = lru_cache(maxsize=maxsize)(self._fetch)
+
+    def _fetch(self, index: int) -> Dict[str, Any]:
+        return self.dataset[index]
+
+    def get(self, index: int) -> Dict[str, Any]:
+        return self._get(int(index))
+
+    def resolve(self, ids: Iterable[int]) -> List[Dict[str, Any]]:
+        return [self._get(int(i)) for i in ids]
+
+    def cache_info(self):
+        return self._get.cache_info()
+
+    def close(self) -> None:
+        self._get.cache_clear()
+        close = getattr(self.dataset, "close", None)
+        if close is not None:
+            close()
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def _write_rows(output_path: PathLike, ds: IndexedJsonl, indices: Iterable[int]) -> int:
+    with json_io.open_writer(output_path) as writer:
+        for i in indices:
+            writer.write(ds[i])
+        return writer.count
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Byte-offset indexed random access over JSON/JSONL datasets.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="构建（或校验）旁路索引")
+    p.add_argument("path", type=Path)
+    p.add_argument("--id_key", type=str, default=None, help="同时构建该字段的 id → 下标映射")
+
+    p = sub.add_parser("sample", help="取前 n 条或随机 n 条另存")
+    p.add_argument("path", type=Path)
+    p.add_argument("--n", type=int, default=100)
+    p.add_argument("--random", action="store_true", help="随机抽样（保持原顺序）")
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--output_path", type=Path, required=True)
+
+    p = sub.add_parser("shard", help="按记录数均分为多个文件")
+    p.add_argument("path", type=Path)
+    p.add_argument("--num_shards", type=int, required=True)
+    p.add_argument("--output_dir", type=Path, required=True)
+
+    p = sub.add_parser("get", help="按下标或 id 打印一条记录")
+    p.add_argument("path", type=Path)
+    group = p.add_mutually_exclusive_group(required=True)
+    group.add_argument("--index", type=int)
+    group.add_argument("--id", type=str)
+    p.add_argument("--id_key", type=str, default="id")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    from metrics import get_metrics
+
+    metrics = get_metrics(f"indexed_jsonl.{args.command}")
+    with metrics.stage("index") as st:
+        ds = IndexedJsonl(args.path)
+        st.rows = len(ds)
+        st.extra["bytes"] = ds.path.stat().st_size
+
+    with ds:
+        if args.command == "index":
+            print(f"✅ {ds.path}: {len(ds)} 条记录，索引 {sidecar_path(ds.path)}")
+            if args.id_key:
+                with metrics.stage("id_index") as st:
+                    ids = ds.id_index(args.id_key)
+                    st.rows = len(ids)
+                print(f"   {args.id_key} → 下标映射 {len(ids)} 个，缓存 {idmap_path(ds.path, args.id_key)}")
+
+        elif args.command == "sample":
+            indices = sample_indices(len(ds), args.n, shuffle=args.random, seed=args.seed)
+            with metrics.stage("write") as st:
+                st.rows = _write_rows(args.output_path, ds, indices)
+            print(f"✅ 已抽取 {st.rows}/{len(ds)} 条 → {args.output_path}")
+
+        elif args.command == "shard":
+            args.output_dir.mkdir(parents=True, exist_ok=True)
+            with metrics.stage("write") as st:
+                st.rows = 0
+                for shard, (start, stop) in enumerate(ds.shard_ranges(args.num_shards)):
+                    out = args.output_dir / f"{ds.path.stem}.shard{shard:03d}-of-{args.num_shards:03d}{ds.path.suffix}"
+                    st.rows += _write_rows(out, ds, range(start, stop))
+                    print(f"   {out}: {stop - start} 条")
+            print(f"✅ 已切分为 {args.num_shards} 个分片 → {args.output_dir}")
+
+        else:
+            if args.index is not None:
+                record = ds.get(args.index)
+            else:
+                record = ds.by_id(args.id, key=args.id_key)
+            if record is None:
+                raise SystemExit(f"❌ 未找到记录: {args.index if args.index is not None else args.id}")
+            print(json_io.dumps(record, indent=True))
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+"""
+统一的 JSON / JSONL 读写层
+
+- 编解码器按 orjson → ujson → json 的顺序自动选择，
+  也可通过环境变量 LLM4RE_JSON_CODEC=orjson|ujson|json 强制指定
+- JSONL 基于 mmap 逐行迭代，不需要把整份文件读成 Python 字符串
+- 写入走缓冲的批量写，避免逐行 write 带来的系统调用开销
+- 输出格式与原脚本保持一致：.json 为 indent=2，.jsonl 为每行一条紧凑 JSON，均不转义中文
+"""
+
+import json
+import mmap
+import os
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+PathLike = Union[str, Path]
+
+
+class _Codec:
+    """一组 loads / dumps 实现。dumps 统一返回 UTF-8 bytes。"""
+
+    def __init__(
+        self,
+        name: str,
+        loads: Callable[[Union[str, bytes]], Any],
+        dumps: Callable[[Any], bytes],
+        dumps_indent: Callable[[Any], bytes],
+    ):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+        self.dumps_indent = dumps_indent
+
+
+def _default(obj: Any) -> Any:
+    """带 to_dict() 的对象（records.Sample）按 dict 写出。"""
+    to_dict = getattr(obj, "to_dict", None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+def _make_orjson() -> _Codec:
+    import orjson
+
+    opts = orjson.OPT_NON_STR_KEYS
+    return _Codec(
+        "orjson",
+        orjson.loads,
+        lambda obj: orjson.dumps(obj, default=_default, option=opts),
+        lambda obj: orjson.dumps(obj, default=_default, option=opts | orjson.OPT_INDENT_2),
+    )
+
+
+def _make_ujson() -> _Codec:
+    import ujson
+
+    return _Codec(
+        "ujson",
+        ujson.loads,
+        lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False, default=_default).encode("utf-8"),
+        lambda obj: ujson.dumps(
+            obj, ensure_ascii=False, escape_forward_slashes=False, indent=2, default=_default
+        ).encode("utf-8"),
+    )
+
+
+def _make_stdlib() -> _Codec:
+    return _Codec(
+        "json",
+        json.loads,
+        lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8"),
+        lambda obj: json.dumps(obj, ensure_ascii=False, indent=2, default=_default).encode("utf-8"),
+    )
+
+
+_FACTORIES = {"orjson": _make_orjson, "ujson": _make_ujson, "json": _make_stdlib}
+_codec: Optional[_Codec] = None
+
+
+def set_codec(name: Optional[str] = None) -> str:
+    """选择编解码器；name 为空时按 orjson → ujson → json 自动回退。返回实际使用的名称。"""
+    global _codec
+    if name:
+        if name not in _FACTORIES:
+            raise ValueError(f"Unknown JSON codec: {name}")
+        _codec = _FACTORIES[name]()
+        return _codec.name
+
+    for candidate in ("orjson", "ujson", "json"):
+        try:
+            _codec = _FACTORIES[candidate]()
+            return _codec.name
+        except ImportError:
+            continue
+    raise RuntimeError("No JSON codec available")
+
+
+def get_codec() -> _Codec:
+    if _codec is None:
+        set_codec(os.environ.get("LLM4RE_JSON_CODEC") or None)
+    return _codec
+
+
+def loads(data: Union[str, bytes, bytearray, memoryview]) -> Any:
+    if isinstance(data, memoryview):
+        data = bytes(data)
+    return get_codec().loads(data)
+
+
+def dumps(obj: Any, *, indent: bool = False) -> str:
+    """紧凑（或 indent=2）且不转义中文的 JSON 字符串。"""
+    return dumps_bytes(obj, indent=indent).decode("utf-8")
+
+
+def dumps_bytes(obj: Any, *, indent: bool = False) -> bytes:
+    codec = get_codec()
+    return codec.dumps_indent(obj) if indent else codec.dumps(obj)
+
+
+# ----------------------------
+# 读取
+# ----------------------------
+
+def iter_jsonl(path: PathLike, *, skip_invalid: bool = False) -> Iterator[Any]:
+    """基于 mmap 逐行解析 JSONL，空行跳过。"""
+    path = Path(path)
+    decode = get_codec().loads
+    with path.open("rb") as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start = 0
+            size = len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = size
+                line = mm[start:end].strip()
+                start = end + 1
+                if not line:
+                    continue
+                try:
+                    yield decode(line)
+                except ValueError:
+                    if not skip_invalid:
+                        raise
+                    yield None
+
+
+def follow_jsonl(
+    path: PathLike,
+    *,
+    offset: int = 0,
+    poll_interval: float = 0.5,
+    idle_timeout: Optional[float] = None,
+    stop: Optional[Callable[[], bool]] = None,
+    skip_invalid: bool = False,
+) -> Iterator[Tuple[Any, int]]:
+    """
+    像 tail -f 一样跟随仍在写入的 JSONL：只产出以换行结尾的完整行，返回 (记录, 该行结束处的字节偏移)。
+    从 offset 处开始（断点续读）；文件尚不存在时等待。stop() 为真、或 idle_timeout 秒内文件没有增长时结束。
+    skip_invalid=True 时无法解析的行产出 None。
+    """
+    path = Path(path)
+    decode = get_codec().loads
+    pending = b""
+    last_growth = time.monotonic()
+    fp = None
+    try:
+        while True:
+            if fp is None and path.exists():
+                fp = path.open("rb")
+                fp.seek(offset)
+            chunk = fp.read() if fp is not None else b""
+            if chunk:
+                last_growth = time.monotonic()
+                pending += chunk
+                lines = pending.split(b"\n")
+                pending = lines.pop()
+                for line in lines:
+                    offset += len(line) + 1
+                    if not line.strip():
+                        continue
+                    try:
+                        record = decode(line)
+                    except ValueError:
+                        if not skip_invalid:
+                            raise
+                        record = None
+                    yield record, offset
+                continue
+            if stop is not None and stop():
+                return
+            if idle_timeout is not None and time.monotonic() - last_growth > idle_timeout:
+                return
+            time.sleep(poll_interval)
+    finally:
+        if fp is not None:
+            fp.close()
+
+
+def iter_json_array(path: PathLike, *, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """流式解析顶层为数组的 .json 文件，内存占用与单条记录大小相关而非文件大小。"""
+    decoder = json.JSONDecoder()
+    with Path(path).open("r", encoding="utf-8") as fp:
+        buf = fp.read(chunk_size)
+        eof = not buf
+        pos = 0
+        # 定位数组起始
+        while True:
+            stripped = buf.lstrip()
+            if stripped or eof:
+                break
+            buf = fp.read(chunk_size)
+            eof = not buf
+        if not stripped.startswith("["):
+            raise ValueError(f"Expected a JSON array in {path}")
+        buf = stripped[1:]
+
+        while True:
+            # 跳过空白与分隔符
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError(f"Unterminated JSON array in {path}")
+                buf = fp.read(chunk_size)
+                eof = not buf
+                pos = 0
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                value, end = None, -1
+            # 值恰好止于缓冲区末尾时可能被截断（如数字），需补读后重试
+            if end == -1 or (end == len(buf) and not eof):
+                if eof:
+                    raise ValueError(f"Malformed JSON array in {path}")
+                more = fp.read(chunk_size)
+                eof = not more
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            yield value
+            pos = end
+
+
+def iter_records(path: PathLike) -> Iterator[Dict[str, Any]]:
+    """按扩展名流式迭代 .json / .jsonl / .rcol 数据集中的记录。"""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path}")
+    suffix = path.suffix.lower()
+    if suffix == ".jsonl":
+        yield from iter_jsonl(path)
+    elif suffix == ".rcol":
+        from columnar_store import ColumnarDataset
+
+        with ColumnarDataset(path) as ds:
+            yield from ds
+    else:
+        yield from iter_json_array(path)
+
+
+def chunked(rows: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """把记录流切成至多 size 条一组的列表，供分批处理 / 进程池使用。"""
+    iterator = iter(rows)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_json(path: PathLike) -> Any:
+    with Path(path).open("rb") as fp:
+        return get_codec().loads(fp.read())
+
+
+def load_json_or_jsonl(path: PathLike) -> List[Dict[str, Any]]:
+    """按扩展名加载 .json / .jsonl / .rcol 数据集。"""
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {path}")
+    suffix = path.suffix.lower()
+    if suffix == ".jsonl":
+        return list(iter_jsonl(path))
+    if suffix == ".rcol":
+        from columnar_store import ColumnarDataset
+
+        with ColumnarDataset(path) as ds:
+            return list(ds)
+    if suffix == ".json":
+        return load_json(path)
+    raise ValueError(f"Unsupported file type: {path}")
+
+
+# ----------------------------
+# 写入
+# ----------------------------
+
+class JsonlWriter:
+    """
+    缓冲批量写 JSONL，积累到 buffer_size 字节后一次性落盘。
+
+    atomic=True（非追加时的默认）先写 <path>.tmp，正常 close() 后才改名为目标文件；
+    with 块内抛出异常时丢弃临时文件，不会留下看似写完的半截输出。
+    边写边被其它进程读取的输出（--follow）需传 atomic=False。
+    """
+
+    def __init__(
+        self, path: PathLike, *, buffer_size: int = 4 << 20, append: bool = False, atomic: Optional[bool] = None
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.atomic = not append if atomic is None else atomic
+        if self.atomic and append:
+            raise ValueError("atomic=True cannot be combined with append=True")
+        self._write_path = self.path.with_name(self.path.name + ".tmp") if self.atomic else self.path
+        self._fp = self._write_path.open("ab" if append else "wb")
+        self._dumps = get_codec().dumps
+        self._chunks: List[bytes] = []
+        self._pending = 0
+        self.buffer_size = buffer_size
+        self.count = 0
+
+    def write(self, row: Any) -> None:
+        data = self._dumps(row)
+        self._chunks.append(data)
+        self._chunks.append(b"\n")
+        self._pending += len(data) + 1
+        self.count += 1
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def write_many(self, rows: Iterable[Any]) -> None:
+        for row in rows:
+            self.write(row)
+
+    def flush(self) -> None:
+        if self._chunks:
+            self._fp.write(b"".join(self._chunks))
+            self._fp.flush()
+            self._chunks = []
+            self._pending = 0
+
+    def tell(self) -> int:
+        """已落盘的字节数（先 flush）。"""
+        self.flush()
+        return self._fp.tell()
+
+    def close(self) -> None:
+        self.flush()
+        self._fp.close()
+        if self.atomic:
+            os.replace(self._write_path, self.path)
+
+    def abort(self) -> None:
+        """
+        放弃写入：atomic 时删除临时文件，目标文件保持原样；
+        否则只落盘已写的记录（JSON 数组不补结尾的 ]），让输出保持不完整。
+        """
+        if self.atomic:
+            self._fp.close()
+            self._write_path.unlink()
+        else:
+            self.flush()
+            self._fp.close()
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter(JsonlWriter):
+    """增量写出 indent=2 的 JSON 数组，格式与 json.dump(rows, indent=2) 一致。"""
+
+    def __init__(self, path: PathLike, *, buffer_size: int = 4 << 20, atomic: bool = True):
+        super().__init__(path, buffer_size=buffer_size, atomic=atomic)
+        self._dumps = get_codec().dumps_indent
+
+    def write(self, row: Any) -> None:
+        data = self._dumps(row).replace(b"\n", b"\n  ")
+        self._chunks.append(b",\n  " if self.count else b"[\n  ")
+        self._chunks.append(data)
+        self._pending += len(data) + 4
+        self.count += 1
+        if self._pending >= self.buffer_size:
+            self.flush()
+
+    def close(self) -> None:
+        self._chunks.append(b"\n]" if self.count else b"[]")
+        super().close()
+
+
+def open_writer(path: PathLike, **kwargs) -> JsonlWriter:
+    """.jsonl 返回 JsonlWriter，其余返回 JsonArrayWriter。"""
+    if Path(path).suffix.lower() == ".jsonl":
+        return JsonlWriter(path, **kwargs)
+    return JsonArrayWriter(path, **kwargs)
+
+
+def write_jsonl(path: PathLike, rows: Iterable[Any]) -> int:
+    with JsonlWriter(path) as writer:
+        writer.write_many(rows)
+        return writer.count
+
+
+def write_json(path: PathLike, data: Any, *, indent: bool = True) -> None:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("wb") as fp:
+        fp.write(dumps_bytes(data, indent=indent))
+
+
+def write_dataset(path: PathLike, rows: List[Dict[str, Any]]) -> None:
+    """按扩展名写出 .json（indent=2）/ .jsonl / .rcol。"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".jsonl":
+        write_jsonl(path, rows)
+    elif suffix == ".rcol":
+        from columnar_store import write_columnar
+
+        write_columnar(path, (row.to_dict() if hasattr(row, "to_dict") else row for row in rows))
+    else:
+        write_json(path, rows)
@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+可增量更新的知识库向量索引：追加 / 墓碑删除 / 后台压缩，行 ID 永久稳定
+
+目录结构:
+  <index_dir>/meta.json               编码模型、检索字段、当前代数、下一个行 ID
+  <index_dir>/gen-000001/
+      vectors.f32                     float32 (rows, dim)，numpy.memmap 只读映射
+      ids.i64 / langs.u8 / hashes.bin 行 ID、语言码、样本内容 sha1
+      samples.jsonl                   原始样本
+      tombstones.i64                  已删除的行 ID（只追加）
+
+- sync() 按样本内容 hash 与索引做多重集差分：新增/修改的行追加，消失的行打墓碑，
+  只有变化的样本需要语言检测和编码，每日刷新的耗时与变化量成正比
+- 删除只写墓碑，检索时屏蔽；墓碑占比超过 compact_ratio 时在后台线程重写成新一代，
+  压缩期间的追加和删除会在切换时补写进新一代，检索不受影响
+- 行 ID 单调递增、永不复用，压缩后不变，可作为外部引用
+- quantization="int8" / "binary" 时打开索引后从 vectors.f32 按块生成内存中的量化码，检索先扫描量化码，
+  再从 memmap 读取候选行的 float32 精确重排（见 retrieval.QuantizedVectors）
+
+用法:
+  python kb_index.py sync --index_dir data/kb_index --knowledge_base_path data/train2.json \
+      --embedding_cache data/emb_cache
+  python kb_index.py delete --index_dir data/kb_index --ids 17 42
+  python kb_index.py compact --index_dir data/kb_index
+  python kb_index.py info --index_dir data/kb_index
+"""
+
+import argparse
+import hashlib
+import shutil
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import json_io
+from metrics import get_metrics
+from retrieval import LANG_CODES, OTHER_LANG, Candidates, QuantizedVectors, partitioned_search, quantized_search
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from embedding_cache import CachedEncoder
+
+_HASH_SIZE = 20
+
+
+def content_hash(sample: Dict[str, Any]) -> bytes:
+    return hashlib.sha1(json_io.dumps_bytes(sample)).digest()
+
+
+class KBIndex:
+    def __init__(
+        self,
+        index_dir: Union[str, Path],
+        *,
+        encoder: Optional["CachedEncoder"] = None,
+        model_name: Optional[str] = None,
+        text_key: str = "input",
+        compact_ratio: float = 0.25,
+        background_compact: bool = True,
+        quantization: str = "none",
+        oversample: Optional[int] = None,
+    ):
+        import numpy as np
+
+        self._np = np
+        self.index_dir = Path(index_dir)
+        self.encoder = encoder
+        self.compact_ratio = compact_ratio
+        self.background_compact = background_compact
+        self.quantization = quantization
+        self.oversample = oversample
+        self._lock = threading.RLock()
+        self._compactor: Optional[threading.Thread] = None
+        self._meta_path = self.index_dir / "meta.json"
+
+        if self._meta_path.exists():
+            self.meta = json_io.load_json(self._meta_path)
+            if model_name and self.meta["model_name"] != model_name:
+                raise ValueError(f"KB index {self.index_dir} was built with {self.meta['model_name']}, not {model_name}")
+        else:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            self.meta = {"model_name": model_name, "text_key": text_key, "dim": None, "generation": 1, "next_id": 0}
+            self._gen_dir(1).mkdir(parents=True, exist_ok=True)
+            json_io.write_json(self._meta_path, self.meta)
+        self.text_key = self.meta["text_key"]
+        self._load()
+
+    # ----------------------------
+    # 存储
+    # ----------------------------
+
+    def _gen_dir(self, generation: int) -> Path:
+        return self.index_dir / f"gen-{generation:06d}"
+
+    @property
+    def _dir(self) -> Path:
+        return self._gen_dir(self.meta["generation"])
+
+    def _truncate(self, d: Path, rows: int) -> None:
+        """追加中途退出时 ids 之外的文件可能多出半截行：都截断到 rows 行，之后的追加与 ids 对齐。"""
+        row_sizes = {"ids.i64": 8, "langs.u8": 1, "hashes.bin": _HASH_SIZE}
+        if self.meta["dim"]:
+            row_sizes["vectors.f32"] = 4 * self.meta["dim"]
+        for name, row_size in row_sizes.items():
+            path = d / name
+            if path.exists() and path.stat().st_size > rows * row_size:
+                with path.open("r+b") as fp:
+                    fp.truncate(rows * row_size)
+        path = d / "samples.jsonl"
+        if not path.exists():
+            return
+        # samples.jsonl 按行数定位字节偏移
+        offset = 0
+        with path.open("rb") as fp:
+            for _ in range(rows):
+                line = fp.readline()
+                if not line.endswith(b"\n"):
+                    break
+                offset += len(line)
+        if path.stat().st_size > offset:
+            with path.open("r+b") as fp:
+                fp.truncate(offset)
+
+    def _load(self) -> None:
+        np = self._np
+        d = self._dir
+        ids_path = d / "ids.i64"
+        rows = ids_path.stat().st_size // 8 if ids_path.exists() else 0
+        self._truncate(d, rows)
+        ids = np.fromfile(ids_path, dtype=np.int64) if rows else np.empty(0, np.int64)
+        if rows and int(ids.max()) >= self.meta["next_id"]:
+            # ids 已落盘但 meta 未更新时退出：行 ID 不能复用
+            self.meta["next_id"] = int(ids.max()) + 1
+            self._write_meta()
+        self._ids = ids
+        self._langs = np.fromfile(d / "langs.u8", dtype=np.uint8)[:rows] if rows else np.empty(0, np.uint8)
+        hashes = (d / "hashes.bin").read_bytes() if rows else b""
+        self._hashes = [hashes[i * _HASH_SIZE:(i + 1) * _HASH_SIZE] for i in range(rows)]
+        self._samples: List[Dict[str, Any]] = list(json_io.iter_jsonl(d / "samples.jsonl")) if rows else []
+        self._vectors = self._map_vectors(d, rows)
+        self._codes = QuantizedVectors.build(self._vectors, self.quantization) \
+            if self.quantization != "none" and rows else None
+        self._row_of = {int(i): r for r, i in enumerate(ids)}
+        tomb_path = d / "tombstones.i64"
+        self._tombstones = set(np.fromfile(tomb_path, dtype=np.int64).tolist()) if tomb_path.exists() else set()
+        self._refresh_alive()
+
+    def _map_vectors(self, d: Path, rows: int) -> "np.ndarray":
+        np = self._np
+        if rows == 0:
+            return np.empty((0, self.meta["dim"] or 0), dtype=np.float32)
+        return np.memmap(d / "vectors.f32", dtype=np.float32, mode="r", shape=(rows, self.meta["dim"]))
+
+    def _refresh_alive(self) -> None:
+        np = self._np
+        alive = np.ones(len(self._ids), dtype=bool)
+        dead = [self._row_of[i] for i in self._tombstones if i in self._row_of]
+        alive[dead] = False
+        self._alive = alive
+
+    @staticmethod
+    def _append_rows(
+        d: Path,
+        ids: "np.ndarray",
+        langs: "np.ndarray",
+        hashes: Sequence[bytes],
+        vectors: "np.ndarray",
+        samples: Iterable[Dict[str, Any]],
+    ) -> None:
+        # samples / 向量先落盘，ids 最后写：ids 的长度即为已完整写入的行数
+        with (d / "samples.jsonl").open("ab") as fp:
+            fp.write(b"".join(json_io.dumps_bytes(s) + b"\n" for s in samples))
+        with (d / "vectors.f32").open("ab") as fp:
+            fp.write(vectors.astype("float32", copy=False).tobytes())
+        with (d / "hashes.bin").open("ab") as fp:
+            fp.write(b"".join(hashes))
+        with (d / "langs.u8").open("ab") as fp:
+            fp.write(langs.tobytes())
+        with (d / "ids.i64").open("ab") as fp:
+            fp.write(ids.tobytes())
+
+    def _write_meta(self) -> None:
+        tmp = self._meta_path.with_suffix(".json.tmp")
+        json_io.write_json(tmp, self.meta)
+        tmp.replace(self._meta_path)
+
+    # ----------------------------
+    # 更新
+    # ----------------------------
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    @property
+    def num_tombstoned(self) -> int:
+        return len(self._ids) - len(self)
+
+    def _encode(self, texts: List[str]) -> "np.ndarray":
+        if self.encoder is None:
+            raise RuntimeError("KBIndex needs an encoder to add rows or run queries")
+        vectors = self.encoder.encode(texts)
+        if self.meta["dim"] is None:
+            self.meta["dim"] = int(vectors.shape[1])
+            cache = getattr(self.encoder, "cache", None)
+            if self.meta["model_name"] is None and cache is not None:
+                self.meta["model_name"] = cache.model_name
+        return vectors
+
+    def append(self, samples: Sequence[Dict[str, Any]], langs: Sequence[str]) -> List[int]:
+        """追加样本，返回分配的行 ID。"""
+        if not samples:
+            return []
+        np = self._np
+        vectors = self._encode([s.get(self.text_key, "") for s in samples])
+        with self._lock:
+            start = self.meta["next_id"]
+            ids = np.arange(start, start + len(samples), dtype=np.int64)
+            codes = np.array([LANG_CODES.get(l, OTHER_LANG) for l in langs], dtype=np.uint8)
+            hashes = [content_hash(s) for s in samples]
+            self._append_rows(self._dir, ids, codes, hashes, vectors, samples)
+            self.meta["next_id"] = start + len(samples)
+            self._write_meta()
+
+            base = len(self._ids)
+            self._ids = np.concatenate([self._ids, ids])
+            self._langs = np.concatenate([self._langs, codes])
+            self._hashes.extend(hashes)
+            self._samples.extend(samples)
+            self._row_of.update((int(i), base + k) for k, i in enumerate(ids))
+            self._vectors = self._map_vectors(self._dir, len(self._ids))
+            if self.quantization != "none":
+                self._codes = QuantizedVectors.build(vectors, self.quantization) if self._codes is None \
+                    else self._codes.extended(vectors)
+            self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        return ids.tolist()
+
+    def delete(self, ids: Iterable[int]) -> int:
+        """为行 ID 打墓碑，返回实际删除的行数。"""
+        with self._lock:
+            new = [int(i) for i in ids if int(i) in self._row_of and int(i) not in self._tombstones]
+            if not new:
+                return 0
+            with (self._dir / "tombstones.i64").open("ab") as fp:
+                fp.write(self._np.array(new, dtype=self._np.int64).tobytes())
+            self._tombstones.update(new)
+            for i in new:
+                self._alive[self._row_of[i]] = False
+        self._maybe_compact()
+        return len(new)
+
+    def sync(
+        self,
+        samples: Sequence[Dict[str, Any]],
+        lang_fn: Callable[[str], str],
+    ) -> Tuple[List[int], List[int]]:
+        """使索引内容与 samples 一致（按内容 hash 的多重集差分），返回 (新增 ID, 删除 ID)。"""
+        with self._lock:
+            live: Dict[bytes, List[int]] = defaultdict(list)
+            for row in self._np.flatnonzero(self._alive):
+                live[self._hashes[row]].append(int(self._ids[row]))
+
+        added: List[Dict[str, Any]] = []
+        for sample in samples:
+            ids = live.get(content_hash(sample))
+            if ids:
+                ids.pop()
+            else:
+                added.append(sample)
+        removed = [i for ids in live.values() for i in ids]
+
+        self.delete(removed)
+        new_ids = self.append(added, [lang_fn(s.get(self.text_key, "")) for s in added])
+        return new_ids, removed
+
+    # ----------------------------
+    # 压缩
+    # ----------------------------
+
+    def _maybe_compact(self) -> None:
+        if not self._ids.size or self.num_tombstoned / len(self._ids) < self.compact_ratio:
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        if self.background_compact:
+            self._compactor = threading.Thread(target=self.compact, daemon=True)
+            self._compactor.start()
+        else:
+            self.compact()
+
+    def wait(self) -> None:
+        """等待后台压缩结束。"""
+        if self._compactor is not None:
+            self._compactor.join()
+
+    def compact(self) -> None:
+        """把存活行重写到新一代目录并原子切换；压缩期间的追加/删除在切换时补齐。"""
+        np = self._np
+        with self._lock:
+            snapshot = len(self._ids)
+            alive = self._alive[:snapshot].copy()
+            ids, langs, hashes = self._ids[:snapshot], self._langs[:snapshot], self._hashes[:snapshot]
+            vectors, samples = self._vectors, self._samples[:snapshot]
+            new_gen = self.meta["generation"] + 1
+        new_dir = self._gen_dir(new_gen)
+        shutil.rmtree(new_dir, ignore_errors=True)
+        new_dir.mkdir(parents=True)
+
+        # 耗时的重写不持锁，检索与更新照常进行
+        keep = np.flatnonzero(alive)
+        self._append_rows(
+            new_dir, ids[keep], langs[keep], [hashes[r] for r in keep],
+            np.asarray(vectors[keep]) if len(keep) else np.empty((0, 0), np.float32), (samples[r] for r in keep),
+        )
+
+        with self._lock:
+            tail = slice(snapshot, len(self._ids))
+            self._append_rows(
+                new_dir, self._ids[tail], self._langs[tail], self._hashes[tail],
+                np.asarray(self._vectors[tail]), self._samples[tail],
+            )
+            kept_ids = set(ids[keep].tolist()) | set(self._ids[tail].tolist())
+            pending = [i for i in self._tombstones if i in kept_ids]
+            if pending:
+                np.array(pending, dtype=np.int64).tofile(new_dir / "tombstones.i64")
+            old_dir = self._dir
+            self.meta["generation"] = new_gen
+            self._write_meta()
+            self._load()
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    # ----------------------------
+    # 检索
+    # ----------------------------
+
+    def ids_by_lang(self, lang: Optional[str] = None) -> List[int]:
+        mask = self._alive if lang is None else self._alive & (self._langs == LANG_CODES.get(lang, OTHER_LANG))
+        return self._ids[mask].tolist()
+
+    def get(self, row_id: int) -> Dict[str, Any]:
+        return self._samples[self._row_of[row_id]]
+
+    def _search(self, query: str, top_k: int, threshold: float, lang: Optional[str]) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        np = self._np
+        with self._lock:
+            vectors, alive, langs, ids, codes = self._vectors, self._alive, self._langs, self._ids, self._codes
+        empty = np.empty(0, dtype=np.int64)
+        if not len(ids):
+            return empty, np.empty(0, dtype=np.float32), vectors
+        mask = alive if lang is None else alive & (langs == LANG_CODES.get(lang, OTHER_LANG))
+        query_vector = self._encode([query])[0]
+        if codes is not None:
+            top, sims = quantized_search(
+                vectors, codes, query_vector, mask, top_k=top_k, threshold=threshold, oversample=self.oversample,
+            )
+            return ids[top], sims, np.asarray(vectors[top])
+        scores = np.where(mask, vectors @ query_vector, -np.inf)
+        k = min(top_k, int(mask.sum()))
+        if k == 0:
+            return empty, scores[:0], vectors
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top = top[scores[top] >= threshold]
+        return ids[top], scores[top], vectors[top]
+
+    def search(
+        self, query: str, top_k: int = 5, threshold: float = 0.0, lang: Optional[str] = None
+    ) -> Tuple[List[int], List[float]]:
+        """返回 (行 ID, 相似度)，已删除的行和其他语言的行被屏蔽。"""
+        ids, scores, _ = self._search(query, top_k, threshold, lang)
+        return ids.tolist(), scores.tolist()
+
+    def retrieve(
+        self, query: str, top_k: int = 5, threshold: float = 0.0, lang: Optional[str] = None, *, return_vectors: bool = False
+    ):
+        """与 rag_utils.Retriever.retrieve 相同的返回形式：(样本, 相似度)[, 候选向量]。"""
+        ids, scores, vectors = self._search(query, top_k, threshold, lang)
+        with self._lock:
+            # 后台压缩可能恰好清除了刚打上墓碑的行
+            keep = [k for k, i in enumerate(ids.tolist()) if i in self._row_of]
+            examples = [self.get(int(ids[k])) for k in keep]
+        sims = scores[keep].tolist()
+        return (examples, sims, self._np.asarray(vectors[keep])) if return_vectors else (examples, sims)
+
+    def search_batch(
+        self,
+        queries: Sequence[str],
+        langs: Sequence[str],
+        *,
+        top_k: int = 20,
+        threshold: float = 0.0,
+        cross_lingual: bool = True,
+    ) -> List[Tuple[Candidates, Optional[Candidates]]]:
+        """批量检索：每条 query 返回 (同语言分区候选, 跨语言候选或 None)，共用一个得分矩阵。"""
+        np = self._np
+        with self._lock:
+            vectors, alive, row_langs, ids, codes = self._vectors, self._alive, self._langs, self._ids, self._codes
+        if not len(ids) or not queries:
+            return [(([], [], vectors[:0]), None) for _ in queries]
+        hits = partitioned_search(
+            vectors, row_langs, alive, self._encode(list(queries)),
+            np.array([LANG_CODES.get(l, OTHER_LANG) for l in langs], dtype=np.uint8),
+            top_k=top_k, threshold=threshold, cross_lingual=cross_lingual,
+            codes=codes, oversample=self.oversample,
+        )
+
+        def gather(hit):
+            if hit is None:
+                return None
+            rows, sims = hit
+            with self._lock:
+                keep = [k for k, r in enumerate(rows) if int(ids[r]) in self._row_of]
+                examples = [self.get(int(ids[rows[k]])) for k in keep]
+            return examples, sims[keep].tolist(), np.asarray(vectors[rows[keep]])
+
+        return [(gather(primary), gather(fallback)) for primary, fallback in hits]
+
+    def view(self, lang: str) -> "_LangView":
+        return _LangView(self, lang)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            **self.meta,
+            "quantization": self.quantization,
+            "code_mb": self._codes.nbytes / (1 << 20) if self._codes is not None else None,
+            "rows": len(self._ids),
+            "live": len(self),
+            "tombstoned": self.num_tombstoned,
+            "live_by_lang": {lang: len(self.ids_by_lang(lang)) for lang in LANG_CODES},
+        }
+
+
+class _LangView:
+    """单一语言的只读检索视图，可直接替换 RAG4JSON 中的 retriever_zh / retriever_en。"""
+
+    def __init__(self, index: KBIndex, lang: str):
+        self.index = index
+        self.lang = lang
+
+    def __len__(self) -> int:
+        return len(self.index.ids_by_lang(self.lang))
+
+    def retrieve(self, query: str, top_k: int = 5, threshold: float = 0.0, *, return_vectors: bool = False):
+        return self.index.retrieve(query, top_k=top_k, threshold=threshold, lang=self.lang, return_vectors=return_vectors)
+
+
+def open_index(
+    index_dir: Union[str, Path],
+    *,
+    model_name: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    device: Optional[str] = None,
+    text_key: str = "input",
+    with_encoder: bool = True,
+    runtime: Optional[str] = None,
+    onnx_dir: Optional[str] = None,
+    **kwargs,
+) -> KBIndex:
+    """
+    打开（或新建）索引；模型名与编码运行时默认沿用索引中记录的模型
+    （记录形如 <模型>@onnx-int8，见 retrieval.encoder_key）。
+    """
+    meta_path = Path(index_dir) / "meta.json"
+    if model_name is None and meta_path.exists():
+        recorded = json_io.load_json(meta_path)["model_name"]
+        if recorded:
+            model_name, _, recorded_runtime = recorded.partition("@")
+            runtime = runtime or recorded_runtime or None
+    runtime = runtime or "torch"
+    encoder = None
+    if with_encoder:
+        from retrieval import DEFAULT_ENCODER, build_encoder
+
+        model_name = model_name or DEFAULT_ENCODER
+        encoder = build_encoder(model_name, cache_dir=cache_dir, device=device, runtime=runtime, onnx_dir=onnx_dir)
+    if model_name:
+        from retrieval import encoder_key
+
+        model_name = encoder_key(model_name, runtime)
+    return KBIndex(index_dir, encoder=encoder, model_name=model_name, text_key=text_key, **kwargs)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="可增量更新的知识库向量索引")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def add_common(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--index_dir", type=Path, required=True)
+
+    p_sync = sub.add_parser("sync", help="与知识库文件同步：追加新增/修改的行，删除消失的行")
+    add_common(p_sync)
+    p_sync.add_argument("--knowledge_base_path", type=Path, required=True, help="知识库 (.json/.jsonl/.rcol)")
+    p_sync.add_argument("--text_key", type=str, default="input")
+    p_sync.add_argument("--encoder_model", type=str, default=None)
+    p_sync.add_argument("--embedding_cache", type=str, default=None)
+    p_sync.add_argument("--device", type=str, default=None)
+    p_sync.add_argument("--encoder_runtime", choices=["torch", "onnx", "onnx-int8"], default=None,
+                        help="编码运行时（默认沿用索引记录，新索引为 torch）；onnx 需 --onnx_dir，见 encoder_runtime.py")
+    p_sync.add_argument("--onnx_dir", type=str, default=None)
+    p_sync.add_argument("--keep_empty", action="store_true", help="保留 output 为空的样本（RAG4JSON 默认过滤）")
+
+    p_delete = sub.add_parser("delete", help="按行 ID 删除")
+    add_common(p_delete)
+    p_delete.add_argument("--ids", type=int, nargs="+", required=True)
+
+    p_compact = sub.add_parser("compact", help="立即压缩，清除墓碑")
+    add_common(p_compact)
+
+    p_info = sub.add_parser("info", help="打印索引统计")
+    add_common(p_info)
+
+    args = parser.parse_args(argv)
+    metrics = get_metrics("kb_index")
+
+    if args.command == "sync":
+        from retrieval import detect_language
+
+        index = open_index(
+            args.index_dir, model_name=args.encoder_model, cache_dir=args.embedding_cache,
+            device=args.device, text_key=args.text_key, background_compact=False,
+            runtime=args.encoder_runtime, onnx_dir=args.onnx_dir,
+        )
+        kb = json_io.load_json_or_jsonl(args.knowledge_base_path)
+        if not args.keep_empty:
+            kb = [s for s in kb if not (isinstance(s.get("output"), list) and len(s["output"]) == 0)]
+        with metrics.stage("sync") as st:
+            added, removed = index.sync(kb, detect_language)
+            st.rows = len(kb)
+        metrics.update({"added": len(added), "removed": len(removed)}, prefix="kb_index.")
+        print(f"🔄 同步完成: 新增 {len(added)} 行，删除 {len(removed)} 行，当前 {len(index)} 行")
+    else:
+        index = open_index(args.index_dir, with_encoder=False, background_compact=False)
+        if args.command == "delete":
+            n = index.delete(args.ids)
+            print(f"🗑️ 已删除 {n} 行")
+        elif args.command == "compact":
+            with metrics.stage("compact") as st:
+                st.rows = len(index)
+                index.compact()
+            print(f"🧹 压缩完成，当前第 {index.meta['generation']} 代，{len(index)} 行")
+    print(json_io.dumps(index.info(), indent=True))
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统一入口：在同一个进程里运行一个或多个流水线阶段
+
+各阶段的模块只在被调用时才导入，并且在同一次调用里只导入一次，
+小分片任务不再为每个阶段重复付出解释器启动与依赖导入的开销。
+多个阶段之间用单独的 `::` 分隔，按顺序执行。
+
+用法:
+  python llm4re.py step2 --input_path data/dev2.json --output_path data/step1_dev2.json
+  python llm4re.py split --input_path data/train2.json --output_dir data \
+      :: rag --knowledge_base_path data/train2.json --data_path data/dev2.json --output_path data/rag_dev2.json \
+      :: convert --data_path data/rag_dev2.json --output_path data/converted_dev2_rag.json
+  python llm4re.py --list
+"""
+
+import importlib
+import sys
+from typing import Callable, Dict, List, Optional, Tuple
+
+# 阶段名 -> (模块, 入口函数, 说明)；入口函数均接受 argv 列表
+COMMANDS: Dict[str, Tuple[str, str, str]] = {
+    "split": ("seprate_language", "main", "按语言分离数据集"),
+    "dedupe": ("near_dup", "main", "近重复 / 泄漏检测与去重"),
+    "kb_index": ("kb_index", "main", "增量知识库索引：同步 / 删除 / 压缩"),
+    "rag": ("RAG4JSON", "main", "检索相似样本做增强"),
+    "eval_retrieval": ("eval_retrieval", "main", "检索效果与延迟离线评测"),
+    "encoder": ("encoder_runtime", "main", "句向量编码器导出 ONNX / int8 量化与速度、漂移基准"),
+    "convert": ("conver_train_for_lora", "main", "转换为 LoRA SFT 格式"),
+    "step1": ("step1_convert", "main", "step-1 前置过滤数据转换"),
+    "gate": ("step1_gate", "main", "Step-1 CPU 门控（训练 / 门控 / 合并 LLM 判定）"),
+    "gazetteer": ("gazetteer", "main", "KB 实体名 Aho-Corasick 词典（构建 / 扫描）"),
+    "target": ("target_format", "main", "紧凑目标格式统计与往返校验"),
+    "budget": ("generation_budget", "main", "逐行 max_new_tokens 预算（拟合 / 分布报告）"),
+    "infer": ("budgeted_infer", "main", "按行预算生成，JSON 数组闭合即停，触顶行可重跑"),
+    "tokens": ("token_cache", "main", "预分词 token id 缓存（构建 / 长度统计 / 导出 tokenized_path）"),
+    "pack": ("pack_planner", "main", "按精确 token 长度离线打包训练序列（FFD）"),
+    "step2": ("step2_convert", "main", "step-2 前置过滤数据转换"),
+    "extract_step1": ("extract_step1", "main", "提取 step-1 的 yes/no 预测"),
+    "extract_entities": ("extract_prediction", "cli", "解析实体抽取预测"),
+    "predict": ("get_predict", "main", "解析三元组预测并评分"),
+    "columnar": ("columnar_store", "main", ".rcol 列式存储工具"),
+    "indexed": ("indexed_jsonl", "main", "JSON/JSONL 偏移索引、抽样与分片"),
+    "bench": ("benchmark", "main", "流水线基准测试"),
+}
+
+SEPARATOR = "::"
+
+
+def resolve(command: str) -> Callable[[Optional[List[str]]], None]:
+    if command not in COMMANDS:
+        raise SystemExit(f"未知阶段: {command}（可用: {', '.join(COMMANDS)}）")
+    module_name, func_name, _ = COMMANDS[command]
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def split_stages(argv: List[str]) -> List[List[str]]:
+    stages: List[List[str]] = [[]]
+    for token in argv:
+        if token == SEPARATOR:
+            stages.append([])
+        else:
+            stages[-1].append(token)
+    return [s for s in stages if s]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help", "--list"):
+        print(__doc__)
+        for name, (module_name, _, desc) in COMMANDS.items():
+            print(f"  {name:<18} {desc} ({module_name}.py)")
+        return
+
+    from metrics import reset_metrics
+
+    for stage_argv in split_stages(argv):
+        command, args = stage_argv[0], stage_argv[1:]
+        print(f"\n▶️ {command} {' '.join(args)}")
+        resolve(command)(args)
+        # 每个阶段单独写一条运行汇总
+        reset_metrics()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+轻量的分阶段埋点：计时、计数器、内存采样，输出机器可读的 JSONL 运行报告
+
+脚本里的用法:
+    metrics = get_metrics("RAG4JSON")
+    with metrics.stage("retrieve") as st:
+        ...
+        st.rows = len(samples)
+        metrics.count("retrieval.full")
+    metrics.finish()
+
+通过环境变量开启，无需改代码:
+  LLM4RE_METRICS=run_report.jsonl        追加写入 JSONL 报告（不设置则只在内存中统计）
+  LLM4RE_PROFILE=cprofile|pyinstrument   对阶段做 profile
+  LLM4RE_PROFILE_STAGES=retrieve,convert 仅 profile 指定阶段（默认全部）
+  LLM4RE_PROFILE_DIR=profiles            profile 输出目录
+  LLM4RE_RSS_INTERVAL=0.5                阶段内 RSS 采样间隔（秒），0 关闭；未设置 LLM4RE_METRICS 时不采样
+
+计数器命名约定：<name>.hit / <name>.miss 会在报告中自动汇总为 <name>.hit_rate，
+retrieval.full / partial / zero 会汇总为 retrieval.coverage。
+"""
+
+import atexit
+import os
+import resource
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb() -> Optional[float]:
+    """当前常驻内存（MB）；优先读 /proc，退化到 psutil。"""
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * _PAGE_SIZE / (1 << 20)
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss / (1 << 20)
+    except ImportError:
+        return None
+
+
+def peak_rss_mb() -> float:
+    # Linux 下 ru_maxrss 单位为 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _RssSampler(threading.Thread):
+    """后台线程按固定间隔采样 RSS，记录阶段内峰值。"""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_mb() or 0.0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            rss = current_rss_mb()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self) -> float:
+        self._stop_event.set()
+        self.join()
+        rss = current_rss_mb()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+        return self.peak
+
+
+class StageRecord:
+    def __init__(self, name: str):
+        self.name = name
+        self.rows: Optional[int] = None
+        self.counters: Counter = Counter()
+        self.extra: Dict[str, Any] = {}
+
+
+class RunMetrics:
+    def __init__(
+        self,
+        script: str,
+        *,
+        report_path: Optional[str] = None,
+        profiler: Optional[str] = None,
+        profile_stages: Optional[List[str]] = None,
+        profile_dir: str = "profiles",
+        rss_interval: float = 0.5,
+    ):
+        self.script = script
+        self.run_id = uuid.uuid4().hex[:12]
+        self.report_path = Path(report_path) if report_path else None
+        self.profiler = profiler
+        self.profile_stages = set(profile_stages) if profile_stages else None
+        self.profile_dir = Path(profile_dir)
+        self.rss_interval = rss_interval
+        self.counters: Counter = Counter()
+        self.stages: List[Dict[str, Any]] = []
+        self._stage_stack: List[StageRecord] = []
+        self._start = time.perf_counter()
+        self._finished = False
+
+    @property
+    def enabled(self) -> bool:
+        """是否写出报告（LLM4RE_METRICS）。"""
+        return self.report_path is not None
+
+    @classmethod
+    def from_env(cls, script: str) -> "RunMetrics":
+        stages = os.environ.get("LLM4RE_PROFILE_STAGES")
+        return cls(
+            script,
+            report_path=os.environ.get("LLM4RE_METRICS") or None,
+            profiler=os.environ.get("LLM4RE_PROFILE") or None,
+            profile_stages=[s.strip() for s in stages.split(",") if s.strip()] if stages else None,
+            profile_dir=os.environ.get("LLM4RE_PROFILE_DIR", "profiles"),
+            rss_interval=float(os.environ.get("LLM4RE_RSS_INTERVAL", "0.5")),
+        )
+
+    # ----------------------------
+    # 计数器
+    # ----------------------------
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] += value
+        if self._stage_stack:
+            self._stage_stack[-1].counters[name] += value
+
+    def update(self, counts: Dict[str, int], prefix: str = "") -> None:
+        for name, value in counts.items():
+            self.count(f"{prefix}{name}", value)
+
+    # ----------------------------
+    # 阶段
+    # ----------------------------
+
+    def _should_profile(self, name: str) -> bool:
+        return bool(self.profiler) and (self.profile_stages is None or name in self.profile_stages)
+
+    @contextmanager
+    def _profile(self, name: str) -> Iterator[None]:
+        if not self._should_profile(name):
+            yield
+            return
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stem = self.profile_dir / f"{self.script}.{name}.{self.run_id}"
+        if self.profiler == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                stem.with_name(stem.name + ".html").write_text(profiler.output_html(), encoding="utf-8")
+        else:
+            import cProfile
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(str(stem.with_name(stem.name + ".prof")))
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        record = StageRecord(name)
+        self._stage_stack.append(record)
+        # 不写报告时峰值无人读取，不启动采样线程
+        sampler = _RssSampler(self.rss_interval) if self.enabled and self.rss_interval > 0 else None
+        if sampler is not None:
+            sampler.start()
+        rss_start = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            with self._profile(name):
+                yield record
+        finally:
+            wall = time.perf_counter() - start
+            self._stage_stack.pop()
+            entry: Dict[str, Any] = {
+                "event": "stage",
+                "stage": name,
+                "wall_s": round(wall, 6),
+                "rows": record.rows,
+                "rows_per_s": round(record.rows / wall, 2) if record.rows and wall > 0 else None,
+                "rss_start_mb": rss_start,
+                "rss_end_mb": current_rss_mb(),
+                "rss_peak_mb": sampler.stop() if sampler is not None else None,
+            }
+            if record.counters:
+                entry["counters"] = dict(record.counters)
+                entry.update(derived_metrics(record.counters))
+            entry.update(record.extra)
+            self.stages.append(entry)
+            self._emit(entry)
+
+    # ----------------------------
+    # 输出
+    # ----------------------------
+
+    def _emit(self, entry: Dict[str, Any]) -> None:
+        if self.report_path is None:
+            return
+        import json_io
+
+        line = {"run_id": self.run_id, "script": self.script, "ts": time.time(), **entry}
+        self.report_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.report_path.open("ab") as fp:
+            fp.write(json_io.dumps_bytes(line) + b"\n")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "event": "run",
+            "wall_s": round(time.perf_counter() - self._start, 6),
+            "peak_rss_mb": peak_rss_mb(),
+            "counters": dict(self.counters),
+            **derived_metrics(self.counters),
+            "stages": [s["stage"] for s in self.stages],
+        }
+
+    def finish(self) -> Dict[str, Any]:
+        """写出整次运行的汇总记录（只会写一次）。"""
+        summary = self.summary()
+        if not self._finished:
+            self._finished = True
+            self._emit(summary)
+        return summary
+
+
+def derived_metrics(counters: Dict[str, int]) -> Dict[str, float]:
+    """由约定命名的计数器推导命中率 / 检索覆盖率。"""
+    derived: Dict[str, float] = {}
+    for name in counters:
+        if name.endswith(".hit"):
+            base = name[: -len(".hit")]
+            total = counters[name] + counters.get(f"{base}.miss", 0)
+            if total:
+                derived[f"{base}.hit_rate"] = round(counters[name] / total, 6)
+    full = counters.get("retrieval.full", 0)
+    partial = counters.get("retrieval.partial", 0)
+    zero = counters.get("retrieval.zero", 0)
+    total = full + partial + zero
+    if total:
+        derived["retrieval.coverage"] = round((full + partial) / total, 6)
+        derived["retrieval.full_rate"] = round(full / total, 6)
+    return derived
+
+
+_METRICS: Optional[RunMetrics] = None
+
+
+def get_metrics(script: Optional[str] = None) -> RunMetrics:
+    """进程内共享的 RunMetrics；首次调用时按环境变量初始化，退出时自动写汇总。"""
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = RunMetrics.from_env(script or "llm4re")
+        atexit.register(_METRICS.finish)
+    return _METRICS
+
+
+def reset_metrics() -> None:
+    """写出当前汇总并清空单例；同一进程内依次运行多个脚本时使用。"""
+    global _METRICS
+    if _METRICS is not None:
+        _METRICS.finish()
+        atexit.unregister(_METRICS.finish)
+        _METRICS = None
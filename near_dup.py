@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基于 MinHash + LSH 的近重复检测与跨划分泄漏检测
+
+- 句子先归一化（小写、去除所有空白），再取字符 k-gram 作为 shingle，
+  对 NYT 的 " , " 式分词差异和中文句子同样有效
+- LSH 分桶后只对候选对做签名比对，整体接近线性时间
+- RAG4JSON 用 NearDupIndex 排除与 query 近重复的“自身”样本
+- dedupe 子命令在转换前对训练集做去重，并剔除与 dev/test 近重复的训练样本
+
+用法:
+  python near_dup.py dedupe \
+    --train_paths data/train2.json \
+    --eval_paths data/dev2.json data/test2.json \
+    --output_dir data/dedup \
+    --threshold 0.8
+"""
+
+import argparse
+import re
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+import json_io
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    return _WHITESPACE.sub("", (text or "").lower())
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """选取 (bands, rows)，使 LSH 的 S 曲线拐点 (1/b)^(1/r) 最接近阈值。"""
+    best = (num_perm, 1)
+    best_err = float("inf")
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if bands == 0:
+            break
+        err = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if err < best_err:
+            best, best_err = (bands, rows), err
+    return best
+
+
+class MinHasher:
+    """字符 k-gram 的 MinHash 签名。"""
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        import numpy as np
+
+        self._np = np
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> "np.ndarray":
+        norm = normalize_text(text)
+        k = self.shingle_size
+        if len(norm) <= k:
+            grams = {norm}
+        else:
+            grams = {norm[i:i + k] for i in range(len(norm) - k + 1)}
+        return self._np.fromiter(
+            (zlib.crc32(g.encode("utf-8")) for g in grams), dtype=self._np.uint64, count=len(grams)
+        )
+
+    def signature(self, text: str) -> "np.ndarray":
+        hashes = self.shingles(text)
+        # (num_perm, num_shingles) 的置换哈希，逐行取最小值
+        np = self._np
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(_MERSENNE_PRIME) & np.uint64(_MAX_HASH)
+        return permuted.min(axis=1).astype(np.uint32)
+
+
+class NearDupIndex:
+    """MinHash-LSH 索引：add 后可查询近重复的 key，并可导出近重复簇。"""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm=num_perm, shingle_size=shingle_size)
+        self.bands, self.rows = choose_bands(threshold, num_perm)
+        self._buckets: List[Dict[bytes, List[Hashable]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures: Dict[Hashable, "np.ndarray"] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, sig: "np.ndarray") -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            yield band, sig[band * self.rows:(band + 1) * self.rows].tobytes()
+
+    def _candidates(self, sig: "np.ndarray") -> set:
+        found = set()
+        for band, key in self._band_keys(sig):
+            found.update(self._buckets[band].get(key, ()))
+        return found
+
+    def similarity(self, sig_a: "np.ndarray", sig_b: "np.ndarray") -> float:
+        return float((sig_a == sig_b).mean())
+
+    def add(self, key: Hashable, text: str, signature: Optional["np.ndarray"] = None) -> List[Hashable]:
+        """加入一条文本，返回已在索引中且与之近重复的 key。"""
+        sig = self.hasher.signature(text) if signature is None else signature
+        dups = self._verify(sig, self._candidates(sig))
+        if key not in self._signatures:
+            for band, band_key in self._band_keys(sig):
+                self._buckets[band][band_key].append(key)
+        self._signatures[key] = sig
+        return dups
+
+    def query(self, text: str, signature: Optional["np.ndarray"] = None) -> List[Hashable]:
+        sig = self.hasher.signature(text) if signature is None else signature
+        return self._verify(sig, self._candidates(sig))
+
+    def _verify(self, sig: "np.ndarray", candidates: Iterable[Hashable]) -> List[Hashable]:
+        return [
+            key for key in candidates
+            if self.similarity(sig, self._signatures[key]) >= self.threshold
+        ]
+
+
+class _UnionFind:
+    def __init__(self):
+        self.parent: Dict[Hashable, Hashable] = {}
+
+    def find(self, x: Hashable) -> Hashable:
+        self.parent.setdefault(x, x)
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: Hashable, b: Hashable) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[rb] = ra
+
+
+def find_clusters(
+    splits: Dict[str, List[Dict[str, Any]]],
+    *,
+    text_key: str = "sentence",
+    threshold: float = 0.8,
+    num_perm: int = 128,
+    shingle_size: int = 5,
+) -> List[List[Tuple[str, int]]]:
+    """对多个划分一起做近重复聚类，返回大小 > 1 的簇，成员为 (split, 行号)。"""
+    index = NearDupIndex(threshold=threshold, num_perm=num_perm, shingle_size=shingle_size)
+    from tqdm import tqdm
+
+    uf = _UnionFind()
+    for split, rows in splits.items():
+        for i, row in enumerate(tqdm(rows, desc=f"MinHash ({split})")):
+            key = (split, i)
+            uf.find(key)
+            for dup in index.add(key, row.get(text_key, "")):
+                uf.union(dup, key)
+
+    groups: Dict[Hashable, List[Tuple[str, int]]] = defaultdict(list)
+    for key in uf.parent:
+        groups[uf.find(key)].append(key)
+    return [sorted(g) for g in groups.values() if len(g) > 1]
+
+
+def dedupe_splits(
+    train: Dict[str, List[Dict[str, Any]]],
+    evals: Dict[str, List[Dict[str, Any]]],
+    *,
+    text_key: str = "sentence",
+    threshold: float = 0.8,
+) -> Tuple[Dict[str, List[Dict[str, Any]]], Dict[str, Any]]:
+    """训练划分内部去重（保留首条），并剔除与任一评测划分近重复的训练样本；评测划分不做修改。"""
+    clusters = find_clusters({**evals, **train}, text_key=text_key, threshold=threshold)
+
+    drop: Dict[str, set] = defaultdict(set)
+    leaked = 0
+    duplicated = 0
+    for cluster in clusters:
+        has_eval = any(split in evals for split, _ in cluster)
+        train_members = [m for m in cluster if m[0] in train]
+        if has_eval:
+            leaked += len(train_members)
+            for split, i in train_members:
+                drop[split].add(i)
+        else:
+            duplicated += len(train_members) - 1
+            for split, i in train_members[1:]:
+                drop[split].add(i)
+
+    kept = {
+        split: [row for i, row in enumerate(rows) if i not in drop[split]]
+        for split, rows in train.items()
+    }
+    report = {
+        "threshold": threshold,
+        "num_clusters": len(clusters),
+        "train_duplicates_removed": duplicated,
+        "train_leaked_into_eval_removed": leaked,
+        "eval_internal_clusters": sum(1 for c in clusters if all(s in evals for s, _ in c)),
+        "per_split": {
+            split: {"before": len(train[split]), "after": len(kept[split])} for split in train
+        },
+        "clusters": [[list(m) for m in c] for c in clusters],
+    }
+    return kept, report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="MinHash/LSH 近重复与跨划分泄漏检测")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_dedupe = sub.add_parser("dedupe", help="训练集去重并剔除与评测集近重复的样本")
+    p_dedupe.add_argument("--train_paths", type=Path, nargs="+", required=True, help="待去重的训练划分")
+    p_dedupe.add_argument("--eval_paths", type=Path, nargs="*", default=[], help="只读的评测划分 (dev/test)")
+    p_dedupe.add_argument("--output_dir", type=Path, required=True)
+    p_dedupe.add_argument("--text_key", type=str, default="sentence")
+    p_dedupe.add_argument("--threshold", type=float, default=0.8, help="估计 Jaccard 相似度阈值")
+
+    args = parser.parse_args(argv)
+
+    metrics = get_metrics("near_dup")
+    train = {str(p): json_io.load_json_or_jsonl(p) for p in args.train_paths}
+    evals = {str(p): json_io.load_json_or_jsonl(p) for p in args.eval_paths}
+    with metrics.stage("dedupe") as st:
+        kept, report = dedupe_splits(train, evals, text_key=args.text_key, threshold=args.threshold)
+        st.rows = sum(map(len, train.values())) + sum(map(len, evals.values()))
+    metrics.update({
+        "clusters": report["num_clusters"],
+        "train_duplicates_removed": report["train_duplicates_removed"],
+        "train_leaked_removed": report["train_leaked_into_eval_removed"],
+    }, prefix="near_dup.")
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for path in args.train_paths:
+        out = args.output_dir / f"{path.stem}_dedup{path.suffix}"
+        json_io.write_dataset(out, kept[str(path)])
+        stats = report["per_split"][str(path)]
+        print(f"📝 {path} : {stats['before']} → {stats['after']} 条，已保存到 {out}")
+
+    report_path = args.output_dir / "near_dup_report.json"
+    json_io.write_json(report_path, report)
+    print(f"\n📊 近重复簇: {report['num_clusters']}")
+    print(f"  训练集内部重复剔除: {report['train_duplicates_removed']}")
+    print(f"  与评测集泄漏剔除: {report['train_leaked_into_eval_removed']}")
+    print(f"💾 报告已保存到: {report_path}")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
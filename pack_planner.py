@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+离线序列打包（sequence packing）规划
+
+lora2_train.bash 使用 --packing False、--cutoff_len 2048、per_device_train_batch_size 2：
+短的 step-1 样本要 padding 到同批最长样本的长度。这里在训练前按精确 token 长度
+（token_cache.py 的预分词缓存，按 LLaMA-Factory 规则截断到 cutoff_len）把样本装进 cutoff_len 长的序列：
+
+- 首次适应递减（first-fit-decreasing）：按长度降序逐个放入第一个放得下的序列，
+  “第一个放得下”用剩余容量的最大值线段树查找，O(n log n)
+- 报告打包前后的 padding 效率（真实 token / 批内补齐后的 token）与每个 epoch 的步数
+- --plan_path 写出每个序列包含的行号；--output_dir 写出打包后的数据集（input_ids / labels /
+  attention_mask），attention_mask 为段号 1..k，与 LLaMA-Factory neat_packing 相同，
+  训练时用 --tokenized_path <output_dir> --neat_packing True，样本之间不会互相 attend
+
+用法:
+  python pack_planner.py --data_path data/step1_train2.json --tokenizer /root/autodl-tmp/Llama-3.1-8B-Instruct \
+      --cutoff_len 2048 --plan_path data/step1_train2.pack.jsonl --output_dir saves/tokenized/step1_train2_packed
+"""
+
+import argparse
+import math
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+import json_io
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def first_fit_decreasing(lengths: Sequence[int], capacity: int) -> List[List[int]]:
+    """把行号装箱，每箱总长不超过 capacity；返回每箱的行号列表（箱内按长度降序）。"""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    size = 1
+    while size < max(len(lengths), 1):
+        size *= 2
+    # 叶子为各箱剩余容量（未启用的箱为满容量），内部节点为子树最大值
+    tree = [capacity] * (2 * size)
+    bins: List[List[int]] = []
+    for idx in order:
+        need = lengths[idx]
+        if need > capacity:
+            raise ValueError(f"Row {idx} has {need} tokens, more than the capacity {capacity}")
+        node = 1
+        while node < size:
+            node = 2 * node if tree[2 * node] >= need else 2 * node + 1
+        slot = node - size
+        if slot == len(bins):
+            bins.append([])
+        bins[slot].append(idx)
+        tree[node] -= need
+        node //= 2
+        while node:
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+            node //= 2
+    return bins
+
+
+def padding_efficiency(lengths: "np.ndarray", batch_size: int, *, seed: int = 42) -> float:
+    """随机打乱后按 batch_size 切批、批内补齐到最长：真实 token 数 / 补齐后 token 数。"""
+    import numpy as np
+
+    if len(lengths) == 0:
+        return 1.0
+    shuffled = np.random.default_rng(seed).permutation(np.asarray(lengths, dtype=np.int64))
+    padded = 0
+    for start in range(0, len(shuffled), batch_size):
+        batch = shuffled[start:start + batch_size]
+        padded += int(batch.max()) * len(batch)
+    return float(shuffled.sum()) / padded
+
+
+def plan_report(
+    lengths: "np.ndarray", bins: List[List[int]], *, batch_size: int, grad_accum: int, seed: int = 42
+) -> Dict[str, Any]:
+    import numpy as np
+
+    packed = np.asarray([int(lengths[b].sum()) for b in bins], dtype=np.int64)
+    per_step = batch_size * grad_accum
+    return {
+        "rows": int(len(lengths)),
+        "sequences": len(bins),
+        "tokens": int(lengths.sum()),
+        "efficiency_before": padding_efficiency(lengths, batch_size, seed=seed),
+        "efficiency_after": padding_efficiency(packed, batch_size, seed=seed),
+        "steps_before": math.ceil(len(lengths) / per_step),
+        "steps_after": math.ceil(len(bins) / per_step),
+        "mean_rows_per_sequence": len(lengths) / max(len(bins), 1),
+    }
+
+
+def export_packed(cache: Any, bins: List[List[int]], output_dir: Path, cutoff_len: int) -> int:
+    """写出打包数据集：各样本首尾相接，attention_mask 为段号（neat_packing 据此构造块对角注意力）。"""
+    from datasets import Dataset
+
+    def sequences():
+        for rows in bins:
+            input_ids: List[int] = []
+            labels: List[int] = []
+            segments: List[int] = []
+            for segment, row in enumerate(rows, 1):
+                ids, row_labels = cache.example(row, cutoff_len)
+                input_ids.extend(ids)
+                labels.extend(row_labels)
+                segments.extend([segment] * len(ids))
+            yield {"input_ids": input_ids, "attention_mask": segments, "labels": labels}
+
+    dataset = Dataset.from_generator(sequences)
+    dataset.save_to_disk(str(output_dir))
+    return len(dataset)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Offline first-fit-decreasing sequence packing for SFT data.")
+    parser.add_argument("--data_path", type=Path, default=None, help="转换结果；与 --tokenizer 一起定位预分词缓存")
+    parser.add_argument("--tokenizer", type=str, default=None)
+    parser.add_argument("--template", type=str, default="llama3")
+    parser.add_argument("--cache_dir", type=Path, default=None, help="直接给出 token_cache.py 的缓存目录（不加载 tokenizer）")
+    parser.add_argument("--cutoff_len", type=int, default=2048, help="打包序列长度（与训练的 cutoff_len 一致）")
+    parser.add_argument("--batch_size", type=int, default=2, help="per_device_train_batch_size，用于估算 padding 效率")
+    parser.add_argument("--grad_accum", type=int, default=8, help="gradient_accumulation_steps，用于估算步数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--plan_path", type=Path, default=None, help="每行一个序列：{rows, tokens}")
+    parser.add_argument("--output_dir", type=Path, default=None, help="打包后的数据集（需要 datasets）")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    import numpy as np
+    from metrics import get_metrics
+    from token_cache import TokenCache, load_tokenizer, open_cache
+
+    metrics = get_metrics("pack_planner")
+    if args.cache_dir is not None:
+        cache = TokenCache(args.cache_dir)
+    elif args.data_path is not None and args.tokenizer:
+        cache = open_cache(args.data_path, load_tokenizer(args.tokenizer), args.template)
+        if cache is None:
+            raise SystemExit(f"❌ {args.data_path} 没有最新的预分词缓存，请先运行 token_cache.py build")
+    else:
+        raise SystemExit("❌ 需要 --cache_dir，或 --data_path 与 --tokenizer")
+
+    lengths = np.minimum(cache.lengths, args.cutoff_len)
+    with metrics.stage("pack") as st:
+        bins = first_fit_decreasing(lengths.tolist(), args.cutoff_len)
+        st.rows = len(lengths)
+        report = plan_report(lengths, bins, batch_size=args.batch_size, grad_accum=args.grad_accum, seed=args.seed)
+        st.extra.update(report)
+
+    print(f"✅ {report['rows']} 行 → {report['sequences']} 个 {args.cutoff_len} token 序列"
+          f"（平均每序列 {report['mean_rows_per_sequence']:.1f} 行）")
+    print(f"   padding 效率 {report['efficiency_before']:.1%} → {report['efficiency_after']:.1%}"
+          f"（batch_size={args.batch_size}）")
+    print(f"   每 epoch 步数 {report['steps_before']} → {report['steps_after']}"
+          f"（batch_size × grad_accum = {args.batch_size * args.grad_accum}）")
+
+    if args.plan_path is not None:
+        with json_io.open_writer(args.plan_path) as writer:
+            writer.write_many({"rows": rows, "tokens": int(lengths[rows].sum())} for rows in bins)
+        print(f"💾 打包方案已保存到 {args.plan_path}")
+    if args.output_dir is not None:
+        with metrics.stage("export") as st:
+            st.rows = export_packed(cache, bins, args.output_dir, args.cutoff_len)
+        print(f"💾 打包数据集已保存到 {args.output_dir}；训练时使用 --tokenized_path {args.output_dir} --neat_packing True")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+紧凑的内存样本表示：带 __slots__ 的 Sample + 全局标签词表
+
+原始数据里每条样本都是一个 dict，重复携带相同的 schema 列表、coarse_types、source 字符串；
+RAG4JSON.py 同时持有知识库、query 和增强后的副本时内存随之膨胀。这里：
+
+- relation / coarse type / source / language 都映射为词表中的小整数（Vocab），
+  schema 与 coarse_types 存为 id 元组，相同的元组全局只存一份
+- output 中的三元组存为 (主体, 主体粗类型 id, 主体细类型, 关系 id, 客体, 客体粗类型 id, 客体细类型) 元组，
+  实体名与细类型用 sys.intern 去重；不符合该结构的 output 原样保留
+- Sample 实现 get / [] / in / keys / items，现有按 dict 读写样本的代码无需修改；
+  读取编码字段返回新解码的 list，修改后需重新赋值（s["output"] = ...）才会保存
+- to_dict() 按原键顺序还原，与原 JSON 完全一致；json_io 写出时自动调用 to_dict
+- 分组 / 计数（group_by、label_counts）直接在整数 id 上进行
+
+读取时（load_samples / iter_samples）转换为 Sample，写出时（json_io 各 writer）还原为 dict，
+转换只发生在读写边界。
+"""
+
+import sys
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import json_io
+
+
+class Vocab:
+    """字符串 ↔ 连续小整数。"""
+
+    __slots__ = ("name", "_ids", "_labels")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._ids: Dict[str, int] = {}
+        self._labels: List[str] = []
+
+    def id(self, label: str) -> int:
+        found = self._ids.get(label)
+        if found is None:
+            found = self._ids[label] = len(self._labels)
+            self._labels.append(sys.intern(label))
+        return found
+
+    def label(self, index: int) -> str:
+        return self._labels[index]
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    def __contains__(self, label: str) -> bool:
+        return label in self._ids
+
+
+RELATIONS = Vocab("relation")
+COARSE_TYPES = Vocab("coarse_type")
+SOURCES = Vocab("source")
+LANGUAGES = Vocab("language")
+
+# 相同的 id 元组 / 键顺序全局共享一个对象
+_TUPLES: Dict[Tuple, Tuple] = {}
+
+
+def _shared(value: Tuple) -> Tuple:
+    return _TUPLES.setdefault(value, value)
+
+
+def _is_str_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _is_entity(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 3 and all(isinstance(v, str) for v in value)
+
+
+_TRIPLE_KEYS = ["subject", "relationship", "object"]
+
+
+def _encode_output(output: Any) -> Any:
+    """三元组列表 → 元组的元组；结构不符时原样返回（list）。"""
+    if not isinstance(output, list):
+        return output
+    triples = []
+    for t in output:
+        if not (isinstance(t, dict) and list(t) == _TRIPLE_KEYS and _is_entity(t["subject"])
+                and _is_entity(t["object"]) and isinstance(t["relationship"], str)):
+            return output
+        s, o = t["subject"], t["object"]
+        triples.append((
+            sys.intern(s[0]), COARSE_TYPES.id(s[1]), sys.intern(s[2]),
+            RELATIONS.id(t["relationship"]),
+            sys.intern(o[0]), COARSE_TYPES.id(o[1]), sys.intern(o[2]),
+        ))
+    return tuple(triples)
+
+
+def _decode_output(output: Any) -> Any:
+    if not isinstance(output, tuple):
+        return output
+    coarse, rel = COARSE_TYPES.label, RELATIONS.label
+    return [
+        {"subject": [s, coarse(sc), sf], "relationship": rel(r), "object": [o, coarse(oc), of]}
+        for s, sc, sf, r, o, oc, of in output
+    ]
+
+
+# 字段名 → (slot, 编码, 解码)；值类型不符时存入 _extra，保证无损
+def _ids_codec(vocab: Vocab):
+    return (
+        lambda v: _shared(tuple(vocab.id(x) for x in v)) if _is_str_list(v) else None,
+        lambda ids: [vocab.label(i) for i in ids],
+    )
+
+
+def _label_codec(vocab: Vocab):
+    return (
+        lambda v: vocab.id(v) if isinstance(v, str) else None,
+        vocab.label,
+    )
+
+
+_FIELDS = {
+    "sentence": ("sentence", lambda v: v if isinstance(v, str) else None, lambda v: v),
+    "schema": ("schema", *_ids_codec(RELATIONS)),
+    "coarse_types": ("coarse_types", *_ids_codec(COARSE_TYPES)),
+    "source": ("source", *_label_codec(SOURCES)),
+    "detected_language": ("language", *_label_codec(LANGUAGES)),
+    "output": ("output", lambda v: _encode_output(v) if isinstance(v, list) else None, _decode_output),
+}
+
+
+class Sample:
+    """一条样本；读写接口与 dict 相同，常见字段以整数 id / 共享元组保存。"""
+
+    __slots__ = ("sentence", "schema", "coarse_types", "source", "language", "output", "_keys", "_extra")
+
+    def __init__(self):
+        self.sentence = self.schema = self.coarse_types = None
+        self.source = self.language = self.output = None
+        self._keys: Tuple[str, ...] = ()
+        self._extra: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def from_dict(cls, row: Dict[str, Any]) -> "Sample":
+        sample = cls()
+        extra = None
+        for key, value in row.items():
+            field = _FIELDS.get(key)
+            encoded = field[1](value) if field is not None else None
+            if encoded is None:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+            else:
+                setattr(sample, field[0], encoded)
+        sample._extra = extra
+        sample._keys = _shared(tuple(row))
+        return sample
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: self[key] for key in self._keys}
+
+    # ---- dict 兼容接口 ----
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        field = _FIELDS.get(key)
+        if field is not None:
+            encoded = getattr(self, field[0])
+            if encoded is not None:
+                return field[2](encoded)
+        return self._extra[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        field = _FIELDS.get(key)
+        encoded = field[1](value) if field is not None else None
+        if encoded is not None:
+            setattr(self, field[0], encoded)
+            if self._extra is not None:
+                self._extra.pop(key, None)
+        else:
+            if field is not None:
+                setattr(self, field[0], None)
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+        if key not in self._keys:
+            self._keys = _shared(self._keys + (key,))
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self._keys:
+            raise KeyError(key)
+        field = _FIELDS.get(key)
+        if field is not None:
+            setattr(self, field[0], None)
+        if self._extra is not None:
+            self._extra.pop(key, None)
+        self._keys = _shared(tuple(k for k in self._keys if k != key))
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sample):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"Sample({self.to_dict()!r})"
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self._keys else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._keys
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return ((key, self[key]) for key in self._keys)
+
+    def values(self) -> Iterator[Any]:
+        return (self[key] for key in self._keys)
+
+    # ---- 不解码的快速访问 ----
+
+    def is_empty_output(self) -> bool:
+        output = self.output if self.output is not None else (self._extra or {}).get("output")
+        return isinstance(output, (list, tuple)) and len(output) == 0
+
+    def output_relation_ids(self) -> Tuple[int, ...]:
+        """output 中的关系 id（结构不符的 output 返回空元组）。"""
+        return tuple(t[3] for t in self.output) if isinstance(self.output, tuple) else ()
+
+
+_GROUP_FIELDS = {"source": SOURCES, "detected_language": LANGUAGES}
+
+
+def group_by(samples: Iterable[Sample], field: str) -> Dict[Optional[str], List[Sample]]:
+    """按 source / detected_language 分组；在整数 id 上分组，最后才还原标签。"""
+    vocab = _GROUP_FIELDS[field]
+    slot = _FIELDS[field][0]
+    groups: Dict[Optional[int], List[Sample]] = defaultdict(list)
+    for sample in samples:
+        groups[getattr(sample, slot)].append(sample)
+    return {(None if k is None else vocab.label(k)): v for k, v in groups.items()}
+
+
+def label_counts(samples: Iterable[Sample], field: str) -> Counter:
+    """schema / coarse_types / source / detected_language 的标签计数。"""
+    slot = _FIELDS[field][0]
+    vocab = {"schema": RELATIONS, "coarse_types": COARSE_TYPES, **_GROUP_FIELDS}[field]
+    counts: Counter = Counter()
+    for sample in samples:
+        value = getattr(sample, slot)
+        if isinstance(value, tuple):
+            counts.update(value)
+        elif value is not None:
+            counts[value] += 1
+    return Counter({vocab.label(k): n for k, n in counts.items()})
+
+
+# ----------------------------
+# 读写边界
+# ----------------------------
+
+def iter_samples(path: Union[str, Path]) -> Iterator[Sample]:
+    for row in json_io.iter_records(path):
+        yield Sample.from_dict(row) if isinstance(row, dict) else row
+
+
+def load_samples(path: Union[str, Path]) -> List[Sample]:
+    return list(iter_samples(path))
+
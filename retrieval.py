@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+仓库内的稠密向量检索后端（RAG4JSON --retriever_backend dense）
+
+接口与 rag_utils 保持一致：
+  retriever = DenseRetriever(samples, key="input", encoder=encoder)
+  examples, sims = retriever.retrieve(query=query, top_k=20, threshold=0.5)
+
+- 向量统一 L2 归一化，余弦相似度即内积
+- 编码经过 CachedEncoder，知识库和 query 共用 EmbeddingCache：
+  KB 与 query 为同一份数据时，query 侧全部命中缓存
+- prefetch() 可预先批量编码全部 query，避免逐条调用编码器
+- 给出每行语言时为统一的多语言索引：search_batch() 先在 query 语言分区内检索，
+  并从同一个得分矩阵里取出跨语言候选，分区内无结果时直接回退，不需要第二个索引或第二遍检索
+- quantization="int8" / "binary" 时第一遍只扫描量化码（int8 每维对称缩放 / 符号位 + Hamming 距离），
+  取 top_k × oversample 个候选后用 float32 精确重排；有 EmbeddingCache 时 float32 向量留在
+  缓存的 memmap 里按行读取，常驻内存的只有量化码（int8 为 1/4，binary 为 1/32）。
+  与 float32 结果的召回差异用 eval_retrieval.py --quantizations 评估
+"""
+
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+from embedding_cache import CachedEncoder, EmbeddingCache
+
+if TYPE_CHECKING:
+    import numpy as np
+
+DEFAULT_ENCODER = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+# 语言分区编码：zh / en 各占一个分区，其余语言（含 unknown）共用一个分区
+LANG_CODES = {"zh": 0, "en": 1}
+OTHER_LANG = 255
+
+# (样本, 相似度, 候选向量)
+Candidates = Tuple[List[Dict[str, Any]], List[float], "np.ndarray"]
+
+QUANTIZATIONS = ("none", "int8", "binary")
+# 第一遍候选数 = top_k × oversample；二值码更粗，需要更多候选
+DEFAULT_OVERSAMPLE = {"int8": 4, "binary": 10}
+# 量化得分的下界，用来区分被屏蔽的 -inf
+_FLOOR = -3.0e38
+
+
+def lang_code(lang: Optional[str]) -> int:
+    return LANG_CODES.get(lang, OTHER_LANG)
+
+
+def load_encoder(
+    model_name: str = DEFAULT_ENCODER,
+    device: Optional[str] = None,
+    *,
+    runtime: str = "torch",
+    onnx_dir: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> Any:
+    """runtime 为 torch 时是 SentenceTransformer；onnx / onnx-int8 见 encoder_runtime.py。"""
+    if runtime == "torch" and not threads:
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(model_name, device=device)
+    from encoder_runtime import load_runtime_encoder
+
+    return load_runtime_encoder(
+        runtime, model_name, onnx_dir=Path(onnx_dir) if onnx_dir else None, device=device, threads=threads,
+    )
+
+
+def encoder_key(model_name: str, runtime: str = "torch") -> str:
+    """向量缓存 / 知识库索引中记录的模型名：非 torch 运行时的向量与原模型略有差异，带上运行时后缀。"""
+    return model_name if runtime == "torch" else f"{model_name}@{runtime}"
+
+
+def build_encoder(
+    model_name: str = DEFAULT_ENCODER,
+    *,
+    cache_dir: Optional[str] = None,
+    device: Optional[str] = None,
+    batch_size: int = 64,
+    runtime: str = "torch",
+    onnx_dir: Optional[str] = None,
+    threads: Optional[int] = None,
+) -> CachedEncoder:
+    """加载编码模型；给出 cache_dir 时挂上持久化向量缓存。"""
+    cache = EmbeddingCache(cache_dir, model_name=encoder_key(model_name, runtime)) if cache_dir else None
+    encoder = load_encoder(model_name, device, runtime=runtime, onnx_dir=onnx_dir, threads=threads)
+    return CachedEncoder(encoder, cache, batch_size=batch_size)
+
+
+def detect_language(text: str) -> str:
+    """langdetect 判定语言，返回 'zh' / 'en' / 原始语言代码 / 'unknown'。"""
+    from langdetect import LangDetectException, detect
+
+    try:
+        lang = detect(text)
+    except LangDetectException:
+        return "unknown"
+    return "zh" if lang.startswith("zh") else lang
+
+
+def separate_by_language(samples: List[Dict[str, Any]], text_key: str = "input"):
+    from seprate_language import separate_by_language as _separate
+
+    return _separate(samples, text_key=text_key)
+
+
+class QuantizedVectors:
+    """
+    float32 行向量的量化码，只用于第一遍粗排。
+    int8：每维按最大绝对值对称缩放到 [-127, 127]，得分为 (q * scale) · codes；
+    binary：减去每维均值后取符号位（np.packbits），得分为 1 - 2 * Hamming / dim。
+    句向量各维通常不以 0 为中心，不减均值时大部分符号位对所有行都相同，二值码几乎失去区分度。
+    """
+
+    def __init__(
+        self,
+        kind: str,
+        codes: "np.ndarray",
+        dim: int,
+        scale: Optional["np.ndarray"] = None,
+        center: Optional["np.ndarray"] = None,
+    ):
+        if kind not in ("int8", "binary"):
+            raise ValueError(f"Unknown quantization {kind!r}; expected int8 or binary")
+        self.kind = kind
+        self.codes = codes
+        self.dim = dim
+        self.scale = scale
+        self.center = center
+
+    @classmethod
+    def build(cls, vectors: Any, kind: str, *, chunk_rows: int = 1 << 16) -> "QuantizedVectors":
+        """vectors 可以是 memmap：按块读取，不把整个 float32 矩阵读进内存。"""
+        import numpy as np
+
+        dim = int(vectors.shape[1])
+        scale = center = None
+        if kind == "int8":
+            peak = np.zeros(dim, dtype=np.float32)
+            for start in range(0, len(vectors), chunk_rows):
+                np.maximum(peak, np.abs(np.asarray(vectors[start:start + chunk_rows])).max(axis=0), out=peak)
+            scale = np.maximum(peak, 1e-12) / 127
+        elif len(vectors):
+            total = np.zeros(dim, dtype=np.float64)
+            for start in range(0, len(vectors), chunk_rows):
+                total += np.asarray(vectors[start:start + chunk_rows]).sum(axis=0, dtype=np.float64)
+            center = (total / len(vectors)).astype(np.float32)
+        empty = cls(kind, np.empty((0, 0), dtype=np.uint8), dim, scale, center)
+        codes = [empty.encode(np.asarray(vectors[start:start + chunk_rows], dtype=np.float32))
+                 for start in range(0, len(vectors), chunk_rows)]
+        empty.codes = np.concatenate(codes) if codes else empty.encode(np.empty((0, dim), dtype=np.float32))
+        return empty
+
+    def encode(self, vectors: "np.ndarray") -> "np.ndarray":
+        import numpy as np
+
+        if self.kind == "int8":
+            return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+        return np.packbits(vectors > (0 if self.center is None else self.center), axis=1)
+
+    def extended(self, vectors: "np.ndarray") -> "QuantizedVectors":
+        """追加新行，返回新对象（原对象不变，检索中的快照不受影响）；int8 沿用原缩放，越界截断。"""
+        import numpy as np
+
+        codes = np.concatenate([self.codes, self.encode(np.asarray(vectors, dtype=np.float32))])
+        return QuantizedVectors(self.kind, codes, self.dim, self.scale, self.center)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes)
+
+    def scores(self, query_vectors: "np.ndarray", *, chunk_rows: int = 1 << 14) -> "np.ndarray":
+        """(B, N) 近似得分；按行块计算，临时内存与块大小相关。"""
+        import numpy as np
+
+        out = np.empty((len(query_vectors), len(self.codes)), dtype=np.float32)
+        if self.kind == "int8":
+            q = (query_vectors * self.scale).astype(np.float32)
+            for start in range(0, len(self.codes), chunk_rows):
+                block = self.codes[start:start + chunk_rows].astype(np.float32)
+                out[:, start:start + len(block)] = q @ block.T
+            return out
+        # ±1 向量的内积 = dim - 2 * Hamming：按块解包成 ±1 后走 BLAS，比逐字节 popcount 快
+        q = np.where(np.unpackbits(self.encode(query_vectors), axis=1, count=self.dim), 1.0, -1.0).astype(np.float32)
+        q /= self.dim
+        for start in range(0, len(self.codes), chunk_rows):
+            bits = np.unpackbits(self.codes[start:start + chunk_rows], axis=1, count=self.dim)
+            block = bits.astype(np.float32)
+            block *= 2
+            block -= 1
+            out[:, start:start + len(block)] = q @ block.T
+        return out
+
+
+class _CacheRows:
+    """EmbeddingCache 中若干行的只读视图：按需从 memmap 读取，支持切片与下标数组。"""
+
+    def __init__(self, cache: EmbeddingCache, rows: "np.ndarray"):
+        self.cache = cache
+        self.rows = rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.rows), self.cache.dim or 0)
+
+    def __getitem__(self, index: Any) -> "np.ndarray":
+        import numpy as np
+
+        return np.asarray(self.cache.matrix[self.rows[index]], dtype=np.float32)
+
+
+def rerank(
+    vectors: Any, query_vector: "np.ndarray", rows: "np.ndarray", top_k: int, threshold: float
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """第一遍候选按 float32 精确得分重排，返回 (列下标, 相似度)。"""
+    import numpy as np
+
+    rows = np.sort(rows)
+    exact = np.asarray(vectors[rows], dtype=np.float32) @ query_vector
+    order = np.argsort(-exact, kind="stable")[:top_k]
+    order = order[exact[order] >= threshold]
+    return rows[order], exact[order]
+
+
+def quantized_search(
+    vectors: Any,
+    codes: QuantizedVectors,
+    query_vector: "np.ndarray",
+    mask: Optional["np.ndarray"] = None,
+    *,
+    top_k: int,
+    threshold: float,
+    oversample: Optional[int] = None,
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """单条 query：量化码取 top_k × oversample 个候选（mask 为假的行除外），再精确重排。"""
+    import numpy as np
+
+    scores = codes.scores(query_vector[None, :])
+    if mask is not None:
+        scores = np.where(mask[None, :], scores, -np.inf)
+    (first, _), = _topk_rows(scores, top_k * (oversample or DEFAULT_OVERSAMPLE[codes.kind]), _FLOOR)
+    return rerank(vectors, query_vector, first, top_k, threshold)
+
+
+def _topk_rows(scores: "np.ndarray", top_k: int, threshold: float) -> List[Tuple["np.ndarray", "np.ndarray"]]:
+    """逐行取 top_k（按相似度降序、过滤阈值与被屏蔽的 -inf），返回 [(列下标, 相似度)]。"""
+    import numpy as np
+
+    k = min(top_k, scores.shape[1])
+    if k == 0:
+        return [(np.empty(0, np.int64), np.empty(0, np.float32)) for _ in range(scores.shape[0])]
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-top, axis=1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    keep = top >= threshold
+    return [(idx[b][keep[b]], top[b][keep[b]]) for b in range(scores.shape[0])]
+
+
+def partitioned_search(
+    vectors: "np.ndarray",
+    row_langs: "np.ndarray",
+    alive: Optional["np.ndarray"],
+    query_vectors: "np.ndarray",
+    query_langs: "np.ndarray",
+    *,
+    top_k: int,
+    threshold: float,
+    cross_lingual: bool = True,
+    max_elements: int = 1 << 25,
+    codes: Optional[QuantizedVectors] = None,
+    oversample: Optional[int] = None,
+) -> List[Tuple[Tuple["np.ndarray", "np.ndarray"], Optional[Tuple["np.ndarray", "np.ndarray"]]]]:
+    """
+    一个 (B, N) 得分矩阵同时给出每条 query 的分区内结果与跨语言（其他分区）结果。
+    query 按 max_elements 切块，限制得分矩阵的内存。
+    给出 codes 时得分矩阵来自量化码，每行取 top_k × oversample 个候选，再从 vectors 读取 float32 精确重排。
+    """
+    import numpy as np
+
+    def topk(scores, mask, q):
+        scores = np.where(mask, scores, -np.inf)
+        if codes is None:
+            return _topk_rows(scores, top_k, threshold)
+        first = _topk_rows(scores, top_k * oversample, _FLOOR)
+        return [rerank(vectors, qv, rows, top_k, threshold) for qv, (rows, _) in zip(q, first)]
+
+    if codes is not None and oversample is None:
+        oversample = DEFAULT_OVERSAMPLE[codes.kind]
+    results = []
+    step = max(1, max_elements // max(1, len(vectors)))
+    for start in range(0, len(query_vectors), step):
+        q = query_vectors[start:start + step]
+        scores = q @ vectors.T if codes is None else codes.scores(q)
+        same = row_langs[None, :] == query_langs[start:start + step, None]
+        live = alive[None, :] if alive is not None else True
+        primary = topk(scores, same & live, q)
+        if cross_lingual:
+            fallback = topk(scores, ~same & live, q)
+        else:
+            fallback = [None] * len(q)
+        results.extend(zip(primary, fallback))
+    return results
+
+
+class DenseRetriever:
+    """
+    对一组样本的指定字段建立稠密向量索引，按余弦相似度检索。
+    quantization 非 none 时第一遍扫描量化码再精确重排；编码器带缓存时 float32 向量不常驻内存。
+    """
+
+    def __init__(
+        self,
+        samples: List[Dict[str, Any]],
+        key: str = "input",
+        *,
+        encoder: CachedEncoder,
+        langs: Optional[Sequence[str]] = None,
+        quantization: str = "none",
+        oversample: Optional[int] = None,
+    ):
+        import numpy as np
+
+        self._np = np
+        self.samples = samples
+        self.key = key
+        self.encoder = encoder
+        self._query_vectors: Dict[str, "np.ndarray"] = {}
+        texts = [s.get(key, "") for s in samples]
+        self.codes: Optional[QuantizedVectors] = None
+        self.oversample = oversample
+        if not texts:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+        elif quantization != "none" and encoder.cache is not None:
+            self.vectors = _CacheRows(encoder.cache, encoder.encode_rows(texts))
+        else:
+            self.vectors = encoder.encode(texts)
+        if quantization != "none" and texts:
+            self.codes = QuantizedVectors.build(self.vectors, quantization)
+        self.langs = np.array([lang_code(l) for l in langs], dtype=np.uint8) if langs is not None else \
+            np.full(len(samples), OTHER_LANG, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def prefetch(self, queries: Sequence[str]) -> None:
+        """批量编码 query 并暂存，随后的 retrieve 直接取用。"""
+        queries = [q for q in dict.fromkeys(queries) if q not in self._query_vectors]
+        if queries:
+            self._query_vectors.update(zip(queries, self.encoder.encode(queries)))
+
+    def _query_vector(self, query: str) -> "np.ndarray":
+        vec = self._query_vectors.pop(query, None)
+        return vec if vec is not None else self.encoder.encode([query])[0]
+
+    def retrieve(self, query: str, top_k: int = 5, threshold: float = 0.0, *, return_vectors: bool = False):
+        """返回 (样本, 相似度)；return_vectors=True 时额外返回候选向量 (n, dim)，供 MMR 计算候选间相似度。"""
+        if not self.samples:
+            return ([], [], self.vectors[:0]) if return_vectors else ([], [])
+        np = self._np
+        query_vector = self._query_vector(query)
+        if self.codes is not None:
+            keep, top_sims = quantized_search(
+                self.vectors, self.codes, query_vector, top_k=top_k, threshold=threshold, oversample=self.oversample,
+            )
+            examples, sims = [self.samples[i] for i in keep], top_sims.tolist()
+            return (examples, sims, self.vectors[keep]) if return_vectors else (examples, sims)
+        scores = self.vectors @ query_vector
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        keep = top[scores[top] >= threshold]
+        examples, sims = [self.samples[i] for i in keep], [float(scores[i]) for i in keep]
+        return (examples, sims, self.vectors[keep]) if return_vectors else (examples, sims)
+
+    def search_batch(
+        self,
+        queries: Sequence[str],
+        langs: Sequence[str],
+        *,
+        top_k: int = 20,
+        threshold: float = 0.0,
+        cross_lingual: bool = True,
+    ) -> List[Tuple[Candidates, Optional[Candidates]]]:
+        """批量检索：每条 query 返回 (分区内候选, 跨语言候选或 None)。"""
+        np = self._np
+        if not self.samples or not queries:
+            return [(([], [], self.vectors[:0]), None) for _ in queries]
+        hits = partitioned_search(
+            self.vectors, self.langs, None, self.encoder.encode(queries),
+            np.array([lang_code(l) for l in langs], dtype=np.uint8),
+            top_k=top_k, threshold=threshold, cross_lingual=cross_lingual,
+            codes=self.codes, oversample=self.oversample,
+        )
+
+        def gather(hit):
+            if hit is None:
+                return None
+            idx, sims = hit
+            return [self.samples[i] for i in idx], sims.tolist(), self.vectors[idx]
+
+        return [(gather(primary), gather(fallback)) for primary, fallback in hits]
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+few-shot 示例选择：在检索得到的候选上做带约束的 MMR（Maximal Marginal Relevance）
+
+一个 batch 的候选被补齐成 (B, C) 的矩阵，所有 query 的第 t 个示例在一次向量化运算里选出：
+  score = λ · sim(query, c) − (1 − λ) · max_{s∈已选} sim(c, s) + μ · 覆盖增益(c)
+- 覆盖增益：候选 output 中出现、且属于 query schema、尚未被已选示例覆盖的关系占 schema 的比例
+- 平衡约束：剩余名额刚好够补齐缺失的类别（output 为空 / 非空）时，只在缺失类别中选
+- 候选间相似度来自检索向量；rag_utils 后端拿不到向量时，用字符 n-gram 哈希向量代替
+
+greedy_select 保留原来“一个非空 + 一个空”的顺序挑选逻辑。
+"""
+
+import zlib
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def is_empty_output(sample: Dict[str, Any]) -> bool:
+    output = sample.get("output", [])
+    return isinstance(output, list) and len(output) == 0
+
+
+def output_relations(sample: Dict[str, Any]) -> Set[str]:
+    output = sample.get("output")
+    if not isinstance(output, list):
+        return set()
+    return {t.get("relationship") for t in output if isinstance(t, dict) and t.get("relationship")}
+
+
+def hashed_ngram_vectors(texts: Sequence[str], dim: int = 1024, n: int = 2) -> "np.ndarray":
+    """字符 n-gram 计数的哈希向量（L2 归一化），作为没有检索向量时的冗余度度量。"""
+    import numpy as np
+
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        text = text or ""
+        grams = [text[j:j + n] for j in range(max(1, len(text) - n + 1))]
+        for g in grams:
+            vectors[i, zlib.crc32(g.encode("utf-8")) % dim] += 1.0
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def greedy_select(examples: Sequence[Dict[str, Any]], sims: Sequence[float]) -> Tuple[List[int], bool, bool]:
+    """按相似度顺序选 1 个 output 非空 + 1 个 output 为空，返回 (下标, has_empty, has_nonempty)。"""
+    picked: List[int] = []
+    has_empty = has_nonempty = False
+    for i, ex in enumerate(examples):
+        if not has_nonempty and ex.get("output", []):
+            picked.append(i)
+            has_nonempty = True
+        elif not has_empty and is_empty_output(ex):
+            picked.append(i)
+            has_empty = True
+        if has_nonempty and has_empty:
+            break
+    return picked, has_empty, has_nonempty
+
+
+def mmr_select(
+    query_sims: "np.ndarray",
+    cand_sims: "np.ndarray",
+    valid: "np.ndarray",
+    is_empty: "np.ndarray",
+    covers: "np.ndarray",
+    schema_size: "np.ndarray",
+    *,
+    k: int = 2,
+    lam: float = 0.7,
+    coverage_weight: float = 0.3,
+    balance: bool = True,
+) -> "np.ndarray":
+    """
+    批量 MMR 选择。
+
+    Args:
+        query_sims: (B, C) query 与候选的相似度
+        cand_sims: (B, C, C) 候选两两相似度
+        valid: (B, C) 有效候选（补齐位置为 False）
+        is_empty: (B, C) 候选 output 是否为空
+        covers: (B, C, R) 候选是否覆盖 query schema 中的第 r 个关系
+        schema_size: (B,) query schema 的关系数
+
+    Returns:
+        (B, k) 选中候选的下标，不足 k 个时以 -1 补齐
+    """
+    import numpy as np
+
+    B, C = query_sims.shape
+    rows = np.arange(B)
+    selected = np.full((B, k), -1, dtype=np.int64)
+    if C == 0:
+        return selected
+
+    available = valid.copy()
+    redundancy = np.zeros((B, C), dtype=np.float32)
+    covered = np.zeros((B, covers.shape[2]), dtype=bool)
+    has_empty = np.zeros(B, dtype=bool)
+    has_nonempty = np.zeros(B, dtype=bool)
+    any_empty = (valid & is_empty).any(axis=1)
+    any_nonempty = (valid & ~is_empty).any(axis=1)
+    denom = np.maximum(schema_size, 1)[:, None].astype(np.float32)
+
+    for t in range(k):
+        gain = (covers & ~covered[:, None, :]).sum(axis=-1) / denom
+        score = lam * query_sims - (1 - lam) * redundancy + coverage_weight * gain
+
+        mask = available
+        if balance:
+            need_empty = ~has_empty & any_empty
+            need_nonempty = ~has_nonempty & any_nonempty
+            must = need_empty.astype(int) + need_nonempty >= k - t
+            needed = (need_empty[:, None] & is_empty) | (need_nonempty[:, None] & ~is_empty)
+            restricted = available & np.where(must[:, None], needed, True)
+            # 缺失类别已无可用候选时退回不受限
+            mask = np.where(restricted.any(axis=1)[:, None], restricted, available)
+
+        score = np.where(mask, score, -np.inf)
+        pick = score.argmax(axis=1)
+        ok = np.isfinite(score[rows, pick])
+        if not ok.any():
+            break
+        r, p = rows[ok], pick[ok]
+        selected[r, t] = p
+        available[r, p] = False
+        redundancy[r] = np.maximum(redundancy[r], cand_sims[r, p])
+        covered[r] |= covers[r, p]
+        has_empty[r] |= is_empty[r, p]
+        has_nonempty[r] |= ~is_empty[r, p]
+    return selected
+
+
+def select_batch(
+    batch: Sequence[Tuple[Dict[str, Any], List[Dict[str, Any]], List[float], Optional["np.ndarray"]]],
+    *,
+    text_key: str,
+    k: int = 2,
+    lam: float = 0.7,
+    coverage_weight: float = 0.3,
+) -> List[List[int]]:
+    """
+    对一批 (query 样本, 候选样本, 相似度, 候选向量或 None) 做 MMR，返回每条 query 选中的候选下标。
+    """
+    import numpy as np
+
+    B = len(batch)
+    C = max((len(c) for _, c, _, _ in batch), default=0)
+    if B == 0 or C == 0:
+        return [[] for _ in batch]
+    R = max((len(q.get("schema") or []) for q, _, _, _ in batch), default=0)
+
+    query_sims = np.zeros((B, C), dtype=np.float32)
+    valid = np.zeros((B, C), dtype=bool)
+    is_empty = np.zeros((B, C), dtype=bool)
+    covers = np.zeros((B, C, R), dtype=bool)
+    schema_size = np.zeros(B, dtype=np.int64)
+    vectors: List["np.ndarray"] = []
+
+    for b, (query, examples, sims, vecs) in enumerate(batch):
+        n = len(examples)
+        query_sims[b, :n] = sims
+        valid[b, :n] = True
+        schema = list(dict.fromkeys(query.get("schema") or []))
+        schema_size[b] = len(schema)
+        for c, ex in enumerate(examples):
+            is_empty[b, c] = is_empty_output(ex)
+            rels = output_relations(ex)
+            for r, rel in enumerate(schema):
+                covers[b, c, r] = rel in rels
+        if vecs is None or len(vecs) != n:
+            vecs = hashed_ngram_vectors([ex.get(text_key, "") for ex in examples])
+        vectors.append(vecs)
+
+    dim = max(v.shape[1] for v in vectors if v.size) if any(v.size for v in vectors) else 1
+    padded = np.zeros((B, C, dim), dtype=np.float32)
+    for b, v in enumerate(vectors):
+        if v.size:
+            padded[b, :len(v), :v.shape[1]] = v
+    cand_sims = np.einsum("bcd,bed->bce", padded, padded)
+
+    selected = mmr_select(
+        query_sims, cand_sims, valid, is_empty, covers, schema_size,
+        k=k, lam=lam, coverage_weight=coverage_weight,
+    )
+    return [[int(i) for i in row if i >= 0] for row in selected]
@@ -5,29 +5,23 @@
 """
 
 import argparse
-import json
 from pathlib import Path
-from tqdm import tqdm
-from langdetect import detect, LangDetectException
+
+import json_io
+from metrics import get_metrics
 
 
 def load_json_or_jsonl(path: str):
     """加载JSON或JSONL文件"""
     p = Path(path)
     if p.suffix.lower() == ".jsonl":
-        with p.open("r", encoding="utf-8") as f:
-            return [json.loads(line) for line in f if line.strip()]
-    else:
-        with p.open("r", encoding="utf-8") as f:
-            return json.load(f)
+        return list(json_io.iter_jsonl(p))
+    return json_io.load_json(p)
 
 
 def write_jsonl(path: str, rows):
     """写入JSONL文件"""
-    with open(path, "w", encoding="utf-8") as f:
-        for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False))
-            f.write("\n")
+    json_io.write_jsonl(path, rows)
 
 
 def separate_by_language(data, text_key="sentence"):
@@ -41,6 +35,10 @@ def separate_by_language(data, text_key="sentence"):
     Returns:
         tuple: 包含三个列表的元组 (chinese_data, english_data, other_data)
     """
+    # langdetect 加载语言模型较慢，只在真正检测时导入
+    from tqdm import tqdm
+    from langdetect import detect, LangDetectException
+
     chinese_samples = []
     english_samples = []
     other_samples = []
@@ -75,7 +73,7 @@ def separate_by_language(data, text_key="sentence"):
     return chinese_samples, english_samples, other_samples
 
 
-def main():
+def main(argv=None):
     # 设置默认路径
     default_input_path = "/home/users/lhy/LLM4RE_2Round/data/dev2.json"
     default_output_dir = "/home/users/lhy/LLM4RE_2Round/data" # 默认输出目录
@@ -85,7 +83,7 @@ def main():
     parser.add_argument("--output_dir", type=str, default=default_output_dir, help=f"输出目录路径, 默认: {default_output_dir}")
     parser.add_argument("--text_key", type=str, default="sentence", help="包含待检测文本的字段名，默认为 'sentence'")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     input_path = Path(args.input_path)
     output_dir = Path(args.output_dir)
@@ -98,17 +96,21 @@ def main():
     print(f"📂 加载数据: {input_path}")
     try:
         data = load_json_or_jsonl(str(input_path))
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         print(f"错误: 输入文件不是有效的 JSON 格式: {e}")
         return
     except Exception as e:
         print(f"错误: 读取输入文件时出现问题: {e}")
         return
 
+    metrics = get_metrics("seprate_language")
     print(f"🔍 开始按语言分离数据 (文本字段: '{args.text_key}')...")
-    chinese_data, english_data, other_data = separate_by_language(
-        data, text_key=args.text_key
-    )
+    with metrics.stage("separate") as st:
+        chinese_data, english_data, other_data = separate_by_language(
+            data, text_key=args.text_key
+        )
+        st.rows = len(data)
+    metrics.update({"zh": len(chinese_data), "en": len(english_data), "other": len(other_data)}, prefix="language.")
 
     # 创建输出目录
     output_dir.mkdir(parents=True, exist_ok=True)
@@ -137,6 +139,7 @@ def main():
     print(f"  英文样本数: {len(english_data)}")
     print(f"  其他/无法识别样本数: {len(other_data)}")
     print(f"✅ 数据分离完成！")
+    metrics.finish()
 
 
 if __name__ == "__main__":
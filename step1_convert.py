@@ -1,23 +1,8 @@
-import json
-import re
+from step_convert import StepVariant, format_step_item, run_cli
 
 RAW_DATA_PATH = "/root/autodl-tmp/LLM4RE_2Round/data/test2.json"
 OUTPUT_PATH = "/root/autodl-tmp/LLM4RE_2Round/data/step1_test2.json"
 
-class LanguageDetector:
-    def detect_language(self, sentence: str, threshold: float = 0.5) -> str:
-        text = sentence or ""
-        text = re.sub(r'[\d\W_]+', '', text)
-        if not text:
-            return "unknown"
-        chinese_chars = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
-        latin_chars = sum(1 for ch in text if ch.isascii() and ch.isalpha())
-        total = chinese_chars + latin_chars
-        if total == 0:
-            return "unknown"
-        ratio = chinese_chars / total
-        return "zh" if ratio >= threshold else "en"
-
 # 中文 Prompt（使用中文术语，输出 yes/no）
 SYSTEM_PROMPT_ZH = (
     "你是一个信息抽取任务的前置过滤器。请判断句子中是否存在潜在的、可抽取的关系三元组。"
@@ -79,71 +64,28 @@ SYSTEM_PROMPT_EN = (
 
 
 
-def convert_raw_to_filter(raw_data):
-    detector = LanguageDetector()
-    result = []
-    for item in raw_data:
-        sentence = item["sentence"]
-        lang = detector.detect_language(sentence, threshold=0.5)
-
-        # 选择 system prompt
-        system_prompt = SYSTEM_PROMPT_EN if lang != "zh" else SYSTEM_PROMPT_ZH
-
-        # 选择 input 的语言引导词
-        if lang == "zh":
-            prefix_sentence = "句子"
-            prefix_relations = "关系候选"
-            prefix_coarse = "实体粗类型候选"
-        else:
-            prefix_sentence = "Sentence"
-            prefix_relations = "Relation candidates"
-            prefix_coarse = "Entity coarse type candidates"
-
-        # 构造 input（保持 schema 和 coarse_types 原样）
-        relations = "、".join(item["schema"])
-        coarse_types = "、".join(item["coarse_types"])
-
-        input_text = (
-            f"{prefix_sentence}：{sentence}\n"
-            f"{prefix_relations}：{relations}\n"
-            f"{prefix_coarse}：{coarse_types}"
-        )
-
-        # 输出标签统一为英文小写
-        # 若 output 不存在，则设为空列表
-        output_field = item.get("output", [])
-
-        # 若为空则直接设为 []，否则转为小写
-        if not output_field:
-            label = []
-        else:
-            # 若原 output 不是列表（例如 "yes"/"no"），则标准化为小写字符串
-            if isinstance(output_field, str):
-                label = output_field.lower()
-            else:
-                label = output_field  # 保留原结构（一般是关系三元组列表）
-
-        result.append({
-            "system": system_prompt,
-            "instruction": "",
-            "input": input_text,
-            "output": label,
-            "history": [] 
-        })
-    return result
+def step1_label(item):
+    # 输出标签统一为英文小写
+    # 若 output 不存在，则设为空列表
+    output_field = item.get("output", [])
+
+    # 若为空则直接设为 []，否则转为小写
+    if not output_field:
+        return []
+    # 若原 output 不是列表（例如 "yes"/"no"），则标准化为小写字符串
+    if isinstance(output_field, str):
+        return output_field.lower()
+    return output_field  # 保留原结构（一般是关系三元组列表）
 
-if __name__ == "__main__":
-    with open(RAW_DATA_PATH, "r", encoding="utf-8") as f:
-        raw_data = json.load(f)
 
-    filter_data = convert_raw_to_filter(raw_data)
+VARIANT = StepVariant("step1", SYSTEM_PROMPT_ZH, SYSTEM_PROMPT_EN, step1_label)
 
-    with open(OUTPUT_PATH, "w", encoding="utf-8") as f:
-        json.dump(filter_data, f, ensure_ascii=False, indent=2)
 
-    num_yes = sum(1 for x in filter_data if x["output"] == "yes")
-    print(f"✅ 转换完成！")
-    print(f"   总样本: {len(filter_data)}")
-    print(f"   正样本（yes）: {num_yes}")
-    print(f"   负样本（no）: {len(filter_data) - num_yes}")
-    print(f"   输出文件: {OUTPUT_PATH}")
\ No newline at end of file
+def convert_raw_to_filter(raw_data):
+    return [format_step_item(item, VARIANT) for item in raw_data]
+
+def main(argv=None):
+    run_cli(VARIANT, default_input=RAW_DATA_PATH, default_output=OUTPUT_PATH, argv=argv)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,656 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Step-1 CPU 前置门控：用轻量分类器代替大部分 LLM yes/no 调用
+
+- 特征：字符 1~3-gram、英文词 uni/bi-gram（均为哈希特征）、关系候选、实体粗类型、语言、长度分桶；
+  给出 --gazetteer（gazetteer.py）时再加上词典实体提及数与是否出现已知实体对
+- 字符 / 词 n-gram 的哈希在 numpy 中整批计算（整批句子拼成一个码点数组），不逐条循环
+- 模型：哈希特征上的逻辑回归（Adagrad），只依赖 numpy
+- 标签可来自 gold output 是否为空，也可蒸馏已有的 LLM 判定（如 data/dev_predict_yes_list.json），
+  --label_source mix 时取两者的加权软标签
+- 置信带 [low, high)：p >= high 直接判 yes，p < low 直接判 no，其余才交给 LLM；
+  训练后在 dev 上按“漏掉的正样本比例 ≤ max_miss”和“自动 yes 的精确率 ≥ min_precision”标定。
+  apply --pair_rule 时，置信带内出现 schema 内已知实体对的样本也直接判 yes
+
+用法:
+  python step1_gate.py train --train_data data/dev2.json --llm_labels data/dev_predict_yes_list.json \
+      --model_path models/step1_gate.npz
+  python step1_gate.py apply --model_path models/step1_gate.npz --input_path data/test2.json \
+      --decisions_path data/test2_gate.json --escalate_path data/test2_escalate.json
+  # 只对 escalate 部分跑 step1_convert.py → LLM_infer.bash → extract_step1.py，再合并：
+  python step1_gate.py merge --decisions_path data/test2_gate.json \
+      --llm_labels data/test2_escalate_yes_list.json --output_path data/predict_yes_list.json
+"""
+
+import argparse
+import math
+from contextlib import nullcontext
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+import json_io
+from metrics import get_metrics
+
+if TYPE_CHECKING:
+    import numpy as np
+
+    from gazetteer import Gazetteer
+
+# 各特征组的哈希盐，保证不同组的同一字符串落在不同位置
+_SALT_CHAR = 0x3C6EF372FE94F82B
+_SALT_WORD = 0xA54FF53A5F1D36F1
+_SALT_BIGRAM = 0x510E527FADE682D1
+_SALT_META = 0x9B05688C2B3E6C1F
+_FNV_PRIME = 0x100000001B3
+_WORD_BASE = 1000003  # 奇数，mod 2^64 可逆
+
+
+def _fmix(h: "np.ndarray") -> "np.ndarray":
+    """murmur3 fmix64，把 uint64 哈希打散到低位。"""
+    import numpy as np
+
+    h = h ^ (h >> np.uint64(33))
+    h = h * np.uint64(0xFF51AFD7ED558CCD)
+    h = h ^ (h >> np.uint64(33))
+    h = h * np.uint64(0xC4CEB9FE1A85EC53)
+    return h ^ (h >> np.uint64(33))
+
+
+def _token_hash(token: str) -> int:
+    import zlib
+
+    return zlib.crc32(token.encode("utf-8")) | (len(token) << 32)
+
+
+class SparseRows:
+    """按行排序的稀疏特征矩阵：(cols, vals) 与行指针 indptr。"""
+
+    def __init__(self, rows: "np.ndarray", cols: "np.ndarray", vals: "np.ndarray", n_rows: int, *, presorted: bool = False):
+        import numpy as np
+
+        if not presorted:
+            order = np.argsort(rows, kind="stable")
+            rows, cols, vals = rows[order], cols[order], vals[order]
+        self.rows, self.cols, self.vals = rows, cols, vals
+        self.n_rows = n_rows
+        self.indptr = np.searchsorted(self.rows, np.arange(n_rows + 1))
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def slice(self, start: int, stop: int) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """行区间 [start, stop) 的 (局部行号, 列, 值)。"""
+        a, b = self.indptr[start], self.indptr[stop]
+        return self.rows[a:b] - start, self.cols[a:b], self.vals[a:b]
+
+    def permuted(self, perm: "np.ndarray") -> "SparseRows":
+        """按 perm 重排行：新第 i 行为原第 perm[i] 行。"""
+        import numpy as np
+
+        inverse = np.empty(len(perm), dtype=np.int32)
+        inverse[perm] = np.arange(len(perm), dtype=np.int32)
+        return SparseRows(inverse[self.rows], self.cols, self.vals, self.n_rows)
+
+
+def featurize(
+    samples: Sequence[Dict[str, Any]],
+    *,
+    dim: int = 1 << 20,
+    char_ngrams: Sequence[int] = (1, 2, 3),
+    word_bigrams: bool = True,
+    gazetteer: Optional["Gazetteer"] = None,
+    chunk_size: int = 8192,
+) -> SparseRows:
+    """按 chunk_size 条一块计算哈希特征（限制中间数组的内存），拼成一个按行排序的稀疏矩阵。"""
+    import numpy as np
+
+    rows, cols, vals = [], [], []
+    for start in range(0, len(samples), chunk_size):
+        r, c, v = _featurize_chunk(samples[start:start + chunk_size], dim, char_ngrams, word_bigrams, gazetteer)
+        order = np.argsort(r, kind="stable")
+        rows.append((r[order] + start).astype(np.int32))
+        cols.append(c[order])
+        vals.append(v[order])
+    if not rows:
+        empty = np.empty(0, dtype=np.int32)
+        return SparseRows(empty, empty, np.empty(0, dtype=np.float32), len(samples), presorted=True)
+    return SparseRows(np.concatenate(rows), np.concatenate(cols), np.concatenate(vals), len(samples), presorted=True)
+
+
+def _featurize_chunk(
+    samples: Sequence[Dict[str, Any]],
+    dim: int,
+    char_ngrams: Sequence[int],
+    word_bigrams: bool,
+    gazetteer: Optional["Gazetteer"] = None,
+) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    整块计算哈希特征。所有句子以 \\0 连接成一个 UTF-32 码点数组，
+    n-gram 哈希与所属行号都由数组运算得到，跨句的窗口按分隔符个数剔除。
+    """
+    import numpy as np
+
+    mask = np.uint64(dim - 1)
+    n = len(samples)
+    text = "\0".join((s.get("sentence") or "") for s in samples).lower()
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    size = len(codes)
+    is_sep = codes == 0
+    # seps[i] = 位置 i 之前的分隔符个数 = 位置 i 所在的行号
+    seps = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(is_sep, out=seps[1:])
+
+    row_parts: List["np.ndarray"] = []
+    col_parts: List["np.ndarray"] = []
+
+    # 字符 n-gram
+    for k in char_ngrams:
+        m = size - k + 1
+        if m <= 0:
+            continue
+        h = np.full(m, _SALT_CHAR + k, dtype=np.uint64)
+        for j in range(k):
+            h = (h ^ codes[j:j + m]) * np.uint64(_FNV_PRIME)
+        valid = seps[k:k + m] == seps[:m]
+        valid &= ~is_sep[:m]
+        row_parts.append(seps[:m][valid])
+        col_parts.append(_fmix(h[valid]) & mask)
+
+    # 英文词（ASCII 字母数字串）：前缀多项式哈希，词哈希 = (S[e] - S[s]) * B^-s
+    is_word = ((codes >= 97) & (codes <= 122)) | ((codes >= 48) & (codes <= 57))
+    edges = np.diff(np.concatenate(([False], is_word, [False])).astype(np.int8))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    if len(starts):
+        base = np.full(size, _WORD_BASE, dtype=np.uint64)
+        base[0] = 1
+        powers = np.cumprod(base)
+        inv = np.full(size, pow(_WORD_BASE, -1, 1 << 64), dtype=np.uint64)
+        inv[0] = 1
+        inv_powers = np.cumprod(inv)
+        prefix = np.zeros(size + 1, dtype=np.uint64)
+        np.cumsum(codes * powers, out=prefix[1:])
+        words = (prefix[ends] - prefix[starts]) * inv_powers[starts]
+        word_rows = seps[starts]
+        row_parts.append(word_rows)
+        col_parts.append(_fmix(words + np.uint64(_SALT_WORD)) & mask)
+        if word_bigrams and len(words) > 1:
+            same = word_rows[1:] == word_rows[:-1]
+            pair = words[:-1][same] * np.uint64(_FNV_PRIME) ^ words[1:][same]
+            row_parts.append(word_rows[1:][same])
+            col_parts.append(_fmix(pair + np.uint64(_SALT_BIGRAM)) & mask)
+
+    # 语言（CJK 字符占比）与长度分桶
+    is_cjk = (codes >= 0x4E00) & (codes <= 0x9FFF)
+    row_of = seps[:size]
+    lengths = np.bincount(row_of, weights=~is_sep, minlength=n)[:n]
+    cjk = np.bincount(row_of, weights=is_cjk, minlength=n)[:n]
+    latin = np.bincount(row_of, weights=is_word & (codes >= 97), minlength=n)[:n]
+    zh = cjk >= np.maximum(cjk + latin, 1) * 0.5
+    all_rows = np.arange(n, dtype=np.int64)
+    meta = np.where(zh, _token_hash("lang:zh"), _token_hash("lang:en")).astype(np.uint64)
+    buckets = np.floor(np.log2(lengths + 1)).astype(np.uint64)
+    row_parts.extend([all_rows, all_rows])
+    col_parts.append(_fmix(meta + np.uint64(_SALT_META)) & mask)
+    col_parts.append(_fmix(buckets * np.uint64(_FNV_PRIME) + np.uint64(_SALT_META)) & mask)
+
+    # 关系候选 / 实体粗类型 / 候选个数 / 词典信号：取值有限，逐条查字典
+    cache: Dict[str, int] = {}
+    meta_rows: List[int] = []
+    meta_hashes: List[int] = []
+    for i, sample in enumerate(samples):
+        schema = sample.get("schema") or []
+        coarse = sample.get("coarse_types") or []
+        tokens = [f"rel:{r}" for r in schema] + [f"type:{t}" for t in coarse]
+        tokens.append(f"nrel:{min(len(schema), 16)}")
+        if gazetteer is not None:
+            hit = gazetteer.scan(sample.get("sentence") or "", schema)
+            tokens.append(f"gaz:mentions={min(hit['mentions'], 3)}")
+            tokens.append(f"gaz:pair={bool(hit['pairs'])}")
+        for token in tokens:
+            h = cache.get(token)
+            if h is None:
+                h = cache[token] = _token_hash(token)
+            meta_rows.append(i)
+            meta_hashes.append(h)
+    row_parts.append(np.array(meta_rows, dtype=np.int64))
+    col_parts.append(_fmix(np.array(meta_hashes, dtype=np.uint64) + np.uint64(_SALT_META)) & mask)
+
+    rows = np.concatenate(row_parts)
+    cols = np.concatenate(col_parts).astype(np.int32)
+    # 每行按 1/sqrt(nnz) 归一化，长短句的 logit 量级一致
+    counts = np.bincount(rows, minlength=n)
+    vals = (1.0 / np.sqrt(np.maximum(counts, 1))).astype(np.float32)[rows]
+    return rows, cols, vals
+
+
+# ----------------------------
+# 标签
+# ----------------------------
+
+def gold_label(sample: Dict[str, Any]) -> Optional[float]:
+    """gold output 非空 → 1，为空 → 0；已转换数据中的 "yes"/"no" 同样可用。"""
+    output = sample.get("output")
+    if isinstance(output, list):
+        return 1.0 if output else 0.0
+    if isinstance(output, str):
+        return llm_label(output)
+    return None
+
+
+def llm_label(value: Any) -> Optional[float]:
+    if not isinstance(value, str):
+        return None
+    value = value.strip().lower()
+    if value.startswith("yes"):
+        return 1.0
+    if value.startswith("no"):
+        return 0.0
+    return None
+
+
+def combine_labels(gold: Optional[float], llm: Optional[float], label_source: str, llm_weight: float) -> Optional[float]:
+    if label_source == "gold":
+        return gold
+    if label_source == "llm":
+        return llm
+    if gold is None:
+        return llm
+    if llm is None:
+        return gold
+    return (1 - llm_weight) * gold + llm_weight * llm
+
+
+def load_labeled(
+    data_paths: Sequence[Path],
+    llm_label_paths: Sequence[Path],
+    *,
+    label_source: str = "mix",
+    llm_weight: float = 0.5,
+) -> Tuple[List[Dict[str, Any]], List[float], List[Optional[float]]]:
+    """
+    加载样本及 (训练目标, 标定用二值标签)。llm_label_paths 按顺序与 data_paths 一一对应，
+    每个文件是与样本按行对齐的 "yes"/"no" 列表（extract_step1.py 的输出）。
+    标定标签优先用 gold，没有 gold 时用 LLM 判定。
+    """
+    if llm_label_paths and len(llm_label_paths) != len(data_paths):
+        raise ValueError("--llm_labels must match the data files one to one")
+    samples: List[Dict[str, Any]] = []
+    targets: List[float] = []
+    truth: List[Optional[float]] = []
+    for i, path in enumerate(data_paths):
+        data = json_io.load_json_or_jsonl(path)
+        llm = json_io.load_json(llm_label_paths[i]) if llm_label_paths else [None] * len(data)
+        if len(llm) != len(data):
+            raise ValueError(f"{llm_label_paths[i]} has {len(llm)} labels but {path} has {len(data)} samples")
+        for sample, value in zip(data, llm):
+            gold, teacher = gold_label(sample), llm_label(value)
+            target = combine_labels(gold, teacher, label_source, llm_weight)
+            if target is None:
+                continue
+            samples.append(sample)
+            targets.append(target)
+            truth.append(gold if gold is not None else teacher)
+    return samples, targets, truth
+
+
+# ----------------------------
+# 模型
+# ----------------------------
+
+class Step1Gate:
+    """哈希特征上的逻辑回归 + 置信带。"""
+
+    def __init__(
+        self,
+        dim: int = 1 << 20,
+        *,
+        char_ngrams: Sequence[int] = (1, 2, 3),
+        word_bigrams: bool = True,
+        low: float = 0.5,
+        high: float = 0.5,
+        gazetteer_path: Optional[Path] = None,
+    ):
+        import numpy as np
+
+        if dim & (dim - 1):
+            raise ValueError(f"dim must be a power of two, got {dim}")
+        self._np = np
+        self.dim = dim
+        self.char_ngrams = tuple(char_ngrams)
+        self.word_bigrams = word_bigrams
+        self.low = low
+        self.high = high
+        self.gazetteer_path = gazetteer_path
+        self.gazetteer: Optional["Gazetteer"] = None
+        if gazetteer_path is not None:
+            from gazetteer import Gazetteer
+
+            self.gazetteer = Gazetteer.load(gazetteer_path)
+        self.weights = np.zeros(dim, dtype=np.float32)
+        self.bias = 0.0
+
+    def featurize(self, samples: Sequence[Dict[str, Any]]) -> SparseRows:
+        return featurize(
+            samples, dim=self.dim, char_ngrams=self.char_ngrams, word_bigrams=self.word_bigrams, gazetteer=self.gazetteer
+        )
+
+    def _logits(self, rows: "np.ndarray", cols: "np.ndarray", vals: "np.ndarray", n: int) -> "np.ndarray":
+        return self._np.bincount(rows, weights=self.weights[cols] * vals, minlength=n) + self.bias
+
+    def predict_proba(self, samples_or_features) -> "np.ndarray":
+        np = self._np
+        feats = samples_or_features if isinstance(samples_or_features, SparseRows) else self.featurize(samples_or_features)
+        logits = self._logits(feats.rows, feats.cols, feats.vals, feats.n_rows)
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -30, 30)))
+
+    def fit(
+        self,
+        feats: SparseRows,
+        targets: Sequence[float],
+        *,
+        sample_weight: Optional["np.ndarray"] = None,
+        epochs: int = 5,
+        lr: float = 0.1,
+        l2: float = 1e-6,
+        batch_size: int = 1024,
+        seed: int = 0,
+    ) -> List[float]:
+        """小批量 Adagrad；目标可为软标签。返回每轮的平均 log loss。"""
+        np = self._np
+        n = feats.n_rows
+        rng = np.random.default_rng(seed)
+        perm = rng.permutation(n)
+        feats = feats.permuted(perm)
+        y = np.asarray(targets, dtype=np.float64)[perm]
+        w = np.ones(n) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)[perm]
+        accum = np.full(self.dim, 1e-8, dtype=np.float32)
+        bias_accum = 1e-8
+        history = []
+        starts = np.arange(0, n, batch_size)
+        for _ in range(epochs):
+            total = 0.0
+            for start in rng.permutation(starts):
+                stop = min(start + batch_size, n)
+                rows, cols, vals = feats.slice(start, stop)
+                logits = self._logits(rows, cols, vals, stop - start)
+                p = 1.0 / (1.0 + np.exp(-np.clip(logits, -30, 30)))
+                yb, wb = y[start:stop], w[start:stop]
+                total += float(-(wb * (yb * np.log(p + 1e-12) + (1 - yb) * np.log(1 - p + 1e-12))).sum())
+                g = (p - yb) * wb / len(yb)
+                # 只更新本批出现过的列（lazy L2）
+                uniq, inverse = np.unique(cols, return_inverse=True)
+                grad = np.bincount(inverse, weights=g[rows] * vals, minlength=len(uniq))
+                grad += l2 * self.weights[uniq]
+                accum[uniq] += (grad * grad).astype(np.float32)
+                self.weights[uniq] -= (lr * grad / np.sqrt(accum[uniq])).astype(np.float32)
+                gb = float(g.sum())
+                bias_accum += gb * gb
+                self.bias -= lr * gb / math.sqrt(bias_accum)
+            history.append(total / max(float(w.sum()), 1e-12))
+        return history
+
+    # ----------------------------
+    # 置信带
+    # ----------------------------
+
+    def decide(self, probs: "np.ndarray") -> "np.ndarray":
+        """1 = yes，0 = no，-1 = 交给 LLM。"""
+        np = self._np
+        return np.where(probs >= self.high, 1, np.where(probs < self.low, 0, -1)).astype(np.int8)
+
+    def calibrate(
+        self,
+        probs: "np.ndarray",
+        labels: "np.ndarray",
+        *,
+        max_miss: float = 0.02,
+        min_precision: float = 0.9,
+    ) -> Tuple[float, float]:
+        """
+        low：自动判 no 的正样本不超过 max_miss（占全部正样本）的最大阈值；
+        high：自动判 yes 的精确率不低于 min_precision 的最小阈值。
+        """
+        np = self._np
+        labels = np.asarray(labels) >= 0.5
+        pos = np.sort(probs[labels])
+        allowed = int(math.floor(max_miss * len(pos)))
+        low = float(pos[allowed]) if allowed < len(pos) else 1.0
+
+        order = np.argsort(-probs, kind="stable")
+        precision = np.cumsum(labels[order]) / np.arange(1, len(order) + 1)
+        ok = np.flatnonzero(precision >= min_precision)
+        high = float(probs[order][ok[-1]]) if len(ok) else math.inf
+        self.low, self.high = low, max(high, low)
+        return self.low, self.high
+
+    # ----------------------------
+    # 保存 / 加载
+    # ----------------------------
+
+    def save(self, path: Path) -> None:
+        np = self._np
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "dim": self.dim,
+            "char_ngrams": list(self.char_ngrams),
+            "word_bigrams": self.word_bigrams,
+            "low": self.low,
+            "high": self.high if math.isfinite(self.high) else None,
+            "bias": self.bias,
+            "gazetteer": str(self.gazetteer_path) if self.gazetteer_path else None,
+        }
+        with path.open("wb") as fp:
+            np.savez_compressed(fp, weights=self.weights, meta=np.frombuffer(json_io.dumps_bytes(meta), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path: Path, *, gazetteer_path: Optional[Path] = None) -> "Step1Gate":
+        """gazetteer_path 可覆盖训练时记录的词典路径（特征需与训练时的词典一致）。"""
+        import numpy as np
+
+        with np.load(path) as data:
+            meta = json_io.loads(data["meta"].tobytes())
+            gate = cls(
+                meta["dim"],
+                char_ngrams=meta["char_ngrams"],
+                word_bigrams=meta["word_bigrams"],
+                low=meta["low"],
+                high=math.inf if meta["high"] is None else meta["high"],
+                gazetteer_path=gazetteer_path or meta.get("gazetteer"),
+            )
+            gate.weights = data["weights"].astype(np.float32)
+        gate.bias = meta["bias"]
+        return gate
+
+
+def band_report(gate: Step1Gate, probs: "np.ndarray", labels: Sequence[float]) -> Dict[str, float]:
+    """置信带在带标签数据上的覆盖率、自动判定的准确率与漏判率。"""
+    import numpy as np
+
+    labels = np.asarray(labels) >= 0.5
+    decisions = gate.decide(probs)
+    auto = decisions >= 0
+    n, n_pos = len(labels), int(labels.sum())
+    auto_yes, auto_no = decisions == 1, decisions == 0
+    return {
+        "n": n,
+        "coverage": float(auto.mean()) if n else 0.0,
+        "escalated": int((~auto).sum()),
+        "auto_accuracy": float((decisions[auto] == labels[auto]).mean()) if auto.any() else 0.0,
+        "auto_yes_precision": float(labels[auto_yes].mean()) if auto_yes.any() else 0.0,
+        "miss_rate": float((auto_no & labels).sum() / n_pos) if n_pos else 0.0,
+        "accuracy@0.5": float(((probs >= 0.5) == labels).mean()) if n else 0.0,
+    }
+
+
+# ----------------------------
+# 子命令
+# ----------------------------
+
+def cmd_train(args: argparse.Namespace) -> None:
+    import numpy as np
+
+    metrics = get_metrics("step1_gate.train")
+    with metrics.stage("load") as st:
+        samples, targets, truth = load_labeled(
+            args.train_data, args.llm_labels or [], label_source=args.label_source, llm_weight=args.llm_weight
+        )
+        if args.dev_data:
+            dev_samples, _, dev_truth = load_labeled(
+                args.dev_data, args.dev_llm_labels or [], label_source=args.label_source, llm_weight=args.llm_weight
+            )
+        else:
+            # 没有 dev 时从训练集留出一部分做标定
+            perm = np.random.default_rng(args.seed).permutation(len(samples))
+            cut = int(len(samples) * (1 - args.holdout))
+            dev_idx, train_idx = perm[cut:], perm[:cut]
+            dev_samples, dev_truth = [samples[i] for i in dev_idx], [truth[i] for i in dev_idx]
+            samples, targets = [samples[i] for i in train_idx], [targets[i] for i in train_idx]
+        st.rows = len(samples) + len(dev_samples)
+    if not samples or not dev_samples:
+        raise SystemExit("❌ 训练集或标定集为空")
+    print(f"✅ 训练样本 {len(samples)}，标定样本 {len(dev_samples)}（正样本目标均值 {np.mean(targets):.3f}）")
+
+    gate = Step1Gate(
+        1 << args.dim_bits, char_ngrams=args.char_ngrams, word_bigrams=not args.no_word_bigrams,
+        gazetteer_path=args.gazetteer,
+    )
+    with metrics.stage("featurize") as st:
+        feats = gate.featurize(samples)
+        dev_feats = gate.featurize(dev_samples)
+        st.rows = len(samples) + len(dev_samples)
+        st.extra["nnz"] = int(len(feats.cols))
+
+    sample_weight = None
+    if args.class_weight == "balanced":
+        y = np.asarray(targets)
+        pos = max(float(y.mean()), 1e-6)
+        sample_weight = np.where(y >= 0.5, 0.5 / pos, 0.5 / max(1 - pos, 1e-6))
+    with metrics.stage("train") as st:
+        losses = gate.fit(
+            feats, targets, sample_weight=sample_weight, epochs=args.epochs, lr=args.lr,
+            l2=args.l2, batch_size=args.batch_size, seed=args.seed,
+        )
+        st.rows = len(samples) * args.epochs
+    print("   log loss: " + " → ".join(f"{x:.4f}" for x in losses))
+
+    with metrics.stage("calibrate") as st:
+        probs = gate.predict_proba(dev_feats)
+        low, high = gate.calibrate(probs, dev_truth, max_miss=args.max_miss, min_precision=args.min_precision)
+        report = band_report(gate, probs, dev_truth)
+        st.rows = len(dev_samples)
+        st.extra.update(report)
+    gate.save(args.model_path)
+    print(f"✅ 置信带 low={low:.4f} high={high:.4f}，模型已保存到 {args.model_path}")
+    print(f"   覆盖率 {report['coverage']:.2%}（交给 LLM {report['escalated']}/{report['n']}），"
+          f"自动判定准确率 {report['auto_accuracy']:.4f}，自动 yes 精确率 {report['auto_yes_precision']:.4f}，"
+          f"漏判率 {report['miss_rate']:.4f}，acc@0.5 {report['accuracy@0.5']:.4f}")
+    metrics.finish()
+
+
+def cmd_apply(args: argparse.Namespace) -> None:
+    metrics = get_metrics("step1_gate.apply")
+    gate = Step1Gate.load(args.model_path, gazetteer_path=args.gazetteer)
+    if args.pair_rule and gate.gazetteer is None:
+        raise SystemExit("❌ --pair_rule 需要词典：训练时使用 --gazetteer 或在此给出 --gazetteer")
+    if args.low is not None:
+        gate.low = args.low
+    if args.high is not None:
+        gate.high = args.high
+
+    decisions: List[Optional[str]] = []
+    escalate_output = json_io.open_writer(args.escalate_path) if args.escalate_path else nullcontext()
+    pair_yes = 0
+    with metrics.stage("apply") as st, escalate_output as escalate_writer:
+        for batch in json_io.chunked(json_io.iter_records(args.input_path), args.batch_size):
+            for sample, d in zip(batch, gate.decide(gate.predict_proba(batch)).tolist()):
+                if d < 0 and args.pair_rule:
+                    hit = gate.gazetteer.scan(sample.get("sentence") or "", sample.get("schema") or [])
+                    if hit["pairs"]:
+                        d = 1
+                        pair_yes += 1
+                decisions.append("yes" if d == 1 else "no" if d == 0 else None)
+                if d < 0 and escalate_writer is not None:
+                    escalate_writer.write(sample)
+        st.rows = len(decisions)
+    json_io.write_json(args.decisions_path, decisions)
+
+    counts = {
+        "yes": decisions.count("yes"), "no": decisions.count("no"), "escalate": decisions.count(None), "pair_yes": pair_yes,
+    }
+    metrics.update(counts, prefix="gate.")
+    total = max(len(decisions), 1)
+    print(f"✅ 门控完成：{len(decisions)} 条，yes {counts['yes']}，no {counts['no']}，"
+          f"交给 LLM {counts['escalate']}（{counts['escalate'] / total:.2%}）")
+    if args.pair_rule:
+        print(f"   其中已知实体对规则判 yes: {pair_yes}")
+    print(f"   判定结果: {args.decisions_path}")
+    if args.escalate_path:
+        print(f"   待 LLM 判定样本: {args.escalate_path}")
+    metrics.finish()
+
+
+def cmd_merge(args: argparse.Namespace) -> None:
+    decisions = json_io.load_json(args.decisions_path)
+    llm = json_io.load_json(args.llm_labels)
+    pending = sum(1 for d in decisions if d is None)
+    if pending != len(llm):
+        raise SystemExit(f"❌ 待 LLM 判定 {pending} 条，但 LLM 结果有 {len(llm)} 条")
+    answers = iter(llm)
+    merged = [d if d is not None else next(answers) for d in decisions]
+    json_io.write_json(args.output_path, merged)
+    print(f"💾 已合并 {len(merged)} 条判定（其中 LLM {pending} 条）到 {args.output_path}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Step-1 CPU gate: hashed n-gram classifier with an LLM escalation band.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("train", help="训练并在 dev 上标定置信带")
+    p.add_argument("--train_data", type=Path, nargs="+", required=True, help="原始样本 (.json/.jsonl/.rcol)")
+    p.add_argument("--llm_labels", type=Path, nargs="*", default=None, help="与 --train_data 一一对应的 LLM yes/no 列表")
+    p.add_argument("--dev_data", type=Path, nargs="*", default=None, help="标定用样本；缺省时从训练集留出")
+    p.add_argument("--dev_llm_labels", type=Path, nargs="*", default=None)
+    p.add_argument("--label_source", choices=["gold", "llm", "mix"], default="mix")
+    p.add_argument("--llm_weight", type=float, default=0.5, help="mix 时 LLM 标签的权重")
+    p.add_argument("--holdout", type=float, default=0.2)
+    p.add_argument("--dim_bits", type=int, default=20, help="哈希空间大小 2^dim_bits")
+    p.add_argument("--char_ngrams", type=int, nargs="+", default=[1, 2, 3])
+    p.add_argument("--no_word_bigrams", action="store_true")
+    p.add_argument("--gazetteer", type=Path, default=None, help="gazetteer.py 构建的词典，提供实体提及特征")
+    p.add_argument("--epochs", type=int, default=5)
+    p.add_argument("--lr", type=float, default=0.1)
+    p.add_argument("--l2", type=float, default=1e-6)
+    p.add_argument("--batch_size", type=int, default=1024)
+    p.add_argument("--class_weight", choices=["none", "balanced"], default="none")
+    p.add_argument("--max_miss", type=float, default=0.02, help="允许被自动判 no 的正样本比例")
+    p.add_argument("--min_precision", type=float, default=0.9, help="自动判 yes 的最低精确率")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--model_path", type=Path, required=True)
+
+    p = sub.add_parser("apply", help="对数据做门控，输出判定与待 LLM 判定的样本")
+    p.add_argument("--model_path", type=Path, required=True)
+    p.add_argument("--input_path", type=Path, required=True)
+    p.add_argument("--decisions_path", type=Path, required=True, help='与输入对齐的 "yes"/"no"/null 列表')
+    p.add_argument("--escalate_path", type=Path, default=None, help="置信带内的样本，交给 step1_convert.py")
+    p.add_argument("--low", type=float, default=None, help="覆盖模型中的 low")
+    p.add_argument("--high", type=float, default=None, help="覆盖模型中的 high")
+    p.add_argument("--gazetteer", type=Path, default=None, help="覆盖模型记录的词典路径")
+    p.add_argument("--pair_rule", action="store_true", help="置信带内出现 schema 内已知实体对的样本直接判 yes")
+    p.add_argument("--batch_size", type=int, default=65536)
+
+    p = sub.add_parser("merge", help="用 LLM 对 escalate 样本的判定填回门控结果")
+    p.add_argument("--decisions_path", type=Path, required=True)
+    p.add_argument("--llm_labels", type=Path, required=True, help="extract_step1.py 对 escalate 样本的输出")
+    p.add_argument("--output_path", type=Path, required=True)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    {"train": cmd_train, "apply": cmd_apply, "merge": cmd_merge}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
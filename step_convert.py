@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Step-1 / Step-2 前置过滤数据的通用转换引擎
+
+step1_convert.py（宽松 prompt，透传 output）与 step2_convert.py（严格 prompt，yes/no 标签）
+只负责定义各自的 system prompt 和标签函数，流式读取、进程池格式化（保序）、写出都在这里完成。
+
+--prompt_ref 模式下每行只写 "system_id"（如 "step2_en"），完整 prompt 只在
+<output>.prompts.json 中保存一次；喂给 LLaMA-Factory 前用 `expand` 子命令还原 "system" 字段。
+"""
+
+import argparse
+import re
+from collections import Counter
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import json_io
+from generation_budget import STEP_BUDGET
+from metrics import get_metrics
+
+
+class LanguageDetector:
+    def detect_language(self, sentence: str, threshold: float = 0.5) -> str:
+        text = sentence or ""
+        text = re.sub(r'[\d\W_]+', '', text)
+        if not text:
+            return "unknown"
+        chinese_chars = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+        latin_chars = sum(1 for ch in text if ch.isascii() and ch.isalpha())
+        total = chinese_chars + latin_chars
+        if total == 0:
+            return "unknown"
+        ratio = chinese_chars / total
+        return "zh" if ratio >= threshold else "en"
+
+
+class StepVariant:
+    """一个过滤步骤：名称 + 中英文 system prompt + 标签函数。"""
+
+    def __init__(self, name: str, prompt_zh: str, prompt_en: str, label_fn: Callable[[Dict[str, Any]], Any]):
+        self.name = name
+        self.prompts = {f"{name}_zh": prompt_zh, f"{name}_en": prompt_en}
+        self.label_fn = label_fn
+
+    def prompt_id(self, lang: str) -> str:
+        return f"{self.name}_zh" if lang == "zh" else f"{self.name}_en"
+
+
+_DETECTOR = LanguageDetector()
+
+
+def format_step_item(
+    item: Dict[str, Any], variant: StepVariant, *, prompt_ref: bool = False, budget: Optional[int] = None
+) -> Dict[str, Any]:
+    sentence = item["sentence"]
+    lang = _DETECTOR.detect_language(sentence, threshold=0.5)
+
+    # 选择 input 的语言引导词
+    if lang == "zh":
+        prefix_sentence = "句子"
+        prefix_relations = "关系候选"
+        prefix_coarse = "实体粗类型候选"
+    else:
+        prefix_sentence = "Sentence"
+        prefix_relations = "Relation candidates"
+        prefix_coarse = "Entity coarse type candidates"
+
+    # 构造 input（保持 schema 和 coarse_types 原样）
+    relations = "、".join(item["schema"])
+    coarse_types = "、".join(item["coarse_types"])
+
+    input_text = (
+        f"{prefix_sentence}：{sentence}\n"
+        f"{prefix_relations}：{relations}\n"
+        f"{prefix_coarse}：{coarse_types}"
+    )
+
+    prompt_id = variant.prompt_id(lang)
+    row: Dict[str, Any] = {"system_id": prompt_id} if prompt_ref else {"system": variant.prompts[prompt_id]}
+    row.update({
+        "instruction": "",
+        "input": input_text,
+        "output": variant.label_fn(item),
+        "history": [],
+    })
+    if budget is not None:
+        # yes/no 只需几个 token（generation_budget.STEP_BUDGET），供 budgeted_infer.py 按行设置 max_new_tokens
+        row["max_new_tokens"] = budget
+    return row
+
+
+def _format_chunk(
+    chunk: List[Dict[str, Any]], variant: StepVariant, prompt_ref: bool, budget: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    return [format_step_item(item, variant, prompt_ref=prompt_ref, budget=budget) for item in chunk]
+
+
+def iter_step_rows(
+    rows: Iterable[Dict[str, Any]],
+    variant: StepVariant,
+    *,
+    prompt_ref: bool = False,
+    workers: int = 1,
+    chunk_size: int = 2000,
+    budget: Optional[int] = None,
+) -> Iterator[Dict[str, Any]]:
+    """逐条产出转换结果；workers > 1 时按 chunk 并行格式化，输出顺序与输入一致。"""
+    formatter = partial(_format_chunk, variant=variant, prompt_ref=prompt_ref, budget=budget)
+    chunks = json_io.chunked(rows, chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield from formatter(chunk)
+        return
+    import multiprocessing
+
+    with multiprocessing.Pool(processes=workers) as pool:
+        for formatted in pool.imap(formatter, chunks):
+            yield from formatted
+
+
+def prompts_path_for(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + ".prompts.json")
+
+
+def convert_file(
+    variant: StepVariant,
+    input_path: Path,
+    output_path: Path,
+    *,
+    prompt_ref: bool = False,
+    workers: int = 1,
+    chunk_size: int = 2000,
+    budget: Optional[int] = None,
+) -> Counter:
+    """流式转换整个文件，返回标签计数。"""
+    stats: Counter = Counter()
+
+    def counted(rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        for row in rows:
+            stats["total"] += 1
+            if row["output"] == "yes":
+                stats["yes"] += 1
+            yield row
+
+    rows = iter_step_rows(
+        json_io.iter_records(input_path),
+        variant,
+        prompt_ref=prompt_ref,
+        workers=workers,
+        chunk_size=chunk_size,
+        budget=budget,
+    )
+    from tqdm import tqdm
+
+    rows = tqdm(counted(rows), desc=f"Converting ({variant.name})", unit="row")
+
+    if output_path.suffix.lower() == ".rcol":
+        from columnar_store import write_columnar
+
+        write_columnar(output_path, rows)
+    else:
+        with json_io.open_writer(output_path) as writer:
+            writer.write_many(rows)
+
+    if prompt_ref:
+        json_io.write_json(prompts_path_for(output_path), variant.prompts)
+    return stats
+
+
+def expand_prompt_refs(input_path: Path, output_path: Path, prompts_path: Optional[Path] = None) -> int:
+    """把 system_id 还原成完整的 system 字段，生成 LLaMA-Factory 可直接读取的文件。"""
+    prompts = json_io.load_json(prompts_path or prompts_path_for(input_path))
+
+    def expanded() -> Iterator[Dict[str, Any]]:
+        for row in json_io.iter_records(input_path):
+            if "system_id" in row:
+                row = {"system": prompts[row["system_id"]], **{k: v for k, v in row.items() if k != "system_id"}}
+            yield row
+
+    with json_io.open_writer(output_path) as writer:
+        writer.write_many(expanded())
+        return writer.count
+
+
+def run_cli(variant: StepVariant, *, default_input: str, default_output: str, argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=f"{variant.name} 前置过滤数据转换")
+    sub = parser.add_subparsers(dest="command")
+
+    p_expand = sub.add_parser("expand", help="将 system_id 还原为完整 system prompt")
+    p_expand.add_argument("--input_path", type=Path, required=True)
+    p_expand.add_argument("--output_path", type=Path, required=True)
+    p_expand.add_argument("--prompts_path", type=Path, default=None, help="默认为 <input_path>.prompts.json")
+
+    parser.add_argument("--input_path", type=Path, default=Path(default_input), help="原始数据 (.json/.jsonl/.rcol)")
+    parser.add_argument("--output_path", type=Path, default=Path(default_output), help="输出路径 (.json/.jsonl/.rcol)")
+    parser.add_argument("--workers", type=int, default=1, help="格式化进程数")
+    parser.add_argument("--chunk_size", type=int, default=2000, help="每个进程任务的样本数")
+    parser.add_argument("--prompt_ref", action="store_true", help="每行只写 system_id，prompt 另存一份")
+    parser.add_argument("--attach_budget", action="store_true",
+                        help="每行写入 max_new_tokens（yes/no 只需几个 token），供 budgeted_infer.py 使用")
+    parser.add_argument("--tokenizer", type=str, default=None, help="同时写出预分词缓存（token_cache.py）")
+    parser.add_argument("--template", type=str, default="llama3", help="--tokenizer 使用的对话模板")
+    args = parser.parse_args(argv)
+
+    if args.command == "expand":
+        n = expand_prompt_refs(args.input_path, args.output_path, args.prompts_path)
+        print(f"💾 已还原 {n} 条样本到 {args.output_path}")
+        return
+
+    metrics = get_metrics(f"{variant.name}_convert")
+    with metrics.stage("convert") as st:
+        stats = convert_file(
+            variant,
+            args.input_path,
+            args.output_path,
+            prompt_ref=args.prompt_ref,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            budget=STEP_BUDGET if args.attach_budget else None,
+        )
+        st.rows = stats["total"]
+        st.extra["workers"] = args.workers
+    metrics.update({"yes": stats["yes"], "no": stats["total"] - stats["yes"]}, prefix="label.")
+    print(f"✅ 转换完成！")
+    print(f"   总样本: {stats['total']}")
+    print(f"   正样本（yes）: {stats['yes']}")
+    print(f"   负样本（no）: {stats['total'] - stats['yes']}")
+    print(f"   输出文件: {args.output_path}")
+    if args.prompt_ref:
+        print(f"   Prompt 表: {prompts_path_for(args.output_path)}")
+    if args.tokenizer:
+        from token_cache import build_cache, load_tokenizer
+
+        # system prompt 只有中英文两种，按文本缓存后每种只分词一次
+        with metrics.stage("tokenize") as st:
+            cache_dir = build_cache(
+                args.output_path, load_tokenizer(args.tokenizer), tokenizer_name=args.tokenizer,
+                template=args.template, prompts=variant.prompts if args.prompt_ref else None, verify=100,
+            )
+            st.rows = stats["total"]
+        print(f"   预分词缓存: {cache_dir}")
+    metrics.finish()
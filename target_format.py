@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+训练目标 / 生成结果的紧凑序列化
+
+json（默认）：[{"subject":["隋文帝","人","君主"],"relationship":"父亲","object":["杨忠","人","君主"]}]
+compact：每行一个三元组，7 个字段以 | 分隔，省去重复的键名与括号引号：
+  隋文帝|人|君主|父亲|杨忠|人|君主
+  无三元组时输出 []
+
+- 字段内的 \\、| 与换行转义为 \\\\、\\| 与 \\n，解码后与原 JSON 完全一致
+- 不符合 7 字段结构的样本（缺字段、多余键等）编码时自动退回 JSON，保证无损
+- decode_target 同时接受两种格式，get_predict.extract_output 据此解析模型输出
+
+用法（统计目标长度并校验往返无损）:
+  python target_format.py stats --data_path data/dev2.json
+  python target_format.py stats --data_path data/dev2.json --tokenizer /root/autodl-tmp/Llama-3.1-8B-Instruct
+"""
+
+import argparse
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import json_io
+
+TARGET_FORMATS = ("json", "compact")
+
+_SEP = "|"
+_FIELDS = 7
+_TRIPLE_KEYS = ["subject", "relationship", "object"]
+# 未转义的 |
+_SPLIT = re.compile(r"(?<!\\)((?:\\\\)*)\|")
+_UNESCAPE = re.compile(r"\\(.)")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("|", "\\|").replace("\n", "\\n")
+
+
+def _unescape(value: str) -> str:
+    return _UNESCAPE.sub(lambda m: "\n" if m.group(1) == "n" else m.group(1), value)
+
+
+def _split_fields(line: str) -> List[str]:
+    fields, start = [], 0
+    for match in _SPLIT.finditer(line):
+        end = match.end(1)
+        fields.append(line[start:end])
+        start = match.end()
+    fields.append(line[start:])
+    return [_unescape(f) for f in fields]
+
+
+def _is_field(value: Any) -> bool:
+    # 解码时会去掉字段两端空白（兼容模型生成的 " | "），带首尾空白的字段无法无损表示
+    return isinstance(value, str) and value == value.strip()
+
+
+def _is_entity(value: Any) -> bool:
+    return isinstance(value, list) and len(value) == 3 and all(_is_field(v) for v in value)
+
+
+def is_compact_safe(output: Any) -> bool:
+    """output 中每个三元组都恰为 subject / relationship / object 且实体为 3 个字符串时，compact 可无损表示。"""
+    if not isinstance(output, list):
+        return False
+    for triple in output:
+        if not isinstance(triple, dict) or list(triple) != _TRIPLE_KEYS:
+            return False
+        if not (_is_entity(triple["subject"]) and _is_entity(triple["object"]) and _is_field(triple["relationship"])):
+            return False
+    return True
+
+
+def encode_compact(output: List[Dict[str, Any]]) -> str:
+    if not is_compact_safe(output):
+        raise ValueError("output cannot be represented losslessly in the compact format")
+    if not output:
+        return "[]"
+    lines = []
+    for triple in output:
+        fields = [*triple["subject"], triple["relationship"], *triple["object"]]
+        lines.append(_SEP.join(_escape(f) for f in fields))
+    return "\n".join(lines)
+
+
+def encode_target(output: Any, target_format: str = "json", *, ensure_ascii: bool = False) -> str:
+    """按 target_format 序列化 output；compact 无法无损表示时退回紧凑 JSON。"""
+    if target_format == "compact" and is_compact_safe(output):
+        return encode_compact(output)
+    if target_format not in TARGET_FORMATS:
+        raise ValueError(f"Unknown target format: {target_format}")
+    return json.dumps(output, ensure_ascii=ensure_ascii, separators=(',', ':'))
+
+
+def looks_compact(text: str) -> bool:
+    """不以 JSON 括号开头、且含字段分隔符的文本按 compact 解析。"""
+    stripped = text.lstrip()
+    return bool(stripped) and stripped[0] not in "[{" and _SEP in stripped
+
+
+def decode_compact(text: str, *, strict: bool = False) -> List[Dict[str, Any]]:
+    """
+    逐行还原三元组；空行与 [] 忽略。字段数不为 7 的行默认跳过（生成被截断等），strict=True 时抛 ValueError。
+    """
+    triples = []
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line or line == "[]":
+            continue
+        fields = _split_fields(line)
+        if len(fields) != _FIELDS:
+            if strict:
+                raise ValueError(f"Expected {_FIELDS} fields, got {len(fields)}: {line!r}")
+            continue
+        fields = [f.strip() for f in fields]
+        triples.append({"subject": fields[0:3], "relationship": fields[3], "object": fields[4:7]})
+    return triples
+
+
+def decode_target(text: str) -> List[Dict[str, Any]]:
+    """两种格式都接受：compact 逐行解析，其余按 JSON 解析。"""
+    if looks_compact(text):
+        return decode_compact(text)
+    value = json.loads(text)
+    return value if isinstance(value, list) else [value]
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def _load_tokenizer(name: Optional[str]):
+    if not name:
+        return None
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compact triple target format: size statistics and round-trip check.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("stats", help="比较 json / compact 目标长度，并校验往返无损")
+    p.add_argument("--data_path", type=Path, required=True, help="带 output 的数据 (.json/.jsonl/.rcol)")
+    p.add_argument("--tokenizer", type=str, default=None, help="给出时同时统计 token 数（需要 transformers）")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    from metrics import get_metrics
+
+    metrics = get_metrics("target_format.stats")
+    tokenizer = _load_tokenizer(args.tokenizer)
+    totals = {"rows": 0, "fallback": 0, "mismatch": 0, "json_chars": 0, "compact_chars": 0,
+              "json_tokens": 0, "compact_tokens": 0}
+    with metrics.stage("stats") as st:
+        for sample in json_io.iter_records(args.data_path):
+            output = sample.get("output", [])
+            as_json = encode_target(output, "json")
+            as_compact = encode_target(output, "compact")
+            totals["rows"] += 1
+            totals["fallback"] += not is_compact_safe(output)
+            totals["mismatch"] += decode_target(as_compact) != output
+            totals["json_chars"] += len(as_json)
+            totals["compact_chars"] += len(as_compact)
+            if tokenizer is not None:
+                totals["json_tokens"] += len(tokenizer.encode(as_json, add_special_tokens=False))
+                totals["compact_tokens"] += len(tokenizer.encode(as_compact, add_special_tokens=False))
+        st.rows = totals["rows"]
+    metrics.update(totals, prefix="target.")
+
+    n = max(totals["rows"], 1)
+    print(f"✅ {totals['rows']} 条样本，退回 JSON {totals['fallback']} 条，往返不一致 {totals['mismatch']} 条")
+    print(f"   平均字符数 json {totals['json_chars'] / n:.1f} → compact {totals['compact_chars'] / n:.1f}"
+          f"（{1 - totals['compact_chars'] / max(totals['json_chars'], 1):.1%} 减少）")
+    if tokenizer is not None:
+        print(f"   平均 token 数 json {totals['json_tokens'] / n:.1f} → compact {totals['compact_tokens'] / n:.1f}"
+              f"（{1 - totals['compact_tokens'] / max(totals['json_tokens'], 1):.1%} 减少）")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()
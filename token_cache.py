@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+预分词缓存：转换结果 → token id 数组，训练 / 评测的重复运行不再重新分词
+
+目录结构（按 tokenizer 指纹区分，换 tokenizer 不会误用旧缓存）:
+  <data>.tok/<fingerprint>/meta.json        tokenizer、模板、源文件大小 / mtime、行数
+  <data>.tok/<fingerprint>/input_ids.i32    所有行拼接的 int32 token id，numpy.memmap 只读映射
+  <data>.tok/<fingerprint>/offsets.i64      行 i 的 token 为 input_ids[offsets[i]:offsets[i + 1]]
+  <data>.tok/<fingerprint>/prompt_lens.i32  assistant 回复之前的 token 数（labels 中这部分为 -100）
+
+- 按 LLaMA-Factory llama3 模板拼接 system / user / assistant；特殊 token 是 BPE 的天然边界，
+  各段分别分词后直接拼接与整段分词结果一致
+- system prompt（每行相同的长 prompt）和 user 内容中的各段（任务说明、每个 RAG 示例等）按文本缓存，
+  同一文本只分词一次；--verify 抽样与整段分词比对，不一致时可用 --no_split_blocks 只缓存 system 段
+- 精确的行长度供打包 / 分桶使用（pack_planner 等）；export-hf 写出 LLaMA-Factory --tokenized_path 可直接加载的数据集
+
+用法:
+  python token_cache.py build --data_path data/train2_converted.json --tokenizer /root/autodl-tmp/Llama-3.1-8B-Instruct
+  python token_cache.py info --data_path data/train2_converted.json --tokenizer ... --cutoff_len 2048
+  python token_cache.py export-hf --data_path data/train2_converted.json --tokenizer ... \
+      --output_dir saves/tokenized/train2 --cutoff_len 2048
+转换脚本加 --tokenizer 时在写出后自动建缓存。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import json_io
+
+if TYPE_CHECKING:
+    import numpy as np
+
+PathLike = Union[str, Path]
+
+# LLaMA-Factory 的 llama3 模板（system 只出现在第一轮之前）
+TEMPLATES: Dict[str, Dict[str, str]] = {
+    "llama3": {
+        "prefix": "<|begin_of_text|>",
+        "system": "<|start_header_id|>system<|end_header_id|>\n\n{content}<|eot_id|>",
+        "user": "<|start_header_id|>user<|end_header_id|>\n\n",
+        "user_end": "<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n",
+        "assistant": "{content}<|eot_id|>",
+    },
+}
+
+# 在 conver_train_for_lora.py prompt 的段落标题（#… / Example N: / 示例N：）所在行首切块；
+# 换行在 llama3 预分词中总是归入前一段，切点两侧的 token 与整段分词一致
+_BLOCK_SPLIT = re.compile(r"(?<=\n)(?=#|Example \d+:|示例\d+：)")
+
+
+def tokenizer_fingerprint(tokenizer: Any, template: str) -> str:
+    """词表 / 合并规则 / 特殊 token 与模板名的 sha1 前 12 位。"""
+    digest = hashlib.sha1(template.encode("utf-8"))
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        digest.update(backend.to_str().encode("utf-8"))
+    else:
+        digest.update(json.dumps(sorted(tokenizer.get_vocab().items()), ensure_ascii=False).encode("utf-8"))
+    digest.update(json.dumps(getattr(tokenizer, "all_special_tokens", []), ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def cache_dir_for(data_path: PathLike, fingerprint: str) -> Path:
+    data_path = Path(data_path)
+    return data_path.with_name(data_path.name + ".tok") / fingerprint
+
+
+def user_query(row: Dict[str, Any]) -> str:
+    """与 LLaMA-Factory alpaca 格式一致：instruction 与 input 以换行拼接。"""
+    return "\n".join(part for part in (row.get("instruction"), row.get("input")) if part)
+
+
+class SegmentEncoder:
+    """按文本缓存的分词：同一段文本只调用一次 tokenizer，未命中的段成批分词。"""
+
+    def __init__(self, tokenizer: Any, maxsize: int = 65536):
+        self.tokenizer = tokenizer
+        self.maxsize = maxsize
+        self._cache: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.lookups = 0
+        self.tokenized = 0
+
+    def prefetch(self, texts: Iterable[str]) -> None:
+        missing = list(dict.fromkeys(t for t in texts if t not in self._cache))
+        if not missing:
+            return
+        encoded = self.tokenizer(missing, add_special_tokens=False)["input_ids"]
+        self.tokenized += len(missing)
+        for text, ids in zip(missing, encoded):
+            self._cache[text] = ids
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def encode(self, text: str) -> List[int]:
+        self.lookups += 1
+        ids = self._cache.get(text)
+        if ids is None:
+            self.tokenized += 1
+            ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+            self._cache[text] = ids
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(text)
+        return ids
+
+
+def row_segments(
+    row: Dict[str, Any], template: Dict[str, str], prompts: Optional[Dict[str, str]] = None, *, split_blocks: bool = True
+) -> Tuple[List[str], List[str], str]:
+    """
+    一行拆成 (可缓存的 prompt 段, 不缓存的 prompt 段, assistant 段)。
+    返回的段按顺序拼接即为完整文本；第二项为空表示所有 prompt 段都走缓存。
+    """
+    system = row.get("system")
+    if system is None and "system_id" in row:
+        if prompts is None:
+            raise ValueError("Row has system_id but no prompts were given (step_convert.py --prompt_ref).")
+        system = prompts[row["system_id"]]
+
+    cached = [template["prefix"] + (template["system"].format(content=system) if system else "")]
+    uncached: List[str] = []
+    for user, assistant in row.get("history") or []:
+        uncached.append(template["user"] + user + template["user_end"] + template["assistant"].format(content=assistant))
+    query = user_query(row)
+    blocks = _BLOCK_SPLIT.split(query) if split_blocks else [query]
+    tail = [template["user"], *blocks, template["user_end"]]
+    if uncached:
+        # 有历史轮次时段顺序为 system, history, user，全部放进 uncached 以保持顺序
+        uncached.extend(tail)
+    else:
+        cached.extend(tail)
+    output = row.get("output", "")
+    if not isinstance(output, str):
+        output = json.dumps(output, ensure_ascii=False)
+    return cached, uncached, template["assistant"].format(content=output)
+
+
+def _encode_row(
+    encoder: SegmentEncoder, segments: Tuple[List[str], List[str], str]
+) -> Tuple[List[int], int]:
+    cached, uncached, answer = segments
+    ids: List[int] = []
+    for text in cached:
+        ids.extend(encoder.encode(text))
+    for text in uncached:
+        ids.extend(encoder.tokenizer(text, add_special_tokens=False)["input_ids"])
+    prompt_len = len(ids)
+    ids.extend(encoder.tokenizer(answer, add_special_tokens=False)["input_ids"])
+    return ids, prompt_len
+
+
+def build_cache(
+    data_path: PathLike,
+    tokenizer: Any,
+    *,
+    tokenizer_name: str = "",
+    template: str = "llama3",
+    prompts: Optional[Dict[str, str]] = None,
+    split_blocks: bool = True,
+    chunk_size: int = 1024,
+    verify: int = 0,
+) -> Path:
+    """分词 data_path 的所有行并写出缓存目录；返回目录路径。"""
+    import numpy as np
+
+    spec = TEMPLATES[template]
+    data_path = Path(data_path)
+    stat = data_path.stat()
+    cache_dir = cache_dir_for(data_path, tokenizer_fingerprint(tokenizer, template))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    encoder = SegmentEncoder(tokenizer)
+
+    rows = json_io.iter_records(data_path)
+    offsets = [0]
+    prompt_lens: List[int] = []
+    mismatches = 0
+    # 先写临时文件，完整写完后再改名，中途失败不会留下半截缓存
+    with (cache_dir / "input_ids.i32.tmp").open("wb") as fp:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            segments = [row_segments(row, spec, prompts, split_blocks=split_blocks) for row in chunk]
+            encoder.prefetch(text for cached, _, _ in segments for text in cached)
+            for segs in segments:
+                ids, prompt_len = _encode_row(encoder, segs)
+                if len(prompt_lens) < verify:
+                    full = "".join(segs[0]) + "".join(segs[1]) + segs[2]
+                    mismatches += ids != tokenizer(full, add_special_tokens=False)["input_ids"]
+                fp.write(np.asarray(ids, dtype=np.int32).tobytes())
+                offsets.append(offsets[-1] + len(ids))
+                prompt_lens.append(prompt_len)
+    if mismatches:
+        (cache_dir / "input_ids.i32.tmp").unlink()
+        raise ValueError(
+            f"Spliced token ids differ from whole-text tokenization in {mismatches}/{verify} rows; "
+            "rebuild with --no_split_blocks."
+        )
+
+    np.asarray(offsets, dtype=np.int64).tofile(cache_dir / "offsets.i64")
+    np.asarray(prompt_lens, dtype=np.int32).tofile(cache_dir / "prompt_lens.i32")
+    os.replace(cache_dir / "input_ids.i32.tmp", cache_dir / "input_ids.i32")
+    json_io.write_json(cache_dir / "meta.json", {
+        "tokenizer": tokenizer_name,
+        "template": template,
+        "split_blocks": split_blocks,
+        "source": str(data_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "rows": len(prompt_lens),
+        "tokens": offsets[-1],
+        "segment_cache": {"lookups": encoder.lookups, "tokenized": encoder.tokenized},
+    })
+    return cache_dir
+
+
+class TokenCache:
+    """只读的预分词缓存：tokens(i) / prompt_len(i) / lengths 均来自 memmap，不做任何分词。"""
+
+    def __init__(self, cache_dir: PathLike):
+        import numpy as np
+
+        self.cache_dir = Path(cache_dir)
+        self.meta = json_io.load_json(self.cache_dir / "meta.json")
+        self.offsets = np.fromfile(self.cache_dir / "offsets.i64", dtype=np.int64)
+        self.prompt_lens = np.fromfile(self.cache_dir / "prompt_lens.i32", dtype=np.int32)
+        if self.meta["tokens"]:
+            self.input_ids = np.memmap(self.cache_dir / "input_ids.i32", dtype=np.int32, mode="r")
+        else:
+            self.input_ids = np.empty(0, dtype=np.int32)
+
+    def __len__(self) -> int:
+        return len(self.prompt_lens)
+
+    def tokens(self, index: int) -> "np.ndarray":
+        return self.input_ids[self.offsets[index]:self.offsets[index + 1]]
+
+    def prompt_len(self, index: int) -> int:
+        return int(self.prompt_lens[index])
+
+    @property
+    def lengths(self) -> "np.ndarray":
+        """每行的精确 token 数。"""
+        return self.offsets[1:] - self.offsets[:-1]
+
+    def labels(self, index: int) -> "np.ndarray":
+        labels = self.tokens(index).copy()
+        labels[:self.prompt_len(index)] = -100
+        return labels
+
+    def example(self, index: int, cutoff_len: int) -> Tuple[List[int], List[int]]:
+        """按 cutoff_len 截断后的 (input_ids, labels)，截断后长度恰为 min(行长度, cutoff_len)。"""
+        ids = self.tokens(index).tolist()
+        split = self.prompt_len(index)
+        source_len, target_len = infer_seqlen(split, len(ids) - split, cutoff_len)
+        target = ids[split:split + target_len]
+        return ids[:source_len] + target, [-100] * source_len + target
+
+    def is_fresh(self, data_path: PathLike) -> bool:
+        stat = Path(data_path).stat()
+        return self.meta["size"] == stat.st_size and self.meta["mtime_ns"] == stat.st_mtime_ns
+
+
+def open_cache(data_path: PathLike, tokenizer: Any, template: str = "llama3") -> Optional[TokenCache]:
+    """返回与 data_path 当前内容、tokenizer 一致的缓存；不存在或已过期时返回 None。"""
+    cache_dir = cache_dir_for(data_path, tokenizer_fingerprint(tokenizer, template))
+    if not (cache_dir / "meta.json").exists():
+        return None
+    cache = TokenCache(cache_dir)
+    return cache if cache.is_fresh(data_path) else None
+
+
+def infer_seqlen(source_len: int, target_len: int, cutoff_len: int) -> Tuple[int, int]:
+    """与 LLaMA-Factory 相同的截断规则：按长度比例分配 prompt 与回复的长度上限。"""
+    if target_len * 2 < cutoff_len:
+        max_target_len = cutoff_len
+    elif source_len * 2 < cutoff_len:
+        max_target_len = cutoff_len - source_len
+    else:
+        max_target_len = int(cutoff_len * (target_len / (source_len + target_len)))
+    new_target_len = min(max_target_len, target_len)
+    new_source_len = min(max(cutoff_len - new_target_len, 0), source_len)
+    return new_source_len, new_target_len
+
+
+def export_hf(cache: TokenCache, output_dir: PathLike, cutoff_len: int) -> int:
+    """写出 input_ids / attention_mask / labels 数据集（datasets.save_to_disk），供 --tokenized_path 加载。"""
+    from datasets import Dataset
+
+    def examples():
+        for i in range(len(cache)):
+            input_ids, labels = cache.example(i, cutoff_len)
+            yield {"input_ids": input_ids, "attention_mask": [1] * len(input_ids), "labels": labels}
+
+    dataset = Dataset.from_generator(examples)
+    dataset.save_to_disk(str(output_dir))
+    return len(dataset)
+
+
+# ----------------------------
+# 命令行
+# ----------------------------
+
+def load_tokenizer(name: str):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pre-tokenized token-id cache for converted SFT data.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p: argparse.ArgumentParser) -> None:
+        p.add_argument("--data_path", type=Path, required=True, help="转换结果 (.json/.jsonl/.rcol)")
+        p.add_argument("--tokenizer", type=str, required=True)
+        p.add_argument("--template", choices=sorted(TEMPLATES), default="llama3")
+
+    p = sub.add_parser("build", help="分词并写出缓存")
+    common(p)
+    p.add_argument("--prompts_path", type=Path, default=None, help="step_convert.py --prompt_ref 的 prompt 表")
+    p.add_argument("--no_split_blocks", action="store_true", help="user 内容整段分词，只缓存 system 段")
+    p.add_argument("--chunk_size", type=int, default=1024)
+    p.add_argument("--verify", type=int, default=100, help="前 N 行与整段分词比对")
+
+    p = sub.add_parser("info", help="长度统计")
+    common(p)
+    p.add_argument("--cutoff_len", type=int, default=2048)
+
+    p = sub.add_parser("export-hf", help="写出 LLaMA-Factory --tokenized_path 数据集（需要 datasets）")
+    common(p)
+    p.add_argument("--output_dir", type=Path, required=True)
+    p.add_argument("--cutoff_len", type=int, default=2048)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    from metrics import get_metrics
+
+    metrics = get_metrics(f"token_cache.{args.command}")
+    tokenizer = load_tokenizer(args.tokenizer)
+    if args.command == "build":
+        prompts = json_io.load_json(args.prompts_path) if args.prompts_path else None
+        with metrics.stage("tokenize") as st:
+            cache_dir = build_cache(
+                args.data_path, tokenizer, tokenizer_name=args.tokenizer, template=args.template, prompts=prompts,
+                split_blocks=not args.no_split_blocks, chunk_size=args.chunk_size, verify=args.verify,
+            )
+            meta = json_io.load_json(cache_dir / "meta.json")
+            st.rows = meta["rows"]
+            st.extra.update(meta["segment_cache"])
+        segs = meta["segment_cache"]
+        print(f"✅ {meta['rows']} 行，{meta['tokens']} 个 token；可缓存段 {segs['lookups']} 个，"
+              f"实际分词 {segs['tokenized']} 个")
+        print(f"💾 已保存到 {cache_dir}")
+        metrics.finish()
+        return
+
+    cache = open_cache(args.data_path, tokenizer, args.template)
+    if cache is None:
+        raise SystemExit(f"❌ {args.data_path} 没有与该 tokenizer 匹配的最新缓存，请先运行 build")
+    if args.command == "info":
+        import numpy as np
+
+        lengths = cache.lengths
+        print(f"✅ {len(cache)} 行，token 总数 {int(lengths.sum())}")
+        if len(cache):
+            print(f"   长度 均值 {lengths.mean():.1f}  p50 {np.percentile(lengths, 50):.0f}  "
+                  f"p99 {np.percentile(lengths, 99):.0f}  最大 {lengths.max()}")
+            print(f"   超过 cutoff_len={args.cutoff_len}: {int((lengths > args.cutoff_len).sum())} 行")
+    else:
+        with metrics.stage("export") as st:
+            st.rows = export_hf(cache, args.output_dir, args.cutoff_len)
+        print(f"💾 {st.rows} 行已写出到 {args.output_dir}（LLaMA-Factory --tokenized_path）")
+    metrics.finish()
+
+
+if __name__ == "__main__":
+    main()